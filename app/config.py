@@ -49,9 +49,64 @@ class Settings(BaseSettings):
         else:
             return "https://api.openai.com/v1/chat/completions"
 
+    # Cliente HTTP para el LLM (uno por worker, conexiones keep-alive)
+    LLM_HTTP_MAX_CONNECTIONS: int = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "20"))
+    LLM_HTTP_MAX_KEEPALIVE: int = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "10"))
+    LLM_HTTP_KEEPALIVE_EXPIRY: float = float(
+        os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", "60")
+    )
+    LLM_HTTP_TIMEOUT: float = float(os.getenv("LLM_HTTP_TIMEOUT", "90"))
+    LLM_HTTP_POOL_TIMEOUT: float = float(os.getenv("LLM_HTTP_POOL_TIMEOUT", "30"))
+    LLM_HTTP2: bool = os.getenv("LLM_HTTP2", "True").lower() in ("true", "1", "t")
+    # Pedir `usage` al final del stream (tokens de prompt cacheados por el proveedor)
+    LLM_STREAM_INCLUDE_USAGE: bool = os.getenv(
+        "LLM_STREAM_INCLUDE_USAGE", "True"
+    ).lower() in ("true", "1", "t")
+
+    # Ensamblado del prompt maestro
+    # "targeted": solo la sección del cuestionario del sector/subsector actual
+    # "full": cuestionario completo y formato de propuesta en cada turno
+    PROMPT_ASSEMBLY_MODE: str = os.getenv("PROMPT_ASSEMBLY_MODE", "targeted")
+    PROMPT_TOKEN_BUDGET: int = int(os.getenv("PROMPT_TOKEN_BUDGET", "8000"))
+    PROMPT_NEARBY_QUESTIONS: int = int(os.getenv("PROMPT_NEARBY_QUESTIONS", "3"))
+    # Mínimo de tokens que el proveedor exige para cachear el prefijo del prompt
+    PROMPT_CACHE_MIN_TOKENS: int = int(os.getenv("PROMPT_CACHE_MIN_TOKENS", "1024"))
+    # Segundos entre comprobaciones de mtime de los archivos del prompt
+    PROMPT_ASSET_CHECK_INTERVAL: float = float(
+        os.getenv("PROMPT_ASSET_CHECK_INTERVAL", "5")
+    )
+
+    # Historial enviado al LLM: presupuesto de tokens + resumen incremental de lo antiguo
+    HISTORY_TOKEN_BUDGET: int = int(os.getenv("HISTORY_TOKEN_BUDGET", "3000"))
+    HISTORY_MIN_RECENT_MSGS: int = int(os.getenv("HISTORY_MIN_RECENT_MSGS", "2"))
+    # Al compactar, dejar los mensajes recientes en esta fracción del presupuesto
+    # (así el resumen no se regenera en cada turno)
+    HISTORY_SUMMARY_KEEP_RATIO: float = float(
+        os.getenv("HISTORY_SUMMARY_KEEP_RATIO", "0.5")
+    )
+    HISTORY_SUMMARY_MAX_TOKENS: int = int(os.getenv("HISTORY_SUMMARY_MAX_TOKENS", "400"))
+
+    # Renderizado de PDF fuera del event loop (pool de procesos por worker)
+    # PDF_RENDER_WORKERS=0 renderiza en un hilo en lugar de en procesos
+    PDF_RENDER_WORKERS: int = int(os.getenv("PDF_RENDER_WORKERS", "2"))
+    PDF_RENDER_MAX_QUEUE: int = int(os.getenv("PDF_RENDER_MAX_QUEUE", "8"))
+    PDF_RENDER_TIMEOUT: float = float(os.getenv("PDF_RENDER_TIMEOUT", "120"))
+
     # Almacenamiento
     CONVERSATION_TIMEOUT: int = 60 * 60 * 24  # 24 horas
     UPLOAD_DIR: str = os.getenv("UPLOAD_DIR", "uploads")
+    # Caché de PDFs de propuesta por contenido (disco local LRU delante de S3)
+    PDF_CACHE_DIR: str = os.getenv(
+        "PDF_CACHE_DIR", os.path.join(os.getenv("UPLOAD_DIR", "uploads"), "pdf_cache")
+    )
+    PDF_CACHE_MAX_MB: int = int(os.getenv("PDF_CACHE_MAX_MB", "500"))
+    # Descarga de propuestas: redirigir a S3 (URL prefirmada) en lugar de servir el archivo
+    PDF_DOWNLOAD_REDIRECT: bool = os.getenv("PDF_DOWNLOAD_REDIRECT", "True").lower() in (
+        "true",
+        "1",
+        "t",
+    )
+    PDF_PRESIGNED_URL_EXPIRES: int = int(os.getenv("PDF_PRESIGNED_URL_EXPIRES", "300"))
 
     # PostgreSQL
     POSTGRES_USER: str = os.getenv("POSTGRES_USER", "hydrous")
@@ -65,13 +120,79 @@ class Settings(BaseSettings):
         f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_SERVER}:{POSTGRES_PORT}/{POSTGRES_DB}"
     )
 
+    # Presupuesto de conexiones por proceso, repartido entre el motor async y el
+    # síncrono (auth, diagnóstico, scripts): como máximo DB_POOL_SIZE + DB_MAX_OVERFLOW
+    # por proceso, así que el total en RDS ≈ procesos × (DB_POOL_SIZE + DB_MAX_OVERFLOW).
+    # DB_POOL_SIZE mínimo 2 (una conexión fija por motor; se valida en app/db/base.py)
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "5"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+    # Conexiones del presupuesto reservadas para el motor síncrono (sin overflow)
+    DB_SYNC_POOL_SIZE: int = int(os.getenv("DB_SYNC_POOL_SIZE", "2"))
+    DB_POOL_TIMEOUT: float = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    DB_POOL_PRE_PING: bool = os.getenv("DB_POOL_PRE_PING", "True").lower() in (
+        "true",
+        "1",
+        "t",
+    )
+    # Timeout por sentencia en PostgreSQL (ms, 0 = sin límite)
+    DB_STATEMENT_TIMEOUT_MS: int = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+    # Comprobación de la revisión de Alembic al arrancar: "warn", "strict" u "off"
+    DB_SCHEMA_CHECK: str = os.getenv("DB_SCHEMA_CHECK", "warn")
+
+    @property
+    def ASYNC_DATABASE_URL(self) -> str:
+        """Misma base de datos con el driver asyncpg (para AsyncEngine)."""
+        url = self.DATABASE_URL
+        for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+            if url.startswith(prefix):
+                return "postgresql+asyncpg://" + url[len(prefix) :]
+        return url
+
     # Redis
     REDIS_URL: str = os.getenv("REDIS_URL", "redis://:redis_password@localhost:6379/0")
 
+    # Rate limiting: "redis" (compartido entre workers) o "memory" (por proceso)
+    RATE_LIMIT_BACKEND: str = os.getenv("RATE_LIMIT_BACKEND", "redis")
+    # Buckets por clase de endpoint (peticiones/minuto y ráfaga máxima)
+    RATE_LIMIT_READ_PER_MINUTE: int = int(os.getenv("RATE_LIMIT_READ_PER_MINUTE", "60"))
+    RATE_LIMIT_READ_BURST: int = int(os.getenv("RATE_LIMIT_READ_BURST", "10"))
+    RATE_LIMIT_LLM_PER_MINUTE: int = int(os.getenv("RATE_LIMIT_LLM_PER_MINUTE", "12"))
+    RATE_LIMIT_LLM_BURST: int = int(os.getenv("RATE_LIMIT_LLM_BURST", "4"))
+    RATE_LIMIT_PDF_PER_MINUTE: int = int(os.getenv("RATE_LIMIT_PDF_PER_MINUTE", "4"))
+    RATE_LIMIT_PDF_BURST: int = int(os.getenv("RATE_LIMIT_PDF_BURST", "2"))
+    # Llamadas al LLM simultáneas por usuario (0 = sin límite)
+    RATE_LIMIT_LLM_MAX_IN_FLIGHT: int = int(
+        os.getenv("RATE_LIMIT_LLM_MAX_IN_FLIGHT", "2")
+    )
+
+    # Cola de trabajos en segundo plano (generación de propuestas)
+    # "redis": cola durable en Redis, visible desde todos los workers
+    # "local": tareas asyncio en el propio proceso (solo desarrollo con un
+    #          único proceso: el estado no se comparte ni sobrevive a reinicios)
+    JOB_QUEUE_BACKEND: str = os.getenv("JOB_QUEUE_BACKEND", "redis")
+    # Consumir la cola de Redis dentro de cada worker de la API (el despliegue
+    # en ECS no tiene servicio `python -m app.worker`; docker-compose sí y lo
+    # desactiva)
+    JOB_WORKER_IN_PROCESS: bool = os.getenv(
+        "JOB_WORKER_IN_PROCESS", "True"
+    ).lower() in ("true", "1", "t")
+    JOB_MAX_ATTEMPTS: int = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+    JOB_RETRY_BACKOFF: float = float(os.getenv("JOB_RETRY_BACKOFF", "10"))
+    JOB_LEASE_SECONDS: int = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+    JOB_RESULT_TTL: int = int(os.getenv("JOB_RESULT_TTL", str(60 * 60 * 24)))
+    JOB_WORKER_CONCURRENCY: int = int(os.getenv("JOB_WORKER_CONCURRENCY", "2"))
+    # Lock por conversación para no generar la misma propuesta dos veces (s)
+    PROPOSAL_LOCK_TTL: int = int(os.getenv("PROPOSAL_LOCK_TTL", "300"))
+
     # Seguridad
     JWT_SECRET_KEY: str = os.getenv("JWT_SECRET_KEY", "temporalsecretkey123456789")
     JWT_ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24  # 24 horas
+    # Caché de tokens verificados (por worker; los logouts llegan por Redis pub/sub).
+    # TTL en segundos, 0 = desactivada
+    AUTH_TOKEN_CACHE_TTL: float = float(os.getenv("AUTH_TOKEN_CACHE_TTL", "30"))
+    AUTH_TOKEN_CACHE_SIZE: int = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
     
     # Logging
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO").upper()
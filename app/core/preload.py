@@ -0,0 +1,52 @@
+# app/core/preload.py
+"""
+Arranque con preload de gunicorn (preload_app): el master importa la app y
+carga el estado de solo lectura UNA vez; los workers lo heredan al hacer fork
+(páginas compartidas copy-on-write). Las conexiones (BD, Redis, cliente HTTP
+del LLM, pool de PDF) se abren siempre después del fork, en cada worker.
+"""
+import logging
+
+logger = logging.getLogger("hydrous")
+
+
+def warm_shared_state():
+    """Carga en el master todo lo que los workers solo leen."""
+    from app.config import settings
+    from app.prompts.prompt_assets import prompt_asset_cache
+    from app.services.pdf_service import pdf_service
+    from app.services.questionnaire_service import questionnaire_service
+    from app.utils.token_counter import warm_encoders
+
+    questionnaire_service.warm()
+    prompt_asset_cache.warm()
+    warm_encoders([settings.MODEL])
+    for template_name in pdf_service.jinja_env.list_templates():
+        try:
+            pdf_service.jinja_env.get_template(template_name)
+        except Exception as e:
+            logger.warning(f"No se pudo precompilar la plantilla {template_name}: {e}")
+    logger.info("Estado de solo lectura cargado en el master antes del fork")
+
+
+def prepare_for_fork():
+    """Cierra en el master las conexiones que se hayan abierto durante la carga."""
+    from app.db.base import engine
+
+    engine.dispose()
+
+
+def reset_after_fork():
+    """
+    En cada worker recién creado: descarta los pools heredados sin cerrar sus
+    sockets (pertenecen al master) para que el worker abra los suyos.
+    """
+    from app.db.base import async_engine, engine
+    from app.db.redis_client import redis_client
+
+    engine.dispose(close=False)
+    async_engine.sync_engine.dispose(close=False)
+
+    pool = getattr(redis_client, "connection_pool", None)
+    if pool is not None and hasattr(pool, "reset"):
+        pool.reset()
@@ -1,19 +1,87 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
 from app.config import settings
+from app.db.pool_metrics import PoolMetrics, timed_pool_class
 
-# Crear motor de SQLAlchemy
-engine = create_engine(settings.DATABASE_URL)
+# Opciones de pool compartidas por ambos motores (configurables desde Settings)
+POOL_OPTIONS = {
+    "pool_timeout": settings.DB_POOL_TIMEOUT,
+    "pool_recycle": settings.DB_POOL_RECYCLE,
+    "pool_pre_ping": settings.DB_POOL_PRE_PING,
+}
+
+# Un solo presupuesto de conexiones por proceso (DB_POOL_SIZE + DB_MAX_OVERFLOW):
+# el motor síncrono recibe DB_SYNC_POOL_SIZE conexiones fijas y el asíncrono el
+# resto más todo el overflow. La suma de ambos pools nunca supera el presupuesto.
+# Cada motor necesita al menos una conexión fija: DB_POOL_SIZE debe ser >= 2.
+if settings.DB_POOL_SIZE < 2:
+    raise RuntimeError(
+        f"DB_POOL_SIZE={settings.DB_POOL_SIZE} no alcanza para los dos motores "
+        "(síncrono y asíncrono necesitan una conexión cada uno): usa DB_POOL_SIZE >= 2"
+    )
+SYNC_POOL_SIZE = max(1, min(settings.DB_SYNC_POOL_SIZE, settings.DB_POOL_SIZE - 1))
+ASYNC_POOL_SIZE = max(1, settings.DB_POOL_SIZE - SYNC_POOL_SIZE)
+
+sync_pool_metrics = PoolMetrics("sync")
+async_pool_metrics = PoolMetrics("async")
+
+# Crear motor de SQLAlchemy (único por proceso; lo comparten todos los repositorios)
+engine_connect_args = {}
+if settings.DB_STATEMENT_TIMEOUT_MS > 0:
+    engine_connect_args["options"] = (
+        f"-c statement_timeout={settings.DB_STATEMENT_TIMEOUT_MS}"
+    )
+
+engine = create_engine(
+    settings.DATABASE_URL,
+    poolclass=timed_pool_class(QueuePool, sync_pool_metrics),
+    connect_args=engine_connect_args,
+    pool_size=SYNC_POOL_SIZE,
+    max_overflow=0,
+    **POOL_OPTIONS,
+)
 
 # Crear clase de sesión
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Motor asíncrono (asyncpg) para las rutas async: las consultas no bloquean
+# el event loop mientras hay llamadas al LLM en curso
+async_engine_connect_args = {}
+if settings.DB_STATEMENT_TIMEOUT_MS > 0:
+    async_engine_connect_args["server_settings"] = {
+        "statement_timeout": str(settings.DB_STATEMENT_TIMEOUT_MS)
+    }
+
+async_engine = create_async_engine(
+    settings.ASYNC_DATABASE_URL,
+    poolclass=timed_pool_class(AsyncAdaptedQueuePool, async_pool_metrics),
+    connect_args=async_engine_connect_args,
+    pool_size=ASYNC_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    **POOL_OPTIONS,
+)
+
+# Sesiones asíncronas (expire_on_commit=False: los objetos siguen usables tras commit)
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
 # Importar Base desde declarations.py
 from app.db.models.declarations import Base
 
 
+def get_pool_metrics():
+    """Métricas de los pools de conexiones de este proceso."""
+    return {
+        "connection_budget": settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW,
+        "sync": sync_pool_metrics.snapshot(engine.pool),
+        "async": async_pool_metrics.snapshot(async_engine.pool),
+    }
+
+
 # Función para usar en dependencias de FastAPI
 def get_db():
     """Dependencia para obtener sesión de base de datos."""
@@ -23,6 +91,13 @@ def get_db():
     finally:
         db.close()
 
+
+async def get_async_db():
+    """Dependencia para obtener sesión asíncrona de base de datos."""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 # Función para obtener sesión directa (para scripts)
 def get_db_session():
     """Obtener sesión directa de base de datos para scripts."""
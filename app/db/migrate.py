@@ -0,0 +1,129 @@
+# app/db/migrate.py
+"""
+Gestión del esquema con Alembic (app/db/migrations).
+
+Se ejecuta una vez por despliegue, antes de arrancar la API y el worker
+(en ECS, como tarea aparte: infra/scripts/run-migrations.sh):
+    python -m app.db.migrate
+
+La API no crea tablas al importar: al arrancar solo comprueba (una consulta)
+que la BD está en la revisión esperada (`check_schema_version`).
+"""
+import logging
+import os
+from typing import Optional, Tuple
+
+from alembic import command
+from alembic.config import Config
+from alembic.script import ScriptDirectory
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.pool import NullPool
+
+from app.config import settings
+
+logger = logging.getLogger("hydrous")
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "migrations")
+ALEMBIC_INI = os.path.join(MIGRATIONS_DIR, "alembic.ini")
+
+# Revisión que crea todas las tablas: las BD creadas antes con create_all
+# (sin tabla alembic_version) se marcan en ella y se actualizan desde ahí
+BASELINE_REVISION = "bf31fbf3d576"
+
+# Lock de Postgres para que solo un proceso migre a la vez
+MIGRATION_LOCK_ID = 72_640_915
+
+_head_revisions: Optional[Tuple[str, ...]] = None
+
+
+def alembic_config() -> Config:
+    config = Config(ALEMBIC_INI)
+    config.set_main_option("script_location", MIGRATIONS_DIR)
+    # configparser interpreta '%' (p. ej. en contraseñas codificadas)
+    config.set_main_option("sqlalchemy.url", settings.DATABASE_URL.replace("%", "%%"))
+    return config
+
+
+def head_revisions() -> Tuple[str, ...]:
+    """Revisiones head de los scripts de migración (se leen una vez por proceso)."""
+    global _head_revisions
+    if _head_revisions is None:
+        script = ScriptDirectory.from_config(alembic_config())
+        _head_revisions = tuple(sorted(script.get_heads()))
+    return _head_revisions
+
+
+def upgrade_database():
+    """Aplica las migraciones pendientes hasta head en una sola transacción."""
+    config = alembic_config()
+    engine = create_engine(settings.DATABASE_URL, poolclass=NullPool)
+    try:
+        with engine.connect() as connection:
+            connection.execute(
+                text("SELECT pg_advisory_lock(:lock_id)"), {"lock_id": MIGRATION_LOCK_ID}
+            )
+            try:
+                config.attributes["connection"] = connection
+                tables = set(inspect(connection).get_table_names())
+                if "alembic_version" not in tables and "users" in tables:
+                    logger.warning(
+                        f"BD creada sin Alembic: marcando revisión base {BASELINE_REVISION}"
+                    )
+                    command.stamp(config, BASELINE_REVISION)
+                command.upgrade(config, "head")
+                connection.commit()
+            finally:
+                # Si la migración falló la transacción está abortada: se
+                # descarta antes de liberar el lock para no ocultar el error
+                connection.rollback()
+                connection.execute(
+                    text("SELECT pg_advisory_unlock(:lock_id)"),
+                    {"lock_id": MIGRATION_LOCK_ID},
+                )
+                connection.commit()
+    finally:
+        engine.dispose()
+    logger.info(f"Esquema de BD en la revisión {', '.join(head_revisions())}")
+
+
+async def check_schema_version():
+    """
+    Comprobación barata al arrancar: la revisión de la BD debe coincidir con
+    head. Según DB_SCHEMA_CHECK: "warn" (registra un error), "strict" (no
+    arranca) u "off".
+    """
+    mode = settings.DB_SCHEMA_CHECK.lower()
+    if mode == "off":
+        return
+
+    from app.db.base import async_engine
+
+    try:
+        async with async_engine.connect() as connection:
+            result = await connection.execute(
+                text("SELECT version_num FROM alembic_version")
+            )
+            current = tuple(sorted(row[0] for row in result))
+    except Exception as e:
+        current = ()
+        logger.debug(f"No se pudo leer alembic_version: {e}")
+
+    expected = head_revisions()
+    if current == expected:
+        logger.info(f"Esquema de BD al día (revisión {', '.join(current)})")
+        return
+
+    message = (
+        f"Esquema de BD desactualizado: BD en {current or 'sin versión'}, "
+        f"se esperaba {expected}. Ejecuta 'python -m app.db.migrate'."
+    )
+    if mode == "strict":
+        raise RuntimeError(message)
+    logger.error(message)
+
+
+if __name__ == "__main__":
+    from app.core.logging_config import get_logger
+
+    get_logger("hydrous")
+    upgrade_database()
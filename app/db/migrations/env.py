@@ -15,17 +15,18 @@ sys.path.append(BASE_DIR)
 from app.db.base import Base
 from app.config import settings
 
-# Importar todos los modelos
-from app.db.models.__all_models import *  # Esto asegura que todos los modelos se importen
+# Importar todos los modelos (app.db.models los registra en Base.metadata)
+import app.db.models  # noqa: F401
 
 # this is the Alembic Config object
 config = context.config
 
-# URL de conexión a la BD
-config.set_main_option("sqlalchemy.url", settings.DATABASE_URL)
+# URL de conexión a la BD (configparser interpreta '%')
+config.set_main_option("sqlalchemy.url", settings.DATABASE_URL.replace("%", "%%"))
 
 # Interpretar el archivo de configuración para tener configuración de logging
-if config.config_file_name is not None:
+# (no al ejecutarse desde app.db.migrate, que ya configuró el logging)
+if config.config_file_name is not None and "connection" not in config.attributes:
     fileConfig(config.config_file_name)
 
 # MetaData para 'autogenerate'
@@ -48,6 +49,14 @@ def run_migrations_offline():
 
 def run_migrations_online():
     """Run migrations in 'online' mode."""
+    # Conexión proporcionada por app.db.migrate (dentro de su transacción y lock)
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        context.configure(connection=connection, target_metadata=target_metadata)
+        with context.begin_transaction():
+            context.run_migrations()
+        return
+
     connectable = engine_from_config(
         config.get_section(config.config_ini_section),
         prefix="sqlalchemy.",
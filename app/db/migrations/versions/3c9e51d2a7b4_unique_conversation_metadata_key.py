@@ -0,0 +1,62 @@
+"""unique_conversation_metadata_key
+
+Revision ID: 3c9e51d2a7b4
+Revises: bf31fbf3d576
+Create Date: 2026-10-17 10:12:31.518204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c9e51d2a7b4'
+down_revision: Union[str, None] = 'bf31fbf3d576'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    inspector = sa.inspect(op.get_bind())
+    # El upsert actualiza updated_at: es lo que indica el valor vigente
+    columns = {column['name'] for column in inspector.get_columns('conversation_metadata')}
+    if 'updated_at' not in columns:
+        op.add_column(
+            'conversation_metadata', sa.Column('updated_at', sa.DateTime(), nullable=True)
+        )
+    # Eliminar duplicados (conversation_id, key) conservando el escrito más
+    # recientemente (updated_at si existe, si no created_at; luego id)
+    op.execute(
+        """
+        DELETE FROM conversation_metadata a
+        USING conversation_metadata b
+        WHERE a.conversation_id = b.conversation_id
+          AND a.key = b.key
+          AND (COALESCE(a.updated_at, a.created_at), a.id::text)
+            < (COALESCE(b.updated_at, b.created_at), b.id::text)
+        """
+    )
+    # Las BD creadas con create_all ya pueden tener la restricción
+    existing = {
+        constraint['name']
+        for constraint in inspector.get_unique_constraints('conversation_metadata')
+    }
+    if 'uq_conversation_metadata_conversation_key' not in existing:
+        op.create_unique_constraint(
+            'uq_conversation_metadata_conversation_key',
+            'conversation_metadata',
+            ['conversation_id', 'key'],
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint(
+        'uq_conversation_metadata_conversation_key',
+        'conversation_metadata',
+        type_='unique',
+    )
+    op.drop_column('conversation_metadata', 'updated_at')
@@ -0,0 +1,32 @@
+"""message_token_count
+
+Revision ID: 7d2f4a9c1e83
+Revises: 3c9e51d2a7b4
+Create Date: 2026-10-17 15:40:12.204187
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d2f4a9c1e83'
+down_revision: Union[str, None] = '3c9e51d2a7b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Las BD creadas con create_all ya pueden tener la columna
+    columns = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('messages')}
+    if 'token_count' not in columns:
+        # Nullable: los mensajes existentes se cuentan al cargarse (en memoria)
+        op.add_column('messages', sa.Column('token_count', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('messages', 'token_count')
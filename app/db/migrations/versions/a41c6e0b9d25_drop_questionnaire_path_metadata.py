@@ -0,0 +1,30 @@
+"""drop_questionnaire_path_metadata
+
+Revision ID: a41c6e0b9d25
+Revises: 7d2f4a9c1e83
+Create Date: 2026-10-17 16:22:48.917530
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a41c6e0b9d25'
+down_revision: Union[str, None] = '7d2f4a9c1e83'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # La ruta del cuestionario ahora se calcula en QuestionnaireService;
+    # las copias guardadas por conversación ya no se leen
+    op.execute("DELETE FROM conversation_metadata WHERE key = 'questionnaire_path'")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Dato derivado: no se restaura (se reconstruía bajo demanda)
+    pass
@@ -0,0 +1,44 @@
+"""conversation_query_indexes
+
+Revision ID: e58b2d7c4f16
+Revises: a41c6e0b9d25
+Create Date: 2026-10-17 18:05:12.403871
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e58b2d7c4f16'
+down_revision: Union[str, None] = 'a41c6e0b9d25'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (tabla, índice, columnas)
+INDEXES = (
+    # Historial: WHERE conversation_id = ? ORDER BY created_at
+    ('messages', 'ix_messages_conversation_id_created_at', ['conversation_id', 'created_at']),
+    # Conversaciones de un usuario
+    ('conversations', 'ix_conversations_user_id', ['user_id']),
+    # Documentos de una conversación (y borrado en cascada)
+    ('documents', 'ix_documents_conversation_id', ['conversation_id']),
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # (conversation_id, key) ya es único desde 3c9e51d2a7b4 y sirve de índice
+    inspector = sa.inspect(op.get_bind())
+    for table, name, columns in INDEXES:
+        # Las BD creadas con create_all ya pueden tener el índice
+        if name not in {index['name'] for index in inspector.get_indexes(table)}:
+            op.create_index(name, table, columns)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table, name, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -10,7 +10,9 @@ class Conversation(Base, BaseModel):
 
     __tablename__ = "conversations"
 
-    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=True)
+    user_id = Column(
+        UUID(as_uuid=True), ForeignKey("users.id"), nullable=True, index=True
+    )
     selected_sector = Column(String(100), nullable=True)
     selected_subsector = Column(String(100), nullable=True)
     current_question_id = Column(String(100), nullable=True)
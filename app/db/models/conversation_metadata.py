@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, ForeignKey
+from sqlalchemy import Column, DateTime, String, ForeignKey, UniqueConstraint
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import relationship
 
@@ -15,9 +15,17 @@ class ConversationMetadata(Base, BaseModel):
     )
     key = Column(String(255), nullable=False)
     value = Column(JSONB, nullable=True)
+    # Última escritura del valor (la fija el upsert; None si nunca se actualizó)
+    updated_at = Column(DateTime, nullable=True)
 
     # Relaciones
     conversation = relationship("Conversation", back_populates="metadata_items")
 
-    # Índice compuesto para optimizar la búsqueda
-    __table_args__ = ({"sqlite_autoincrement": True},)
+    # Índice único compuesto: búsqueda por (conversación, clave) y destino
+    # del upsert INSERT ... ON CONFLICT (conversation_id, key)
+    __table_args__ = (
+        UniqueConstraint(
+            "conversation_id", "key", name="uq_conversation_metadata_conversation_key"
+        ),
+        {"sqlite_autoincrement": True},
+    )
@@ -11,7 +11,7 @@ class Document(Base, BaseModel):
     __tablename__ = "documents"
 
     conversation_id = Column(
-        UUID(as_uuid=True), ForeignKey("conversations.id"), nullable=False
+        UUID(as_uuid=True), ForeignKey("conversations.id"), nullable=False, index=True
     )
     filename = Column(String(255), nullable=False)
     file_path = Column(String(255), nullable=False)
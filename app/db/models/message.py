@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Text, ForeignKey, Enum
+from sqlalchemy import Column, String, Text, ForeignKey, Enum, Integer, Index
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 
@@ -15,6 +15,13 @@ class Message(Base, BaseModel):
     )
     role = Column(Enum(RoleEnum, name="role_enum_type"), nullable=False)
     content = Column(Text, nullable=False)
+    # Tokens del contenido para el modelo configurado (calculado al guardar)
+    token_count = Column(Integer, nullable=True)
 
     # Relaciones
     conversation = relationship("Conversation", back_populates="messages")
+
+    # Índice compuesto: historial de una conversación ordenado por fecha
+    __table_args__ = (
+        Index("ix_messages_conversation_id_created_at", "conversation_id", "created_at"),
+    )
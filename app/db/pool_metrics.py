@@ -0,0 +1,96 @@
+# app/db/pool_metrics.py
+import logging
+import threading
+import time
+from typing import Any, Dict, Type
+
+from sqlalchemy import exc
+from sqlalchemy.pool import Pool
+
+logger = logging.getLogger("hydrous")
+
+
+class PoolMetrics:
+    """Tiempo de espera por conexión y saturación de un pool de SQLAlchemy."""
+
+    def __init__(self, name: str, slow_checkout_seconds: float = 1.0):
+        self.name = name
+        self.slow_checkout_seconds = slow_checkout_seconds
+        self._lock = threading.Lock()
+        self._checkouts = 0
+        self._timeouts = 0
+        self._total_wait_seconds = 0.0
+        self._max_wait_seconds = 0.0
+
+    def record_checkout(self, wait_seconds: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self._timeouts += 1
+            else:
+                self._checkouts += 1
+                self._total_wait_seconds += wait_seconds
+                self._max_wait_seconds = max(self._max_wait_seconds, wait_seconds)
+
+        if timed_out:
+            logger.error(
+                f"Timeout esperando conexión del pool de BD '{self.name}' ({wait_seconds:.2f}s)"
+            )
+        elif wait_seconds > self.slow_checkout_seconds:
+            logger.warning(
+                f"Espera de {wait_seconds:.2f}s por conexión del pool de BD '{self.name}' (pool saturado)"
+            )
+
+    def snapshot(self, pool: Pool) -> Dict[str, Any]:
+        """Estado actual del pool y métricas acumuladas de checkout."""
+        metrics: Dict[str, Any] = {
+            "checkouts": self._checkouts,
+            "timeouts": self._timeouts,
+            "avg_wait_ms": (
+                round(self._total_wait_seconds / self._checkouts * 1000, 2)
+                if self._checkouts
+                else 0.0
+            ),
+            "max_wait_ms": round(self._max_wait_seconds * 1000, 2),
+            "status": pool.status(),
+        }
+        # Solo los pools con cola (QueuePool y variantes) exponen tamaño/overflow
+        if hasattr(pool, "size") and hasattr(pool, "checkedout"):
+            size = pool.size()
+            max_overflow = getattr(pool, "_max_overflow", 0)
+            capacity = size + max(max_overflow, 0)
+            checked_out = pool.checkedout()
+            metrics.update(
+                {
+                    "pool_size": size,
+                    "max_overflow": max_overflow,
+                    "checked_out": checked_out,
+                    "overflow": pool.overflow(),
+                    "saturation": round(checked_out / capacity, 3) if capacity else None,
+                }
+            )
+        return metrics
+
+
+def timed_pool_class(base: Type[Pool], metrics: PoolMetrics) -> Type[Pool]:
+    """
+    Devuelve una subclase del pool que mide cuánto se espera en cada checkout.
+    Se usa como `poolclass` al crear el engine (se conserva al recrear el pool).
+    """
+
+    class TimedPool(base):
+        pool_metrics = metrics
+
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                connection = super()._do_get()
+            except exc.TimeoutError:
+                self.pool_metrics.record_checkout(
+                    time.perf_counter() - started, timed_out=True
+                )
+                raise
+            self.pool_metrics.record_checkout(time.perf_counter() - started)
+            return connection
+
+    TimedPool.__name__ = f"Timed{base.__name__}"
+    return TimedPool
@@ -1,23 +1,27 @@
 # app/main.py
 import os
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
-import logging
 
 from app.routes import chat, documents, feedback, auth, diagnostic
 from app.config import settings
-from app.db.models.declarations import Base
-from app.db.base import engine
-
-# Inicializar la base de datos (crear tablas si no existen)
-logger = logging.getLogger("hydrous")
-logger.info("Verificando e inicializando tablas de la base de datos...")
-try:
-    Base.metadata.create_all(bind=engine)
-    logger.info("¡Tablas inicializadas correctamente!")
-except Exception as e:
-    logger.error(f"Error al inicializar tablas: {e}")
+from app.db.base import async_engine
+from app.db.migrate import check_schema_version
+from app.services.llm_http_client import llm_http_client
+from app.services.pdf_render_pool import pdf_render_pool
+from app.services.questionnaire_service import questionnaire_service
+from app.services.task_queue import task_queue
+from app.services.token_cache import token_invalidation_subscriber
+from app.utils.token_counter import warm_encoders
+
+# Registra los handlers de trabajos (para el consumidor en proceso)
+import app.services.proposal_jobs  # noqa: F401
+
+# El esquema lo gestiona Alembic (python -m app.db.migrate, una vez por despliegue);
+# al arrancar cada worker solo se comprueba la revisión (ver lifespan)
 
 # Importar middlewares
 from app.middleware.auth_middleware import AuthMiddleware
@@ -32,11 +36,46 @@ logger = get_logger("hydrous")
 # Asegurarse de que el directorio de uploads existe
 os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Recursos de larga vida por worker: se abren al arrancar y se cierran al apagar."""
+    await check_schema_version()
+    await llm_http_client.start()
+    # Revocaciones de tokens (logout) de cualquier worker a la caché de este
+    await token_invalidation_subscriber.start()
+    # Encoder de tokens cargado antes de la primera petición (lectura/descarga del BPE)
+    await asyncio.to_thread(warm_encoders, [settings.MODEL])
+    # Rutas del cuestionario (índices de QuestionnairePath) construidas antes de
+    # la primera petición; con preload de gunicorn ya vienen hechas del master
+    await asyncio.to_thread(questionnaire_service.warm)
+    # Consumidor de la cola de Redis en este worker (sin servicio worker aparte)
+    job_worker_stop = asyncio.Event()
+    job_worker = None
+    if settings.JOB_QUEUE_BACKEND == "redis" and settings.JOB_WORKER_IN_PROCESS:
+        job_worker = asyncio.create_task(
+            task_queue.run_worker(
+                concurrency=settings.JOB_WORKER_CONCURRENCY, stop_event=job_worker_stop
+            )
+        )
+    try:
+        yield
+    finally:
+        if job_worker is not None:
+            job_worker_stop.set()
+            await job_worker
+        await token_invalidation_subscriber.close()
+        await llm_http_client.close()
+        pdf_render_pool.close()
+        await async_engine.dispose()
+
+
 # Inicializar aplicación
 app = FastAPI(
     title="Hydrous AI Chatbot API",
     description="Backend para el chatbot de soluciones de agua Hydrous",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Configurar CORS
@@ -50,14 +89,18 @@ app.add_middleware(
     allow_origin_regex=r"https://.*\.hostingersite\.com$|https://ricardoalt1515\.github\.io$|http://localhost:.*$|https://(www\.)?h2oassistant\.com$",
 )
 
-# Middleware de autenticación
-app.add_middleware(AuthMiddleware)
-
-# Rate limiting
+# Rate limiting (añadido antes que Auth para ejecutarse después de él y
+# disponer de request.state.user: buckets y límite de concurrencia por usuario)
 app.add_middleware(
-    RateLimitMiddleware, requests_per_minute=60, burst_size=10, per_user=True
+    RateLimitMiddleware,
+    requests_per_minute=settings.RATE_LIMIT_READ_PER_MINUTE,
+    burst_size=settings.RATE_LIMIT_READ_BURST,
+    per_user=True,
 )
 
+# Middleware de autenticación
+app.add_middleware(AuthMiddleware)
+
 # Incluir rutas
 app.include_router(chat.router, prefix=f"{settings.API_V1_STR}/chat", tags=["chat"])
 app.include_router(
@@ -6,7 +6,7 @@ from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import Response
 
 from app.services.auth_service import auth_service
-from app.db.base import SessionLocal
+from app.db.base import AsyncSessionLocal
 
 logger = logging.getLogger("hydrous")
 
@@ -96,9 +96,8 @@ class AuthMiddleware(BaseHTTPMiddleware):
 
         # 5. Verificar el token
         try:
-            # Crear una sesión de base de datos para la verificación
-            db = SessionLocal()
-            try:
+            # Crear una sesión de base de datos (asíncrona) para la verificación
+            async with AsyncSessionLocal() as db:
                 user_data = await auth_service.verify_token(token, db)
 
                 if not user_data:
@@ -125,9 +124,6 @@ class AuthMiddleware(BaseHTTPMiddleware):
                     f"Usuario autenticado: {user_data['id']} accediendo a {path}"
                 )
 
-            finally:
-                db.close()
-
         except Exception as e:
             logger.error(f"Error en middleware de autenticación: {e}")
             return JSONResponse(
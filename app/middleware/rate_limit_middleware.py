@@ -1,14 +1,129 @@
 from fastapi import Request, HTTPException, status
 from fastapi.responses import JSONResponse
-from typing import Callable, Dict
+from typing import Callable, Dict, List, Optional, Tuple
+import json
+import math
+import re
 import time
-import asyncio
+from dataclasses import dataclass
 from starlette.middleware.base import BaseHTTPMiddleware
 import logging
 
+from app.config import settings
+from app.services.rate_limiter import (
+    ConcurrencyLimiter,
+    RateLimitResult,
+    RateLimiter,
+    create_concurrency_limiter,
+    create_rate_limiter,
+)
+from app.utils.chat_intents import skips_llm
+
 logger = logging.getLogger("hydrous")
 
 
+@dataclass
+class EndpointClass:
+    """Bucket independiente para un tipo de endpoint (lecturas, LLM, PDF)."""
+
+    name: str
+    requests_per_minute: int
+    burst_size: int
+
+    @property
+    def refill_rate(self) -> float:
+        return self.requests_per_minute / 60.0
+
+
+@dataclass
+class RouteCost:
+    """Asigna las peticiones que encajan (método + regex de ruta) a un bucket y un coste."""
+
+    method: str
+    pattern: str
+    endpoint_class: str
+    cost: float = 1.0
+    # Mensajes de chat: si el cuerpo es una verificación o una solicitud de PDF
+    # (no llaman al LLM) se cobran como una lectura
+    inspect_message: bool = False
+
+    def __post_init__(self):
+        self._regex = re.compile(self.pattern)
+
+    def matches(self, method: str, path: str) -> bool:
+        return method == self.method and self._regex.fullmatch(path) is not None
+
+
+API_PREFIX = settings.API_V1_STR
+
+# Rutas sin rate limit (health checks del ALB y documentación)
+RATE_LIMIT_EXEMPT_PATHS = [
+    f"{API_PREFIX}/health",
+    "/health",
+    "/alb-health",
+    "/docs",
+    "/openapi.json",
+    "/redoc",
+]
+
+# La primera regla que coincide gana; el resto va al bucket "read" con coste 1
+DEFAULT_ROUTE_COSTS: List[RouteCost] = [
+    # Turnos de chat: una llamada al LLM (y posiblemente la propuesta completa)
+    RouteCost("POST", rf"{API_PREFIX}/chat/message", "llm", 1, inspect_message=True),
+    RouteCost(
+        "POST", rf"{API_PREFIX}/chat/message/stream", "llm", 1, inspect_message=True
+    ),
+    # Subida de documento: extracción de texto + llamada al LLM
+    RouteCost("POST", rf"{API_PREFIX}/documents/upload", "llm", 2),
+    # Descarga/regeneración de la propuesta en PDF
+    RouteCost("GET", rf"{API_PREFIX}/chat/[^/]+/download-pdf", "pdf", 1),
+    RouteCost("POST", rf"{API_PREFIX}/chat/[^/]+/diagnose", "pdf", 1),
+    # Escrituras en BD más caras que una lectura
+    RouteCost("POST", rf"{API_PREFIX}/chat/start", "read", 2),
+    RouteCost(
+        "POST",
+        rf"{API_PREFIX}/auth/(register|login|forgot-password|reset-password)",
+        "read",
+        3,
+    ),
+]
+
+
+def default_endpoint_classes() -> Dict[str, EndpointClass]:
+    return {
+        "read": EndpointClass(
+            "read", settings.RATE_LIMIT_READ_PER_MINUTE, settings.RATE_LIMIT_READ_BURST
+        ),
+        "llm": EndpointClass(
+            "llm", settings.RATE_LIMIT_LLM_PER_MINUTE, settings.RATE_LIMIT_LLM_BURST
+        ),
+        "pdf": EndpointClass(
+            "pdf", settings.RATE_LIMIT_PDF_PER_MINUTE, settings.RATE_LIMIT_PDF_BURST
+        ),
+    }
+
+
+def validate_route_costs(
+    route_costs: List[RouteCost], endpoint_classes: Dict[str, EndpointClass]
+):
+    """
+    Comprueba las reglas al arrancar: una ruta cuyo coste supera la ráfaga de
+    su bucket se rechazaría siempre. Lanza ValueError si hay alguna inválida.
+    """
+    for rule in route_costs:
+        endpoint_class = endpoint_classes.get(rule.endpoint_class)
+        if endpoint_class is None:
+            raise ValueError(
+                f"RouteCost {rule.method} {rule.pattern}: clase de endpoint desconocida "
+                f"'{rule.endpoint_class}'"
+            )
+        if rule.cost > endpoint_class.burst_size:
+            raise ValueError(
+                f"RouteCost {rule.method} {rule.pattern}: coste {rule.cost} mayor que la "
+                f"ráfaga del bucket '{endpoint_class.name}' ({endpoint_class.burst_size})"
+            )
+
+
 class RateLimitMiddleware(BaseHTTPMiddleware):
     """
     Middleware que implementa rate limiting usando el algoritmo de "Token Bucket".
@@ -23,6 +138,14 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
     - Permite ráfagas cortas (burst)
     - Suaviza el tráfico a largo plazo
     - Fácil de implementar
+
+    Los buckets viven en Redis, así que el límite es global para todos los
+    workers y tareas (con respaldo en memoria si Redis no está disponible).
+
+    Cada usuario tiene un bucket por clase de endpoint ("read", "llm", "pdf")
+    y cada ruta consume un coste distinto, de modo que un health check o un
+    listado no compite con los turnos de chat que llaman al LLM. Además se
+    limita el número de llamadas al LLM en curso por usuario.
     """
 
     def __init__(
@@ -31,42 +154,64 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
         requests_per_minute: int = 60,
         burst_size: int = 10,
         per_user: bool = True,
+        limiter: RateLimiter = None,
+        endpoint_classes: Optional[Dict[str, EndpointClass]] = None,
+        route_costs: Optional[List[RouteCost]] = None,
+        llm_max_in_flight: Optional[int] = None,
+        concurrency_limiter: ConcurrencyLimiter = None,
     ):
         """
         Args:
-            requests_per_minute: Peticiones permitidas por minuto
-            burst_size: Máximo de peticiones en ráfaga
+            requests_per_minute: Peticiones permitidas por minuto (bucket "read")
+            burst_size: Máximo de peticiones en ráfaga (bucket "read")
             per_user: Si True, límite por usuario. Si False, por IP
+            limiter: Backend de buckets (por defecto Redis con respaldo en memoria)
+            endpoint_classes: Buckets por clase de endpoint (por defecto desde settings)
+            route_costs: Reglas ruta → (clase, coste)
+            llm_max_in_flight: Llamadas al LLM simultáneas por usuario (0 = sin límite)
+            concurrency_limiter: Backend del contador de llamadas en curso
         """
         super().__init__(app)
 
         # Configuración del rate limiting
-        self.requests_per_minute = requests_per_minute
-        self.burst_size = burst_size
         self.per_user = per_user
+        self.endpoint_classes = endpoint_classes or default_endpoint_classes()
+        self.endpoint_classes["read"] = EndpointClass(
+            "read", requests_per_minute, burst_size
+        )
+        self.route_costs = route_costs if route_costs is not None else DEFAULT_ROUTE_COSTS
+        validate_route_costs(self.route_costs, self.endpoint_classes)
+        self.exempt_paths = RATE_LIMIT_EXEMPT_PATHS
+        self.llm_max_in_flight = (
+            settings.RATE_LIMIT_LLM_MAX_IN_FLIGHT
+            if llm_max_in_flight is None
+            else llm_max_in_flight
+        )
 
-        # Tasa de recarga (tokens por segundo)
-        self.refill_rate = requests_per_minute / 60.0
-
-        # Almacén de buckets en memoria (en producción usar Redis)
-        self.buckets: Dict[str, Dict] = {}
-
-        # Limpieza periódica de buckets antiguos
-        self._start_cleanup_task()
+        # Buckets compartidos en Redis (respaldo en memoria si Redis no responde)
+        self.limiter = limiter or create_rate_limiter()
+        self.concurrency = concurrency_limiter or create_concurrency_limiter()
 
     async def dispatch(self, request: Request, call_next: Callable):
         """
         Verifica y actualiza el rate limit para cada petición.
         """
+        path = request.url.path
+        if request.method == "OPTIONS" or any(
+            path.startswith(exempt) for exempt in self.exempt_paths
+        ):
+            return await call_next(request)
 
-        # 1. Determinar el identificador (usuario o IP)
+        # 1. Determinar el identificador (usuario o IP) y el bucket de la ruta
         identifier = await self._get_identifier(request)
+        endpoint_class, cost = await self._classify(request)
 
         # 2. Verificar rate limit
-        allowed, retry_after = await self._check_rate_limit(identifier)
+        result = await self._check_rate_limit(identifier, endpoint_class, cost)
 
-        if not allowed:
+        if not result.allowed:
             # 3. Si se excedió el límite, devolver error 429
+            retry_after = round(result.retry_after, 2)
             return JSONResponse(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
                 content={
@@ -74,22 +219,88 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
                     "error_code": "RATE_LIMIT_EXCEEDED",
                     "retry_after": retry_after,
                 },
+                headers={"Retry-After": str(math.ceil(result.retry_after))},
             )
 
-        # 4. Petición permitida, continuar
-        response = await call_next(request)
+        # 4. Limitar las llamadas al LLM en curso del mismo usuario
+        in_flight: Optional[Tuple[str, str]] = None
+        if endpoint_class.name == "llm" and self.llm_max_in_flight > 0:
+            in_flight_key = f"llm:{identifier}"
+            backend = await self.concurrency.acquire(
+                in_flight_key, self.llm_max_in_flight
+            )
+            if backend is None:
+                logger.warning(
+                    f"Demasiadas llamadas al LLM en curso para {identifier} "
+                    f"(máx. {self.llm_max_in_flight})"
+                )
+                return JSONResponse(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    content={
+                        "detail": "Ya hay una respuesta en curso. Espera a que termine.",
+                        "error_code": "TOO_MANY_CONCURRENT_REQUESTS",
+                        "retry_after": 1,
+                    },
+                    headers={"Retry-After": "1"},
+                )
+            in_flight = (in_flight_key, backend)
+
+        # 5. Petición permitida, continuar
+        try:
+            response = await call_next(request)
+        except Exception:
+            if in_flight:
+                await self.concurrency.release(*in_flight)
+            raise
+
+        if in_flight:
+            # El hueco se libera cuando termina el cuerpo (incluye respuestas SSE)
+            response.body_iterator = self._release_after_body(
+                response.body_iterator, *in_flight
+            )
 
-        # 5. Añadir headers informativos sobre rate limit
-        response.headers["X-RateLimit-Limit"] = str(self.requests_per_minute)
-        response.headers["X-RateLimit-Remaining"] = str(
-            int(self.buckets[identifier]["tokens"])
-        )
+        # 6. Añadir headers informativos sobre rate limit
+        response.headers["X-RateLimit-Limit"] = str(endpoint_class.requests_per_minute)
+        response.headers["X-RateLimit-Remaining"] = str(int(result.remaining))
         response.headers["X-RateLimit-Reset"] = str(
-            int(self.buckets[identifier]["next_refill"])
+            int(
+                time.time()
+                + (endpoint_class.burst_size - result.remaining)
+                / endpoint_class.refill_rate
+            )
         )
+        response.headers["X-RateLimit-Class"] = endpoint_class.name
 
         return response
 
+    async def _classify(self, request: Request) -> Tuple[EndpointClass, float]:
+        """Devuelve el bucket y el coste de la petición (por defecto "read", coste 1)."""
+        for rule in self.route_costs:
+            if rule.matches(request.method, request.url.path):
+                if rule.inspect_message and skips_llm(
+                    await self._message_text(request) or ""
+                ):
+                    break
+                return self.endpoint_classes[rule.endpoint_class], rule.cost
+        return self.endpoint_classes["read"], 1.0
+
+    @staticmethod
+    async def _message_text(request: Request) -> Optional[str]:
+        """Campo `message` del cuerpo JSON (Starlette lo cachea para la ruta)."""
+        try:
+            payload = json.loads(await request.body() or b"{}")
+        except (ValueError, UnicodeDecodeError):
+            return None
+        message = payload.get("message") if isinstance(payload, dict) else None
+        return message if isinstance(message, str) else None
+
+    async def _release_after_body(self, body_iterator, key: str, backend: str):
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            await self.concurrency.release(key, backend)
+
     async def _get_identifier(self, request: Request) -> str:
         """
         Obtiene el identificador para rate limiting.
@@ -106,78 +317,24 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
             client_host = request.client.host if request.client else "unknown"
             return f"ip:{client_host}"
 
-    async def _check_rate_limit(self, identifier: str) -> tuple[bool, float]:
+    async def _check_rate_limit(
+        self, identifier: str, endpoint_class: EndpointClass, cost: float = 1.0
+    ) -> RateLimitResult:
         """
-        Implementa el algoritmo Token Bucket.
-
-        Returns:
-            tuple: (allowed: bool, retry_after: float)
+        Implementa el algoritmo Token Bucket (recarga + consumo atómicos)
+        sobre el bucket de la clase de endpoint.
         """
-        current_time = time.time()
-
-        # Inicializar bucket si no existe
-        if identifier not in self.buckets:
-            self.buckets[identifier] = {
-                "tokens": self.burst_size,
-                "last_refill": current_time,
-                "next_refill": current_time + 1.0 / self.refill_rate,
-            }
-
-        bucket = self.buckets[identifier]
-
-        # Calcular cuántos tokens añadir desde la última recarga
-        time_passed = current_time - bucket["last_refill"]
-        tokens_to_add = time_passed * self.refill_rate
-
-        # Añadir tokens (sin exceder el burst_size)
-        bucket["tokens"] = min(self.burst_size, bucket["tokens"] + tokens_to_add)
-        bucket["last_refill"] = current_time
-
-        # Verificar si hay tokens disponibles
-        if bucket["tokens"] >= 1:
-            # Consumir un token
-            bucket["tokens"] -= 1
-
-            # Actualizar tiempo de siguiente recarga completa
-            if bucket["tokens"] == 0:
-                bucket["next_refill"] = current_time + 1.0 / self.refill_rate
-
-            return True, 0
-        else:
-            # No hay tokens, calcular tiempo de espera
-            tokens_needed = 1 - bucket["tokens"]
-            retry_after = tokens_needed / self.refill_rate
+        result = await self.limiter.consume(
+            f"{endpoint_class.name}:{identifier}",
+            capacity=endpoint_class.burst_size,
+            refill_rate=endpoint_class.refill_rate,
+            cost=cost,
+        )
 
+        if not result.allowed:
             logger.warning(
-                f"Rate limit excedido para {identifier}. "
-                f"Retry after: {retry_after:.2f} segundos"
+                f"Rate limit '{endpoint_class.name}' excedido para {identifier} ({result.backend}). "
+                f"Retry after: {result.retry_after:.2f} segundos"
             )
 
-            return False, retry_after
-
-    def _start_cleanup_task(self):
-        """
-        Inicia tarea de limpieza de buckets antiguos para evitar memory leaks.
-        """
-
-        async def cleanup():
-            while True:
-                await asyncio.sleep(300)  # Limpiar cada 5 minutos
-                current_time = time.time()
-
-                # Remover buckets inactivos por más de 1 hora
-                expired_identifiers = [
-                    identifier
-                    for identifier, bucket in self.buckets.items()
-                    if current_time - bucket["last_refill"] > 3600
-                ]
-
-                for identifier in expired_identifiers:
-                    del self.buckets[identifier]
-
-                logger.debug(
-                    f"Rate limit cleanup: {len(expired_identifiers)} buckets removidos"
-                )
-
-        # Ejecutar tarea de limpieza en background
-        asyncio.create_task(cleanup())
+        return result
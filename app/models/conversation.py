@@ -1,7 +1,8 @@
 # app/models/conversation.py
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 from datetime import datetime
 from typing import List, Dict, Any, Optional
+import json
 import uuid
 
 from app.models.message import Message
@@ -22,7 +23,6 @@ class Conversation(BaseModel):
             "collected_data": {},
             "selected_sector": None,
             "selected_subsector": None,
-            "questionnaire_path": [],  # Podemos seguir usando esto para referencia
             "is_complete": False,
             "has_proposal": False,
             "proposal_text": None,
@@ -34,6 +34,30 @@ class Conversation(BaseModel):
     )
     # --------------------------------------
 
+    # Metadata tal como se cargó/guardó en BD (serializada), para
+    # escribir solo las claves que cambian
+    _persisted_metadata: Dict[str, str] = PrivateAttr(default_factory=dict)
+
+    @staticmethod
+    def _serialize_metadata_value(value: Any) -> str:
+        return json.dumps(value, sort_keys=True, default=str)
+
+    def mark_metadata_persisted(self):
+        """Marca la metadata actual como sincronizada con la BD."""
+        self._persisted_metadata = {
+            key: self._serialize_metadata_value(value)
+            for key, value in self.metadata.items()
+        }
+
+    def get_changed_metadata(self) -> Dict[str, Any]:
+        """Claves de metadata nuevas o modificadas desde la última carga/guardado."""
+        return {
+            key: value
+            for key, value in self.metadata.items()
+            if self._persisted_metadata.get(key)
+            != self._serialize_metadata_value(value)
+        }
+
     def add_message(self, message: Message):
         """Añade un mensaje a la conversación."""
         self.messages.append(message)
@@ -14,7 +14,8 @@ class Message(BaseModel):
     role: Literal["user", "assistant", "system"]
     content: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
-    # Otros campos opcionales como 'metadata', 'token_count', etc. podrían ir aquí
+    # Tokens del mensaje (se calcula una vez al guardarlo; None en mensajes antiguos)
+    token_count: Optional[int] = None
 
     @classmethod
     def user(cls, content: str):
@@ -1,54 +1,239 @@
 # app/prompts/main_prompt_llm_driven.py
-import os
+import re
 import logging  # Importar logging
+import unicodedata
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.config import settings
+from app.prompts.prompt_assets import (
+    CompiledTemplate,
+    PROPOSAL_FORMAT_PATH,
+    QUESTIONNAIRE_PATH,
+    prompt_asset_cache,
+)
+from app.services.questionnaire_service import QuestionnairePath, questionnaire_service
 
 logger = logging.getLogger("hydrous")  # Obtener logger
 
+# Nombres de subsector usados en cuestionario_completo.txt que no coinciden
+# con los de QUESTIONNAIRE_STRUCTURE (ya normalizados con _normalize_name)
+SUBSECTOR_TEXT_ALIASES = {
+    "petroleoygas": "oilandgas",
+    "hotel": "hotelero",
+    "gobiernodelaciudad": "municipiosestados",
+    "autoridaddeserviciosdeagua": "municipiosestados",
+    "puebloaldea": "puebloaldeavilla",
+    "viviendaunifamiliar": "casahabitacion",
+    "edificiomultifamiliar": "casahabitacion",
+}
 
-# Función para cargar cuestionario (sin cambios)
+# Función para cargar cuestionario (desde la caché en proceso)
 def load_questionnaire_content_for_prompt():
-    try:
-        q_path = os.path.join(os.path.dirname(__file__), "cuestionario_completo.txt")
-        if os.path.exists(q_path):
-            with open(q_path, "r", encoding="utf-8") as f:
-                return f.read()
+    text = prompt_asset_cache.get_text(QUESTIONNAIRE_PATH)
+    if text is None:
+        logger.error("Archivo cuestionario_completo.txt no disponible en app/prompts/")
+        return "[ERROR: Archivo cuestionario_completo.txt no encontrado]"
+    return text
+
+
+# Función para cargar formato propuesta (desde la caché en proceso)
+def load_proposal_format_content():
+    text = prompt_asset_cache.get_text(PROPOSAL_FORMAT_PATH)
+    if text is None:
+        logger.error("Archivo Format Proposal.txt no disponible en app/prompts/")
+        return "[ERROR: Archivo Format Proposal.txt no encontrado]"
+    return text
+
+def _normalize_name(name: Optional[str]) -> str:
+    """Normaliza nombres de sector/subsector (sin acentos, minúsculas, solo alfanuméricos)."""
+    if not name:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", str(name))
+    ascii_name = decomposed.encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[^a-z0-9]", "", ascii_name.lower())
+
+
+def split_questionnaire_sections(
+    questionnaire_text: str,
+) -> Tuple[str, Dict[Tuple[str, str], str]]:
+    """
+    Divide el cuestionario completo en el bloque inicial (preguntas comunes)
+    y un diccionario de secciones por (sector, subsector) normalizados.
+    """
+    preamble_lines: List[str] = []
+    sections: Dict[Tuple[str, str], List[str]] = {}
+    current_key: Optional[Tuple[str, str]] = None
+    pending_sector: Optional[str] = None
+
+    for line in questionnaire_text.splitlines():
+        stripped = line.strip()
+        if stripped.startswith("Sector:"):
+            pending_sector = _normalize_name(stripped[len("Sector:") :])
+            current_key = None
+            sector_line = line
+            continue
+        if pending_sector is not None and stripped.startswith("Subsector:"):
+            current_key = (pending_sector, _normalize_name(stripped[len("Subsector:") :]))
+            sections[current_key] = [sector_line, line]
+            pending_sector = None
+            continue
+
+        if current_key is not None:
+            sections[current_key].append(line)
         else:
-            logger.error(
-                "Archivo cuestionario_completo.txt no encontrado en app/prompts/"
+            preamble_lines.append(line)
+
+    return (
+        "\n".join(preamble_lines).strip(),
+        {key: "\n".join(lines).strip() for key, lines in sections.items()},
+    )
+
+
+def _get_question_position(path: QuestionnairePath, metadata: Dict[str, Any]) -> int:
+    """Posición aproximada de la conversación dentro de la ruta de preguntas."""
+    index = path.position(metadata.get("current_question_id"))
+    if index is not None:
+        return index
+    # Si el ID no pertenece a la ruta, estimar por número de respuestas recogidas
+    answered = len(metadata.get("collected_data") or {})
+    return min(answered, max(len(path) - 1, 0))
+
+
+def _format_nearby_questions(
+    questions: Sequence[Dict[str, Any]], position: int, window: int
+) -> str:
+    """Formatea la pregunta actual y las siguientes `window` preguntas de la ruta."""
+    if not questions or window <= 0:
+        return ""
+    lines = []
+    for question in questions[max(position - 1, 0) : position + window + 1]:
+        lines.append(f"- [{question['id']}] {question.get('text', '')}")
+        options = question.get("options")
+        if options:
+            lines.append(f"  Options: {', '.join(str(o) for o in options)}")
+    return "\n".join(lines)
+
+
+def build_targeted_prompt_sections(metadata: Dict[str, Any]) -> Tuple[str, str]:
+    """
+    Construye las partes variables del prompt en modo "targeted". Las preguntas
+    iniciales y el formato de propuesta van en el prefijo estático.
+
+    Returns:
+        (sección del cuestionario del sector/subsector, preguntas cercanas)
+    """
+    sector = metadata.get("selected_sector") or metadata.get("sector")
+    subsector = metadata.get("selected_subsector") or metadata.get("subsector")
+
+    _, sections = prompt_asset_cache.get_derived(
+        "questionnaire_sections",
+        (QUESTIONNAIRE_PATH,),
+        lambda text: split_questionnaire_sections(text or ""),
+    )
+
+    section_text = ""
+    if sector and subsector:
+        sector_key = _normalize_name(sector)
+        subsector_key = _normalize_name(subsector)
+        subsector_key = SUBSECTOR_TEXT_ALIASES.get(subsector_key, subsector_key)
+        section_text = sections.get((sector_key, subsector_key), "")
+        if not section_text:
+            logger.info(
+                f"Sin sección de cuestionario para {sector}/{subsector}. Usando solo preguntas iniciales."
             )
-            return "[ERROR: Archivo cuestionario_completo.txt no encontrado]"
-    except Exception as e:
-        logger.error(f"Error cargando cuestionario para prompt: {e}", exc_info=True)
-        return "[ERROR AL CARGAR CUESTIONARIO]"
 
+    path = questionnaire_service.get_path(sector, subsector)
+    position = _get_question_position(path, metadata)
+    nearby_questions = _format_nearby_questions(
+        path.questions, position, settings.PROMPT_NEARBY_QUESTIONS
+    )
 
-# Función para cargar formato propuesta (sin cambios)
-def load_proposal_format_content():
+    return section_text, nearby_questions
+
+
+def _count_prompt_tokens(prompt: str) -> Optional[int]:
+    """Cuenta tokens del prompt de sistema; None si no es posible contarlos."""
     try:
-        format_path = os.path.join(os.path.dirname(__file__), "Format Proposal.txt")
-        if os.path.exists(format_path):
-            with open(format_path, "r", encoding="utf-8") as f:
-                return f.read()
-        else:
-            logger.error("Archivo Format Proposal.txt no encontrado en app/prompts/")
-            return "[ERROR: Archivo Format Proposal.txt no encontrado]"
+        from app.utils.token_counter import count_tokens
+
+        return count_tokens([{"role": "system", "content": prompt}], model=settings.MODEL)
     except Exception as e:
-        logger.error(f"Error cargando formato de propuesta: {e}", exc_info=True)
-        return "[ERROR AL CARGAR FORMATO PROPUESTA]"
+        logger.warning(f"No se pudieron contar tokens del prompt: {e}")
+        return None
+
 
+def _truncate_to_ratio(text: str, ratio: float) -> str:
+    """Recorta el texto a una fracción de su longitud, cortando en salto de línea."""
+    if ratio <= 0:
+        return ""
+    cut = text[: int(len(text) * ratio)]
+    last_newline = cut.rfind("\n")
+    return cut[:last_newline] if last_newline > 0 else cut
 
-def get_llm_driven_master_prompt(metadata: dict = None):
+
+def _apply_token_budget(
+    render, static_prefix: str, section_text: str, nearby_questions: str
+) -> Tuple[str, str, str]:
     """
-    Genera el prompt maestro para que el LLM maneje el flujo del cuestionario.
+    Garantiza que el prompt renderizado (prefijo + contextos) no exceda
+    PROMPT_TOKEN_BUDGET. Primero descarta las preguntas cercanas y después
+    recorta la sección del cuestionario; el prefijo estático no se toca.
     """
-    if metadata is None:
-        metadata = {}
 
-    # Cargar contenidos
-    full_questionnaire_text = load_questionnaire_content_for_prompt()
-    proposal_format_text = load_proposal_format_content()
+    def count(parts: Tuple[str, str, str]) -> Optional[int]:
+        return _count_prompt_tokens("\n\n".join(parts))
+
+    budget = settings.PROMPT_TOKEN_BUDGET
+    parts = render(static_prefix, section_text, nearby_questions)
+    tokens = count(parts)
+    if tokens is None or tokens <= budget:
+        return parts
+
+    logger.warning(
+        f"Prompt excede el presupuesto ({tokens} > {budget} tokens). Recortando contexto."
+    )
+    nearby_questions = ""
+    parts = render(static_prefix, section_text, nearby_questions)
+    tokens = count(parts)
+
+    attempts = 0
+    while tokens is not None and tokens > budget and section_text and attempts < 3:
+        fixed_tokens = count(render(static_prefix, "", "")) or 0
+        slice_tokens = max(tokens - fixed_tokens, 1)
+        ratio = (budget - fixed_tokens) / slice_tokens
+        section_text = _truncate_to_ratio(section_text, ratio * 0.95)
+        parts = render(static_prefix, section_text, nearby_questions)
+        tokens = count(parts)
+        attempts += 1
 
-    system_prompt_template = """
+    logger.info(f"Prompt recortado a {tokens} tokens (presupuesto: {budget}).")
+    return parts
+
+
+def _check_prefix_cacheable(name: str, static_prefix: str) -> str:
+    """
+    Avisa si el prefijo estático no llega al mínimo de tokens que el proveedor
+    exige para cachearlo (PROMPT_CACHE_MIN_TOKENS). Se llama al construir el
+    prefijo, es decir, una vez por versión de los archivos del prompt.
+    """
+    tokens = _count_prompt_tokens(static_prefix)
+    if tokens is None:
+        return static_prefix
+    if tokens < settings.PROMPT_CACHE_MIN_TOKENS:
+        logger.warning(
+            f"Prefijo del prompt '{name}' con {tokens} tokens, por debajo del mínimo "
+            f"de caché del proveedor ({settings.PROMPT_CACHE_MIN_TOKENS}). "
+            f"No habrá aciertos de caché."
+        )
+    else:
+        logger.info(f"Prefijo del prompt '{name}': {tokens} tokens (cacheable).")
+    return static_prefix
+
+
+# Instrucciones del prompt maestro: constantes, idénticas byte a byte para
+# todos los usuarios y estados. Van siempre primero para que el proveedor
+# pueda reutilizar su caché de prompt.
+SYSTEM_PROMPT_INSTRUCTIONS = """
 # **YOU ARE THE HYDROUS AI WATER SOLUTION DESIGNER**
 
 You are a friendly and professional expert water solutions consultant who guides users in developing customized wastewater treatment and recycling solutions. Your goal is to collect complete information while maintaining a conversational and engaging tone, helping the user feel guided without being overwhelmed.
@@ -65,14 +250,6 @@ You are a friendly and professional expert water solutions consultant who guides
 * If you already know the user's name, location, sector, or subsector, **DO NOT ask again**
 * Instead, confirm the information: "I see you're in the [sector] industry in [location]..."
 
-## **EXISTING USER INFORMATION**
-- User Name: {metadata_user_name}
-- User Email: {metadata_user_email}
-- User Location: {metadata_user_location}
-- Company Name: {metadata_company_name}
-- Selected Sector: {metadata_selected_sector}  
-- Selected Subsector: {metadata_selected_subsector}
-
 ## **QUESTIONNAIRE FLOW**
 * IF user information is already available, SKIP those questions
 * Start with the NEXT relevant question after the information you already have
@@ -110,22 +287,101 @@ You are a friendly and professional expert water solutions consultant who guides
 * Include specific numerical data in your insights (percentages, ranges, efficiencies)  
 * Every 3-4 questions, provide a short summary of the information collected so far
 
-## **REFERENCE QUESTIONNAIRE**
-{full_questionnaire_text_placeholder}
-
-## **PROPOSAL TEMPLATE**
-{proposal_format_text_placeholder}
-
 ## **FINAL PROPOSAL GENERATION**
 * Once the questionnaire is completed, DO NOT generate the proposal directly in the chat  
 * Instead, you MUST end your response with EXACTLY this text:  
   "[PROPOSAL_COMPLETE: This proposal is ready to be downloaded as a PDF]"  
 * Do not include the proposal in the chat – only indicate it has been completed  
 * This special marker is CRITICAL to trigger the automatic PDF generation
+"""
 
+# Material de referencia. En modo "full" lleva el cuestionario completo; en
+# modo "targeted", solo las preguntas iniciales (comunes a todos los sectores).
+# En ambos casos es igual para todos y va en el prefijo estático.
+REFERENCE_TEMPLATE = """
+## **REFERENCE QUESTIONNAIRE**
+{full_questionnaire_text_placeholder}
+
+## **PROPOSAL TEMPLATE**
+{proposal_format_text_placeholder}
+"""
+
+# Contexto de la conversación: cambia poco entre turnos (sector y datos del
+# usuario). Va en un mensaje de sistema aparte, después del prefijo y antes
+# del historial.
+CONVERSATION_CONTEXT_TEMPLATE = """
+{sector_questionnaire_placeholder}
+## **EXISTING USER INFORMATION**
+- User Name: {metadata_user_name}
+- User Email: {metadata_user_email}
+- User Location: {metadata_user_location}
+- Company Name: {metadata_company_name}
+- Selected Sector: {metadata_selected_sector}  
+- Selected Subsector: {metadata_selected_subsector}
+"""
+
+# Estado del turno: cambia en cada mensaje, así que va DESPUÉS del historial
+# para no invalidar la caché del proveedor sobre los mensajes anteriores.
+TURN_CONTEXT_TEMPLATE = """
+## **CURRENT POSITION**
+- Last Question Asked: {metadata_current_question_asked_summary}
+{nearby_questions_placeholder}
 **FINAL INSTRUCTION:** Analyze the user's response, provide a relevant educational insight for their sector, and ask ONE FOLLOW-UP question from the questionnaire. If the questionnaire is complete, generate the final proposal using the specified format.
 """
 
+COMPILED_REFERENCE = CompiledTemplate.compile(REFERENCE_TEMPLATE)
+COMPILED_CONVERSATION_CONTEXT = CompiledTemplate.compile(CONVERSATION_CONTEXT_TEMPLATE)
+COMPILED_TURN_CONTEXT = CompiledTemplate.compile(TURN_CONTEXT_TEMPLATE)
+
+
+def _render_prefix(questionnaire_text, proposal_format_text):
+    """Instrucciones + material de referencia."""
+    reference = COMPILED_REFERENCE.render(
+        full_questionnaire_text_placeholder=(
+            questionnaire_text
+            or "[ERROR: Archivo cuestionario_completo.txt no encontrado]"
+        ),
+        proposal_format_text_placeholder=(
+            proposal_format_text or "[ERROR: Archivo Format Proposal.txt no encontrado]"
+        ),
+    )
+    return SYSTEM_PROMPT_INSTRUCTIONS + reference
+
+
+def _build_full_prefix(questionnaire_text, proposal_format_text):
+    """Prefijo del modo "full": instrucciones + cuestionario y formato completos."""
+    return _check_prefix_cacheable(
+        "full", _render_prefix(questionnaire_text, proposal_format_text)
+    )
+
+
+def _build_targeted_prefix(questionnaire_text, proposal_format_text):
+    """
+    Prefijo del modo "targeted": instrucciones + preguntas iniciales + formato
+    de propuesta. Solo las instrucciones no llegan al mínimo de caché.
+    """
+    preamble, _ = split_questionnaire_sections(questionnaire_text or "")
+    return _check_prefix_cacheable(
+        "targeted", _render_prefix(preamble, proposal_format_text)
+    )
+
+
+def get_llm_driven_prompt_parts(metadata: dict = None) -> Tuple[str, str, str]:
+    """
+    Genera el prompt para que el LLM maneje el flujo del cuestionario, en tres
+    partes, de la más estable a la más volátil:
+
+    - Prefijo estático: instrucciones, formato de propuesta y cuestionario
+      (completo en modo "full"; solo las preguntas iniciales en "targeted").
+      Es el mismo para todos los usuarios, así que el proveedor puede cachearlo.
+    - Contexto de la conversación: la sección del cuestionario de su sector
+      (modo "targeted") y los datos conocidos del usuario. Va antes del historial.
+    - Contexto del turno: pregunta actual y preguntas cercanas. Va después del
+      historial.
+    """
+    if metadata is None:
+        metadata = {}
+
     # Definir variables incluyendo company_name
     metadata_user_name = metadata.get("user_name", "Not provided")
     metadata_user_email = metadata.get("user_email", "Not provided")
@@ -139,28 +395,60 @@ You are a friendly and professional expert water solutions consultant who guides
         metadata.get("current_question_asked_summary", "None (Start of conversation)")
         or "None (Start of conversation)"
     )
-    metadata_is_complete = metadata.get("is_complete", False)
-    last_user_message_placeholder = (
-        metadata.get("last_user_message_content", "N/A") or "N/A"
+
+    # Campos por usuario (solo en el contexto, nunca en el prefijo estático)
+    metadata_fields = dict(
+        metadata_user_name=metadata_user_name,
+        metadata_user_email=metadata_user_email,
+        metadata_user_location=metadata_user_location,
+        metadata_company_name=metadata_company_name,
+        metadata_selected_sector=metadata_selected_sector,
+        metadata_selected_subsector=metadata_selected_subsector,
     )
 
-    # Formatear el prompt final
-    try:
-        system_prompt = system_prompt_template.format(
-            metadata_user_name=metadata_user_name,
-            metadata_user_email=metadata_user_email,
-            metadata_user_location=metadata_user_location,
-            metadata_company_name=metadata_company_name,
-            metadata_selected_sector=metadata_selected_sector,
-            metadata_selected_subsector=metadata_selected_subsector,
+    def render(static_prefix, section_text, nearby_questions):
+        sector_block = (
+            f"## **SECTOR QUESTIONNAIRE**\n{section_text}\n" if section_text else ""
+        )
+        nearby_block = (
+            f"\n### **QUESTIONS AROUND THE CURRENT POSITION**\n{nearby_questions}\n"
+            if nearby_questions
+            else ""
+        )
+        conversation_context = COMPILED_CONVERSATION_CONTEXT.render(
+            sector_questionnaire_placeholder=sector_block,
+            **metadata_fields,
+        ).strip()
+        turn_context = COMPILED_TURN_CONTEXT.render(
             metadata_current_question_asked_summary=metadata_current_question_asked_summary,
-            metadata_is_complete=metadata_is_complete,
-            full_questionnaire_text_placeholder=full_questionnaire_text,
-            proposal_format_text_placeholder=proposal_format_text,
-            last_user_message_placeholder=last_user_message_placeholder,
+            nearby_questions_placeholder=nearby_block,
+        ).strip()
+        return static_prefix, conversation_context, turn_context
+
+    try:
+        if settings.PROMPT_ASSEMBLY_MODE == "full":
+            static_prefix = prompt_asset_cache.get_derived(
+                "full_prompt_prefix",
+                (QUESTIONNAIRE_PATH, PROPOSAL_FORMAT_PATH),
+                _build_full_prefix,
+            )
+            return render(static_prefix, "", "")
+
+        static_prefix = prompt_asset_cache.get_derived(
+            "targeted_prompt_prefix",
+            (QUESTIONNAIRE_PATH, PROPOSAL_FORMAT_PATH),
+            _build_targeted_prefix,
         )
+        section_text, nearby_questions = build_targeted_prompt_sections(metadata)
+        return _apply_token_budget(render, static_prefix, section_text, nearby_questions)
     except KeyError as e:
         logger.error(f"Missing key when formatting main prompt: {e}", exc_info=True)
-        system_prompt = f"# ROLE AND OBJECTIVE...\n\n# INSTRUCTION:\nContinue the conversation. Error formatting status: {e}"
+        return (
+            "# ROLE AND OBJECTIVE...",
+            "",
+            f"# INSTRUCTION:\nContinue the conversation. Error formatting status: {e}",
+        )
+
 
-    return system_prompt
+# Cargar los archivos del prompt una sola vez al importar (por worker)
+prompt_asset_cache.warm()
@@ -0,0 +1,131 @@
+# app/prompts/prompt_assets.py
+import os
+import time
+import logging
+import threading
+from string import Formatter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.config import settings
+
+logger = logging.getLogger("hydrous")
+
+PROMPTS_DIR = os.path.dirname(__file__)
+QUESTIONNAIRE_PATH = os.path.join(PROMPTS_DIR, "cuestionario_completo.txt")
+PROPOSAL_FORMAT_PATH = os.path.join(PROMPTS_DIR, "Format Proposal.txt")
+
+
+class CompiledTemplate:
+    """
+    Plantilla tipo str.format pre-procesada una sola vez: en cada petición
+    solo se sustituyen los campos.
+    """
+
+    def __init__(self, parts: List[Tuple[str, Optional[str]]]):
+        self._parts = parts
+        self.field_names = {field for _, field in parts if field is not None}
+
+    @classmethod
+    def compile(cls, template: str) -> "CompiledTemplate":
+        parts = [
+            (literal, field_name)
+            for literal, field_name, _, _ in Formatter().parse(template)
+        ]
+        return cls(parts)
+
+    def render(self, **values: Any) -> str:
+        """Sustituye los campos. Lanza KeyError si falta alguno."""
+        chunks = []
+        for literal, field_name in self._parts:
+            chunks.append(literal)
+            if field_name is not None:
+                chunks.append(str(values[field_name]))
+        return "".join(chunks)
+
+
+class PromptAssetCache:
+    """
+    Caché en proceso de los archivos fuente del prompt.
+
+    - Cada archivo se lee una vez por worker.
+    - Se invalida cuando cambia el mtime del archivo (comprobado como
+      máximo cada `check_interval` segundos para no hacer stat en cada llamada).
+    - Los valores derivados (secciones, esqueletos) se recalculan solo
+      cuando cambia la versión de los archivos de los que dependen.
+    """
+
+    def __init__(self, check_interval: float = 5.0):
+        self.check_interval = check_interval
+        self._files: Dict[str, Dict[str, Any]] = {}
+        self._derived: Dict[str, Tuple[Tuple[float, ...], Any]] = {}
+        self._lock = threading.Lock()
+
+    def _refresh(self, path: str) -> float:
+        """Recarga el archivo si cambió y devuelve su versión (mtime, -1 si no existe)."""
+        now = time.monotonic()
+        entry = self._files.get(path)
+        if entry and now - entry["checked_at"] < self.check_interval:
+            return entry["mtime"]
+
+        with self._lock:
+            entry = self._files.get(path)
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                if entry is None or entry["mtime"] != -1:
+                    logger.error(f"Archivo de prompt no encontrado: {path}")
+                self._files[path] = {"mtime": -1, "text": None, "checked_at": now}
+                return -1
+
+            if entry is None or entry["mtime"] != mtime:
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        text = f.read()
+                except Exception as e:
+                    logger.error(f"Error leyendo archivo de prompt {path}: {e}", exc_info=True)
+                    self._files[path] = {"mtime": -1, "text": None, "checked_at": now}
+                    return -1
+                if entry is not None:
+                    logger.info(f"Archivo de prompt modificado, recargando: {path}")
+                self._files[path] = {"mtime": mtime, "text": text, "checked_at": now}
+            else:
+                entry["checked_at"] = now
+            return mtime
+
+    def get_text(self, path: str) -> Optional[str]:
+        """Devuelve el contenido del archivo (None si no existe o no se pudo leer)."""
+        self._refresh(path)
+        return self._files[path]["text"]
+
+    def get_derived(
+        self, key: str, paths: Tuple[str, ...], builder: Callable[..., Any]
+    ) -> Any:
+        """
+        Devuelve un valor derivado de uno o más archivos, recalculándolo
+        con `builder(*textos)` solo si alguno de los archivos cambió.
+        """
+        versions = tuple(self._refresh(path) for path in paths)
+        cached = self._derived.get(key)
+        if cached and cached[0] == versions:
+            return cached[1]
+
+        value = builder(*(self._files[path]["text"] for path in paths))
+        self._derived[key] = (versions, value)
+        return value
+
+    def warm(self, paths: Tuple[str, ...] = (QUESTIONNAIRE_PATH, PROPOSAL_FORMAT_PATH)):
+        """Carga los archivos por adelantado (al arrancar el worker)."""
+        for path in paths:
+            self._refresh(path)
+
+    def clear(self):
+        """Vacía la caché (útil en scripts y diagnósticos)."""
+        with self._lock:
+            self._files.clear()
+            self._derived.clear()
+
+
+# Instancia global
+prompt_asset_cache = PromptAssetCache(
+    check_interval=settings.PROMPT_ASSET_CHECK_INTERVAL
+)
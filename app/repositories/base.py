@@ -1,22 +1,18 @@
 from typing import Generic, TypeVar, Type, Optional, List, Any, Dict, Union
 from uuid import UUID
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from sqlalchemy.exc import SQLAlchemyError
 import logging
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 
-from app.db.base import Base
-from app.config import settings
+# Engine y sesiones compartidos por todo el proceso (un único pool)
+from app.db.base import Base, SessionLocal, engine
 
 # Configurar logger
 logger = logging.getLogger("hydrous")
 
-# Crear engine para usar en repositorios
-engine = create_engine(settings.DATABASE_URL)
-SessionLocal = sessionmaker(bind=engine)
-
 # Definir tipos genéricos
 ModelType = TypeVar("ModelType", bound=Base)
 CreateSchemaType = TypeVar("CreateSchemaType", bound=BaseModel)
@@ -46,6 +42,16 @@ class BaseRepository(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
             db.rollback()
             return None
 
+    async def get_async(self, db: AsyncSession, id: UUID) -> Optional[ModelType]:
+        """Obtener un registro por ID (sesión asíncrona)"""
+        try:
+            result = await db.execute(select(self.model).where(self.model.id == id))
+            return result.scalars().first()
+        except SQLAlchemyError as e:
+            logger.error(f"Error en get_async: {e}")
+            await db.rollback()
+            return None
+
     def get_multi(
         self, db: Session, *, skip: int = 0, limit: int = 100
     ) -> List[ModelType]:
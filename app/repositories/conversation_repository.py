@@ -1,6 +1,10 @@
+from datetime import datetime
 from typing import Optional, List, Dict, Any
 from uuid import UUID
-from sqlalchemy.orm import Session
+from sqlalchemy import delete, func, literal_column, select, update
+from sqlalchemy.dialects.postgresql import aggregate_order_by, insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 from sqlalchemy.exc import SQLAlchemyError
 import logging
 import json
@@ -8,6 +12,7 @@ import json
 from app.db.models.conversation import Conversation
 from app.db.models.message import Message
 from app.db.models.conversation_metadata import ConversationMetadata
+from app.db.models.document import Document
 from app.repositories.base import BaseRepository
 from app.schemas.database_schemas import ConversationCreate, ConversationUpdate
 
@@ -17,39 +22,137 @@ logger = logging.getLogger("hydrous")
 class ConversationRepository(
     BaseRepository[Conversation, ConversationCreate, ConversationUpdate]
 ):
-    def get_with_messages(self, db: Session, id: UUID) -> Optional[Conversation]:
+    """
+    Repositorio de conversaciones. Sus métodos propios son asíncronos
+    (AsyncSession) porque solo se usan desde rutas async.
+    """
+
+    async def get_with_messages(
+        self, db: AsyncSession, id: UUID
+    ) -> Optional[Conversation]:
         """Obtener una conversación con sus mensajes"""
         try:
-            return db.query(Conversation).filter(Conversation.id == id).first()
+            result = await db.execute(
+                select(Conversation)
+                .options(selectinload(Conversation.messages))
+                .where(Conversation.id == id)
+            )
+            return result.scalars().first()
         except SQLAlchemyError as e:
             logger.error(f"Error en get_with_messages: {e}")
             return None
 
-    def get_by_user_id(
-        self, db: Session, user_id: UUID, *, skip: int = 0, limit: int = 100
+    async def get_full(
+        self, db: AsyncSession, id: UUID, user_id: Optional[UUID] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Obtener conversación, mensajes ordenados y metadatos en UNA sola consulta.
+
+        Los mensajes y metadatos se agregan como JSON en subconsultas correlacionadas
+        (sin producto cartesiano de JOINs). Con user_id, la propiedad se comprueba
+        en el mismo WHERE: una conversación ajena no se carga y devuelve None.
+        """
+        try:
+            messages_json = (
+                select(
+                    func.coalesce(
+                        func.json_agg(
+                            aggregate_order_by(
+                                func.json_build_object(
+                                    "id",
+                                    Message.id,
+                                    "role",
+                                    Message.role,
+                                    "content",
+                                    Message.content,
+                                    "created_at",
+                                    Message.created_at,
+                                    "token_count",
+                                    Message.token_count,
+                                ),
+                                Message.created_at,
+                            )
+                        ),
+                        literal_column("'[]'::json"),
+                    )
+                )
+                .where(Message.conversation_id == Conversation.id)
+                .scalar_subquery()
+            )
+            metadata_json = (
+                select(
+                    func.json_object_agg(
+                        ConversationMetadata.key, ConversationMetadata.value
+                    )
+                )
+                .where(ConversationMetadata.conversation_id == Conversation.id)
+                .scalar_subquery()
+            )
+
+            query = select(
+                Conversation.id,
+                Conversation.user_id,
+                Conversation.created_at,
+                messages_json.label("messages"),
+                metadata_json.label("metadata"),
+            ).where(Conversation.id == id)
+            if user_id is not None:
+                query = query.where(Conversation.user_id == user_id)
+
+            result = await db.execute(query)
+            row = result.first()
+            if row is None:
+                return None
+
+            # asyncpg devuelve los tipos json como texto
+            messages = row.messages
+            if isinstance(messages, str):
+                messages = json.loads(messages)
+            metadata = row.metadata
+            if isinstance(metadata, str):
+                metadata = json.loads(metadata)
+
+            return {
+                "id": row.id,
+                "user_id": row.user_id,
+                "created_at": row.created_at,
+                "messages": messages or [],
+                "metadata": metadata or {},
+            }
+        except SQLAlchemyError as e:
+            logger.error(f"Error en get_full: {e}")
+            return None
+
+    async def get_by_user_id(
+        self, db: AsyncSession, user_id: UUID, *, skip: int = 0, limit: int = 100
     ) -> List[Conversation]:
-        """Obtener conversaciones de un usuario"""
+        """Obtener conversaciones de un usuario (con sus mensajes precargados)"""
         try:
-            return (
-                db.query(Conversation)
-                .filter(Conversation.user_id == user_id)
+            result = await db.execute(
+                select(Conversation)
+                .options(selectinload(Conversation.messages))
+                .where(Conversation.user_id == user_id)
                 .offset(skip)
                 .limit(limit)
-                .all()
             )
+            return list(result.scalars().all())
         except SQLAlchemyError as e:
             logger.error(f"Error en get_by_user_id: {e}")
             return []
 
-    def create_with_metadata(
-        self, db: Session, *, obj_in: Dict[str, Any], metadata: Dict[str, Any] = None
+    async def create_with_metadata(
+        self,
+        db: AsyncSession,
+        *,
+        obj_in: Dict[str, Any],
+        metadata: Dict[str, Any] = None,
     ) -> Optional[Conversation]:
         """Crear una conversación con metadatos iniciales"""
         try:
             # Crear conversación
             db_conversation = Conversation(**obj_in)
             db.add(db_conversation)
-            db.flush()  # Para obtener el ID sin hacer commit todavía
+            await db.flush()  # Para obtener el ID sin hacer commit todavía
 
             # Añadir metadatos si existen
             if metadata:
@@ -63,82 +166,142 @@ class ConversationRepository(
                         )
                         db.add(metadata_item)
 
-            db.commit()
-            db.refresh(db_conversation)
+            await db.commit()
+            await db.refresh(db_conversation)
             return db_conversation
         except SQLAlchemyError as e:
             logger.error(f"Error en create_with_metadata: {e}")
-            db.rollback()
+            await db.rollback()
             return None
 
-    def update_metadata(
-        self, db: Session, *, conversation_id: UUID, key: str, value: Any
+    async def update_fields(
+        self,
+        db: AsyncSession,
+        *,
+        conversation_id: UUID,
+        values: Dict[str, Any],
+        commit: bool = True,
     ) -> bool:
-        """Actualizar o crear un ítem de metadatos"""
+        """
+        Actualizar columnas de la conversación con un único UPDATE (sin cargarla antes).
+        Devuelve False si la conversación no existe.
+        """
         try:
-            # Buscar si existe
-            metadata_item = (
-                db.query(ConversationMetadata)
-                .filter(
-                    ConversationMetadata.conversation_id == conversation_id,
-                    ConversationMetadata.key == key,
-                )
-                .first()
+            result = await db.execute(
+                update(Conversation)
+                .where(Conversation.id == conversation_id)
+                .values(**values)
             )
+            if commit:
+                await db.commit()
+            return result.rowcount > 0
+        except SQLAlchemyError as e:
+            logger.error(f"Error en update_fields: {e}")
+            await db.rollback()
+            return False
 
-            if metadata_item:
-                # Actualizar existente
-                metadata_item.value = value
-            else:
-                # Crear nuevo
-                metadata_item = ConversationMetadata(
-                    conversation_id=conversation_id, key=key, value=value
-                )
-                db.add(metadata_item)
+    async def update_metadata(
+        self, db: AsyncSession, *, conversation_id: UUID, key: str, value: Any
+    ) -> bool:
+        """Actualizar o crear un ítem de metadatos"""
+        return await self.upsert_metadata(
+            db, conversation_id=conversation_id, items={key: value}
+        )
 
-            db.commit()
+    async def upsert_metadata(
+        self,
+        db: AsyncSession,
+        *,
+        conversation_id: UUID,
+        items: Dict[str, Any],
+        commit: bool = True,
+    ) -> bool:
+        """
+        Insertar o actualizar varios ítems de metadatos en una sola sentencia
+        (INSERT ... ON CONFLICT (conversation_id, key) DO UPDATE).
+        """
+        if not items:
+            return True
+        try:
+            stmt = pg_insert(ConversationMetadata).values(
+                [
+                    {"conversation_id": conversation_id, "key": key, "value": value}
+                    for key, value in items.items()
+                ]
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[
+                    ConversationMetadata.conversation_id,
+                    ConversationMetadata.key,
+                ],
+                set_={
+                    "value": stmt.excluded.value,
+                    "updated_at": datetime.utcnow(),
+                },
+            )
+            await db.execute(stmt)
+
+            if commit:
+                await db.commit()
             return True
         except SQLAlchemyError as e:
-            logger.error(f"Error en update_metadata: {e}")
-            db.rollback()
+            logger.error(f"Error en upsert_metadata: {e}")
+            await db.rollback()
             return False
 
-    def get_metadata(self, db: Session, *, conversation_id: UUID) -> Dict[str, Any]:
+    async def get_metadata(
+        self, db: AsyncSession, *, conversation_id: UUID
+    ) -> Dict[str, Any]:
         """Obtener todos los metadatos de una conversación"""
         try:
-            metadata_items = (
-                db.query(ConversationMetadata)
-                .filter(ConversationMetadata.conversation_id == conversation_id)
-                .all()
+            result = await db.execute(
+                select(ConversationMetadata.key, ConversationMetadata.value).where(
+                    ConversationMetadata.conversation_id == conversation_id
+                )
             )
 
             # Convertir a diccionario
             metadata_dict = {}
-            for item in metadata_items:
-                metadata_dict[item.key] = item.value
+            for key, value in result.all():
+                metadata_dict[key] = value
 
             return metadata_dict
         except SQLAlchemyError as e:
             logger.error(f"Error en get_metadata: {e}")
             return {}
 
-    def get_old_conversations(
-        self, db: Session, *, older_than_seconds: int
+    async def get_old_conversations(
+        self, db: AsyncSession, *, older_than_seconds: int
     ) -> List[Conversation]:
         """Obtener conversaciones antiguas para limpieza"""
         from datetime import datetime, timedelta
 
         try:
             cutoff_date = datetime.utcnow() - timedelta(seconds=older_than_seconds)
-            return (
-                db.query(Conversation)
-                .filter(Conversation.created_at < cutoff_date)
-                .all()
+            result = await db.execute(
+                select(Conversation).where(Conversation.created_at < cutoff_date)
             )
+            return list(result.scalars().all())
         except SQLAlchemyError as e:
             logger.error(f"Error en get_old_conversations: {e}")
             return []
 
+    async def remove_with_children(self, db: AsyncSession, *, id: UUID) -> bool:
+        """
+        Eliminar una conversación con sus mensajes, metadatos y documentos.
+        Usa DELETE explícitos (con AsyncSession no hay carga perezosa para la cascada ORM).
+        """
+        try:
+            for model in (Message, ConversationMetadata, Document):
+                await db.execute(delete(model).where(model.conversation_id == id))
+            result = await db.execute(delete(Conversation).where(Conversation.id == id))
+            await db.commit()
+            return result.rowcount > 0
+        except SQLAlchemyError as e:
+            logger.error(f"Error en remove_with_children: {e}")
+            await db.rollback()
+            return False
+
 
 # Instanciar repositorio - CORREGIDO
 conversation_repository = ConversationRepository(Conversation)
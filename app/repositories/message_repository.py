@@ -1,6 +1,7 @@
-from typing import Optional, List
+from typing import Optional, List, Dict, Any
 from uuid import UUID
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
 import logging
 
@@ -12,73 +13,141 @@ logger = logging.getLogger("hydrous")
 
 
 class MessageRepository(BaseRepository[Message, MessageCreate, MessageUpdate]):
-    def get_by_conversation_id(
-        self, db: Session, conversation_id: UUID
+    """
+    Repositorio de mensajes. Sus métodos propios son asíncronos
+    (AsyncSession) porque solo se usan desde rutas async.
+    """
+
+    async def get_by_conversation_id(
+        self, db: AsyncSession, conversation_id: UUID
     ) -> List[Message]:
         """Obtener todos los mensajes de una conversación ordenados por fecha"""
         try:
-            return (
-                db.query(Message)
-                .filter(Message.conversation_id == conversation_id)
+            result = await db.execute(
+                select(Message)
+                .where(Message.conversation_id == conversation_id)
                 .order_by(Message.created_at)
-                .all()
             )
+            return list(result.scalars().all())
         except SQLAlchemyError as e:
             logger.error(f"Error en get_by_conversation_id: {e}")
             return []
 
-    def create_user_message(
-        self, db: Session, *, conversation_id: UUID, content: str
+    async def _create_message(
+        self,
+        db: AsyncSession,
+        *,
+        conversation_id: UUID,
+        role: RoleEnum,
+        content: str,
+        token_count: Optional[int] = None,
     ) -> Optional[Message]:
-        """Crear un mensaje de usuario"""
+        """Crear un mensaje con el rol indicado"""
         try:
             message = Message(
-                conversation_id=conversation_id, role=RoleEnum.user, content=content
+                conversation_id=conversation_id,
+                role=role,
+                content=content,
+                token_count=token_count,
             )
             db.add(message)
-            db.commit()
-            db.refresh(message)
+            await db.commit()
+            await db.refresh(message)
             return message
         except SQLAlchemyError as e:
-            logger.error(f"Error en create_user_message: {e}")
-            db.rollback()
+            logger.error(f"Error creando mensaje '{role.value}': {e}")
+            await db.rollback()
             return None
 
-    def create_assistant_message(
-        self, db: Session, *, conversation_id: UUID, content: str
+    async def create_user_message(
+        self,
+        db: AsyncSession,
+        *,
+        conversation_id: UUID,
+        content: str,
+        token_count: Optional[int] = None,
+    ) -> Optional[Message]:
+        """Crear un mensaje de usuario"""
+        return await self._create_message(
+            db,
+            conversation_id=conversation_id,
+            role=RoleEnum.user,
+            content=content,
+            token_count=token_count,
+        )
+
+    async def create_assistant_message(
+        self,
+        db: AsyncSession,
+        *,
+        conversation_id: UUID,
+        content: str,
+        token_count: Optional[int] = None,
     ) -> Optional[Message]:
         """Crear un mensaje del asistente"""
-        try:
-            message = Message(
-                conversation_id=conversation_id,
-                role=RoleEnum.assistant,
-                content=content,
-            )
-            db.add(message)
-            db.commit()
-            db.refresh(message)
-            return message
-        except SQLAlchemyError as e:
-            logger.error(f"Error en create_assistant_message: {e}")
-            db.rollback()
-            return None
+        return await self._create_message(
+            db,
+            conversation_id=conversation_id,
+            role=RoleEnum.assistant,
+            content=content,
+            token_count=token_count,
+        )
 
-    def create_system_message(
-        self, db: Session, *, conversation_id: UUID, content: str
+    async def create_system_message(
+        self,
+        db: AsyncSession,
+        *,
+        conversation_id: UUID,
+        content: str,
+        token_count: Optional[int] = None,
     ) -> Optional[Message]:
         """Crear un mensaje del sistema"""
+        return await self._create_message(
+            db,
+            conversation_id=conversation_id,
+            role=RoleEnum.system,
+            content=content,
+            token_count=token_count,
+        )
+
+    async def create_many(
+        self,
+        db: AsyncSession,
+        *,
+        conversation_id: UUID,
+        messages: List[Dict[str, Any]],
+        commit: bool = True,
+    ) -> bool:
+        """
+        Crear varios mensajes de una vez. Cada mensaje es un dict con
+        role y content (opcionalmente id, created_at y token_count).
+        """
+        if not messages:
+            return True
         try:
-            message = Message(
-                conversation_id=conversation_id, role=RoleEnum.system, content=content
-            )
-            db.add(message)
-            db.commit()
-            db.refresh(message)
-            return message
-        except SQLAlchemyError as e:
-            logger.error(f"Error en create_system_message: {e}")
-            db.rollback()
-            return None
+            for data in messages:
+                fields = {
+                    "conversation_id": conversation_id,
+                    "role": RoleEnum(data["role"]),
+                    "content": data["content"],
+                }
+                if data.get("id"):
+                    fields["id"] = UUID(str(data["id"]))
+                if data.get("created_at"):
+                    fields["created_at"] = data["created_at"]
+                if data.get("token_count") is not None:
+                    fields["token_count"] = data["token_count"]
+                db.add(Message(**fields))
+
+            if commit:
+                await db.commit()
+            else:
+                await db.flush()
+            return True
+        except (SQLAlchemyError, ValueError) as e:
+            logger.error(f"Error en create_many: {e}")
+            await db.rollback()
+            return False
 
 
 # Instanciar repositorio
@@ -2,13 +2,14 @@ from fastapi import APIRouter, HTTPException, Depends, Header, Request
 from typing import Optional
 import logging
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel, EmailStr  # AÑADIDO: EmailStr
 from sqlalchemy import text  # AÑADIDO: Para test de DB
 
 from app.models.user import UserCreate, User, LoginRequest
 from app.services.auth_service import auth_service
 from app.services.password_reset_service import password_reset_service  # AÑADIDO
-from app.db.base import get_db
+from app.db.base import get_async_db, get_db
 
 # Configuración del logger
 logger = logging.getLogger("hydrous")
@@ -25,7 +26,7 @@ class PasswordResetConfirm(BaseModel):
     new_password: str
 
 @router.post("/register", response_model=dict)
-async def register_user(user_data: UserCreate, db: Session = Depends(get_db)):
+def register_user(user_data: UserCreate, db: Session = Depends(get_db)):
     """Registra un nuevo usuario"""
     try:
         # Log detallado de los datos recibidos (sin contraseña)
@@ -67,7 +68,7 @@ async def register_user(user_data: UserCreate, db: Session = Depends(get_db)):
 
 
 @router.post("/login", response_model=dict)
-async def login_user(login_data: LoginRequest, db: Session = Depends(get_db)):
+def login_user(login_data: LoginRequest, db: Session = Depends(get_db)):
     """Inicia sesión de usuario"""
     try:
         # Autenticar usuario
@@ -111,7 +112,7 @@ async def login_user(login_data: LoginRequest, db: Session = Depends(get_db)):
 
 
 @router.get("/verify", response_model=dict)
-async def verify_token(authorization: Optional[str] = Header(None), db: Session = Depends(get_db)):
+async def verify_token(authorization: Optional[str] = Header(None), db: AsyncSession = Depends(get_async_db)):
     """Verifica si un token es válido"""
     try:
         # Verificar que hay un token
@@ -147,7 +148,7 @@ async def verify_token(authorization: Optional[str] = Header(None), db: Session
 
 
 @router.get("/me", response_model=dict)
-async def get_current_user(authorization: Optional[str] = Header(None), db: Session = Depends(get_db)):
+async def get_current_user(authorization: Optional[str] = Header(None), db: AsyncSession = Depends(get_async_db)):
     """Obtiene información del usuario actual"""
     try:
         # Verificar que hay un token
@@ -172,7 +173,7 @@ async def get_current_user(authorization: Optional[str] = Header(None), db: Sess
             )
 
         # Obtener usuario completo
-        user = auth_service.get_user_by_id(user_data["id"], db)
+        user = await auth_service.get_user_by_id(user_data["id"], db)
 
         if not user:
             raise HTTPException(
@@ -205,7 +206,7 @@ async def get_current_user(authorization: Optional[str] = Header(None), db: Sess
 
 # NUEVOS ENDPOINTS DE LOGOUT
 @router.post("/logout", response_model=dict)
-async def logout(request: Request, db: Session = Depends(get_db)):
+async def logout(request: Request, db: AsyncSession = Depends(get_async_db)):
     """Cierra sesión invalidando el token actual"""
     try:
         # Obtener el token del request
@@ -247,7 +248,7 @@ async def logout(request: Request, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail="Error en logout")
 
 @router.post("/logout-all", response_model=dict)
-async def logout_all_devices(request: Request, db: Session = Depends(get_db)):
+async def logout_all_devices(request: Request, db: AsyncSession = Depends(get_async_db)):
     """Cierra sesión en todos los dispositivos del usuario"""
     try:
         # Obtener el token del request
@@ -364,7 +365,7 @@ async def reset_password(request: PasswordResetConfirm):
 
 # ENDPOINT DE DIAGNÓSTICO TEMPORAL
 @router.get("/db-test")
-async def test_database_connection(db: Session = Depends(get_db)):
+def test_database_connection(db: Session = Depends(get_db)):
     """Endpoint temporal para probar la conectividad a la base de datos"""
     try:
         # Probar conexión básica
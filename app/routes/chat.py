@@ -1,15 +1,21 @@
 # app/routes/chat.py
 from fastapi import APIRouter, HTTPException, BackgroundTasks, Depends, Header, Request
-from fastapi.responses import FileResponse
+from fastapi.responses import (
+    JSONResponse,
+    RedirectResponse,
+    StreamingResponse,
+)
+import json
 import logging
 import os
 import uuid
 import re
 from datetime import datetime
-from typing import Any, Optional, Dict, List
+from typing import Any, Optional, Dict
+import anyio
 from pydantic import BaseModel
 from uuid import UUID
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 # Modelos
 from app.models.conversation import ConversationResponse, Conversation
@@ -19,14 +25,23 @@ from app.models.message import Message, MessageCreate
 from app.services.storage_service import storage_service
 from app.services.ai_service import ai_service
 from app.services.pdf_service import pdf_service
+from app.services.pdf_cache import pdf_cache
 from app.services.proposal_service import proposal_service
 from app.services.questionnaire_service import questionnaire_service
 from app.services.auth_service import auth_service
+from app.services.proposal_jobs import (
+    PROPOSAL_IN_PROGRESS_MESSAGE,
+    enqueue_proposal,
+    proposal_job_status_url,
+)
+from app.services.task_queue import ACTIVE_STATUSES, task_queue
 from app.config import settings
-from app.db.base import get_db
+from app.db.base import AsyncSessionLocal, get_async_db
 
 # Importar repositorios
 from app.repositories.conversation_repository import conversation_repository
+from app.utils.chat_intents import VERIFICATION_MESSAGE, is_pdf_request
+from app.utils.file_response import conditional_file_response
 
 router = APIRouter()
 logger = logging.getLogger("hydrous")
@@ -48,34 +63,6 @@ def get_current_user(request: Request):
     return request.state.user
 
 
-def _get_full_questionnaire_path(metadata: Dict[str, Any]) -> List[str]:
-    """Intenta construir la ruta completa del cuestionario."""
-    path = [
-        q["id"]
-        for q in questionnaire_service.structure.get("initial_questions", [])
-        if "id" in q
-    ]
-    sector = metadata.get("selected_sector")
-    subsector = metadata.get("selected_subsector")
-    if sector and subsector:
-        try:
-            sector_data = questionnaire_service.structure.get(
-                "sector_questionnaires", {}
-            ).get(sector, {})
-            subsector_questions = sector_data.get(subsector, [])
-            if not isinstance(subsector_questions, list):
-                subsector_questions = sector_data.get("Otro", [])
-            path.extend([q["id"] for q in subsector_questions if "id" in q])
-        except Exception as e:
-            logger.error(f"Error construyendo ruta en _get_full_path: {e}")
-            path = [
-                q["id"]
-                for q in questionnaire_service.structure.get("initial_questions", [])
-                if "id" in q
-            ]
-    return path
-
-
 def _is_last_question(
     current_question_id: Optional[str], metadata: Dict[str, Any]
 ) -> bool:
@@ -84,69 +71,216 @@ def _is_last_question(
         logger.debug("_is_last_question: No hay pregunta actual, retornando False")
         return False
 
-    # Obtener la ruta completa del cuestionario
-    path = metadata.get("questionnaire_path", [])
-    if not path:
-        # Si no existe, construirla
-        logger.debug(f"_is_last_question: Construyendo ruta para {current_question_id}")
-        path = _get_full_questionnaire_path(metadata)
-        metadata["questionnaire_path"] = path
-        logger.debug(
-            f"_is_last_question: Ruta construida: {path} (total: {len(path)} preguntas)"
-        )
+    # Ruta precalculada del sector/subsector actual (búsqueda O(1) por ID)
+    path = questionnaire_service.get_path(
+        metadata.get("selected_sector"), metadata.get("selected_subsector")
+    )
 
-    if not path:
+    if not len(path):
         logger.warning(
             "_is_last_question: No se pudo obtener ruta de preguntas, retornando False"
         )
         return False
 
-    try:
-        # Verificar posición en la ruta
-        current_index = path.index(current_question_id)
-        total_questions = len(path)
-        is_last = current_index == total_questions - 1
-
-        logger.debug(
-            f"_is_last_question: Pregunta {current_question_id} es la #{current_index+1} de {total_questions}"
-        )
-
-        if is_last:
-            logger.info(
-                f"¡ÚLTIMA PREGUNTA DETECTADA! ({current_question_id}) - Posición {current_index+1} de {total_questions}"
-            )
-        return is_last
-    except ValueError:
+    current_index = path.position(current_question_id)
+    if current_index is None:
         logger.warning(
-            f"_is_last_question: ID '{current_question_id}' no encontrado en ruta {path}"
+            f"_is_last_question: ID '{current_question_id}' no encontrado en ruta {path.question_ids}"
         )
         # Si la pregunta no está en la ruta, podríamos estar ante un caso especial
         # Verificar si es una pregunta final según alguna otra lógica
-        if current_question_id and current_question_id.startswith("FINAL_"):
+        if current_question_id.startswith("FINAL_"):
             logger.info(
                 f"Detectada pregunta especial de finalización: {current_question_id}"
             )
             return True
         return False
 
+    total_questions = len(path)
+    is_last = path.is_last(current_question_id)
+
+    logger.debug(
+        f"_is_last_question: Pregunta {current_question_id} es la #{current_index+1} de {total_questions}"
+    )
+
+    if is_last:
+        logger.info(
+            f"¡ÚLTIMA PREGUNTA DETECTADA! ({current_question_id}) - Posición {current_index+1} de {total_questions}"
+        )
+    return is_last
+
+
+def _record_user_answer(conversation: Conversation, user_input: str) -> Optional[str]:
+    """
+    Registra la respuesta del usuario a la pregunta actual (collected_data y
+    response_summaries) en la metadata; se guarda con el flush de la petición.
+    Devuelve el ID de la pregunta que se estaba respondiendo.
+    """
+    # Verificar si es la primera interacción y actualizar metadata
+    if conversation.metadata.get("first_interaction", False):
+        logger.info(
+            f"Primera interacción detectada para conversación {conversation.id}. Actualizando metadata."
+        )
+        conversation.metadata["first_interaction"] = False
+        # Mantenemos is_new_conversation=True para que el asistente sepa que
+        # sigue siendo una conversación nueva aunque ya no sea la primera interacción
+
+    # Save user response immediately
+    current_question_id = conversation.metadata.get("current_question_id")
+
+    if current_question_id:
+        # Update metadata with the response
+        if "collected_data" not in conversation.metadata:
+            conversation.metadata["collected_data"] = {}
+
+        conversation.metadata["collected_data"][
+            current_question_id
+        ] = user_input.strip()
+
+        # Save response summary
+        if "response_summaries" not in conversation.metadata:
+            conversation.metadata["response_summaries"] = {}
+
+        conversation.metadata["response_summaries"][current_question_id] = {
+            "question": conversation.metadata.get(
+                "current_question_asked_summary", ""
+            ),
+            "answer": user_input.strip(),
+            "timestamp": datetime.utcnow().isoformat(),
+        }
+
+        # Mark question as answered
+        conversation.metadata["last_answered_question_id"] = current_question_id
+
+        logger.info(
+            f"Response recorded for {current_question_id}: '{user_input.strip()}'"
+        )
+
+    return current_question_id
+
+
+async def _finalize_assistant_response(
+    conversation: Conversation,
+    ai_response_content: str,
+    current_question_id: Optional[str],
+) -> str:
+    """
+    Post-procesa la respuesta de la IA: solicita la propuesta si llegó el marcador,
+    evita preguntas repetidas y actualiza current_question_id.
+    Devuelve el contenido final del mensaje del asistente.
+    """
+    # Detectar si es una propuesta completa que necesita generación de PDF
+    if "[HYDROUS_INTERNAL_MARKER:GENERATE_PROPOSAL]" in ai_response_content:
+        logger.info(
+            f"Detectada propuesta completa que requiere generación de PDF para {conversation.id}"
+        )
+        # Extraer el texto de la propuesta (ya guardado en metadata)
+        proposal_text = conversation.metadata.get("proposal_text")
+        if not proposal_text and len(ai_response_content) > 40:
+            # Si no está en metadata, extraerlo del marcador
+            proposal_text = ai_response_content.replace(
+                "[HYDROUS_INTERNAL_MARKER:GENERATE_PROPOSAL]", ""
+            )
+            conversation.metadata["proposal_text"] = proposal_text
+
+        # La propuesta (LLM + PDF) se genera en la cola de trabajos; se encola
+        # después del flush del turno con _enqueue_requested_proposal
+        conversation.metadata["proposal_status"] = "queued"
+        ai_response_content = PROPOSAL_IN_PROGRESS_MESSAGE
+        logger.info(f"Generación de propuesta solicitada para {conversation.id}")
+
+    # Anti-repetition check
+    new_question_id = None
+    lines = ai_response_content.split("\n")
+    for i, line in enumerate(lines):
+        if "**QUESTION:**" in line or "**PREGUNTA:**" in line:
+            new_question_id = f"q_{i}"
+            break
+
+    # Check if AI is repeating a question
+    if new_question_id and new_question_id in conversation.metadata.get(
+        "collected_data", {}
+    ):
+        logger.warning(
+            f"AI attempted to repeat answered question: {new_question_id}"
+        )
+        ai_response_content = (
+            "I already have your answer to that question. Let me continue with the next one:\n\n"
+            "**QUESTION:** [Next relevant question from questionnaire]"
+        )
+
+    # Update current question ID if new
+    if new_question_id and new_question_id != current_question_id:
+        conversation.metadata["current_question_id"] = new_question_id
+
+    return ai_response_content
+
+
+async def _enqueue_requested_proposal(
+    conversation: Conversation, user_id: Optional[str], db: AsyncSession
+) -> Optional[str]:
+    """
+    Encola la generación de la propuesta si la conversación la tiene pedida.
+    Se llama tras el flush para que el worker lea el estado ya guardado.
+
+    `proposal_status` sigue en "queued" hasta que el trabajo termina, así que
+    antes de encolar se consulta el trabajo guardado en `proposal_job_id`: si
+    sigue activo se devuelve ese ID en lugar de encolar otro en cada turno.
+    """
+    if conversation.metadata.get("proposal_status") != "queued":
+        return None
+
+    job_id = conversation.metadata.get("proposal_job_id")
+    if job_id:
+        job = await task_queue.get_job(job_id)
+        if job and job["status"] in ACTIVE_STATUSES:
+            return job_id
 
-def _is_pdf_request(message_content: str) -> bool:
-    """Determina si el mensaje del usuario es una solicitud de descarga del PDF."""
-    normalized = message_content.lower().strip()
-    pdf_requests = [
-        "descargar pdf",
-        "download pdf",
-        "obtener pdf",
-        "get pdf",
-        "pdf",
-        "descargar",
-        "download",
-        "quiero el pdf",
-        "quiero mi pdf",
-        "dame el pdf",
-        "dame mi pdf",
-    ]
-    return any(request in normalized for request in pdf_requests)
+    try:
+        job_id = await enqueue_proposal(conversation.id, user_id)
+    except Exception as e:
+        logger.error(
+            f"No se pudo encolar la propuesta de {conversation.id}: {e}", exc_info=True
+        )
+        return None
+
+    # Se guarda directamente (sin marcar la metadata en memoria como modificada)
+    await conversation_repository.update_metadata(
+        db, conversation_id=UUID(conversation.id), key="proposal_job_id", value=job_id
+    )
+    return job_id
+
+
+async def _proposal_pdf_ready(metadata: Dict[str, Any]) -> bool:
+    """
+    Indica si el PDF de la propuesta ya se puede descargar.
+
+    La fuente de verdad es lo que el trabajo de propuesta guarda en la tabla
+    de metadata (`proposal_status="ready"` y `pdf_key`): `has_proposal` y
+    `pdf_path` se guardan en columnas que no se releen al cargar la
+    conversación. Con S3 el PDF se sirve por URL prefirmada; si no, desde la
+    caché local (`pdf_cache.ensure_local`).
+    """
+    if (
+        metadata.get("proposal_status") == "ready"
+        and metadata.get("pdf_key")
+        and pdf_cache.s3_enabled
+    ):
+        return True
+    return await pdf_cache.ensure_local(metadata) is not None
+
+
+def _proposal_in_progress_data(
+    conversation_id: str, job_id: Optional[str]
+) -> Dict[str, Any]:
+    """Campos de respuesta para que el cliente consulte el progreso de la propuesta."""
+    if not job_id:
+        return {}
+    return {
+        "action": "proposal_in_progress",
+        "job_id": job_id,
+        "status_url": proposal_job_status_url(job_id),
+    }
 
 
 # --- Endpoints ---
@@ -158,7 +292,7 @@ class ConversationStartRequest(BaseModel):
 async def start_conversation(
     request: Request,  # Para acceder a datos del usuario
     request_data: Optional[ConversationStartRequest] = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Inicia conversación. Ahora requiere autenticación obligatoria."""
     try:
@@ -203,7 +337,7 @@ async def start_conversation(
         logger.info(f"Metadata inicial de la conversación: {initial_metadata}")
 
         # Crear conversación en base de datos
-        new_conversation = conversation_repository.create_with_metadata(
+        new_conversation = await conversation_repository.create_with_metadata(
             db,
             obj_in={
                 "user_id": UUID(current_user["id"]),
@@ -284,192 +418,74 @@ async def start_conversation(
         )
 
 
-@router.post("/message")
-async def send_message(
-    request: Request,
-    data: MessageCreate,
-    background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
-):
-    """Process user message."""
-    # Extraer datos del mensaje
-    conversation_id = (
-        data.conversation_id if hasattr(data, "conversation_id") else "unknown"
-    )
-    user_input = data.message if hasattr(data, "message") else ""
+def _verification_response(
+    conversation: Conversation, conversation_id: str
+) -> Dict[str, Any]:
+    """Respuesta a VERIFICACIÓN_SILENCIOSA: mensajes actuales, sin procesar nada."""
+    return {
+        "id": conversation.id,
+        "messages": conversation.messages,
+        "conversation_id": conversation_id,
+        "created_at": conversation.created_at,
+    }
 
-    # Verificar si es un mensaje de verificación silenciosa (para cargar mensajes)
-    is_verification_message = user_input == "VERIFICACIÓN_SILENCIOSA"
 
-    if is_verification_message:
-        # Cargar conversación
-        conversation = await storage_service.get_conversation(conversation_id, db)
-        if not conversation:
-            logger.error(f"Conversation not found: {conversation_id}")
-            return {
-                "id": "error-conv-not-found",
-                "message": "Error: Conversation not found. Please restart.",
-                "conversation_id": conversation_id,
-                "created_at": datetime.utcnow(),
-            }
+def _fatal_error_response(conversation_id: str) -> Dict[str, Any]:
+    return {
+        "id": "error-fatal-" + str(uuid.uuid4())[:8],
+        "message": "Sorry, an unexpected server error occurred.",
+        "conversation_id": conversation_id,
+        "created_at": datetime.utcnow(),
+    }
 
-        # Retornar mensajes actuales sin procesar el mensaje de verificación
-        return {
-            "id": conversation.id,
-            "messages": conversation.messages,
-            "conversation_id": conversation_id,
-            "created_at": conversation.created_at,
-        }
+
+async def _process_message(
+    conv_session,
+    conversation_id: str,
+    user_input: str,
+    current_user: Dict[str, Any],
+    background_tasks: BackgroundTasks,
+    db: AsyncSession,
+) -> Dict[str, Any]:
+    """
+    Procesa un mensaje sobre una conversación ya cargada y con el propietario
+    verificado (la usan /message y /message/stream). Los cambios del turno se
+    guardan con un único flush.
+    """
+    conversation = conv_session.conversation
     assistant_response_data = None
 
     try:
-        # Get authenticated user
-        current_user = get_current_user(request)
-
-        # 1. Load conversation
-        logger.debug(f"Received /message request for conv: {conversation_id}")
-        conversation = await storage_service.get_conversation(conversation_id, db)
-        if not conversation:
-            logger.error(f"Conversation not found: {conversation_id}")
-            return {
-                "id": "error-conv-not-found",
-                "message": "Error: Conversation not found. Please restart.",
-                "conversation_id": conversation_id,
-                "created_at": datetime.utcnow(),
-            }
-
-        # 2. Create user message object
+        # Create user message object
         user_message_obj = Message.user(user_input)
 
-        # Verify ownership
-        db_conversation = conversation_repository.get(db, UUID(conversation_id))
-        if not db_conversation or str(db_conversation.user_id) != current_user["id"]:
-            logger.warning(
-                f"User {current_user['id']} tried to access unauthorized conversation {conversation_id}"
-            )
-            raise HTTPException(
-                status_code=403,
-                detail="You don't have permission to access this conversation",
-            )
-
-        # 3. Check if PDF request
-        is_pdf_req = _is_pdf_request(user_input)
-        proposal_ready = conversation.metadata.get("has_proposal", False)
+        # Check if PDF request
+        is_pdf_req = is_pdf_request(user_input)
         is_complete = conversation.metadata.get("is_complete", False)
         ready_for_proposal = conversation.metadata.get("ready_for_proposal", False)
-        pdf_path = conversation.metadata.get("pdf_path")
+        proposal_status = conversation.metadata.get("proposal_status")
 
         logger.info(
             f"PDF_CHECK: ConvID={conversation_id}, Input='{user_input}', is_pdf_req={is_pdf_req}, "
-            f"proposal_ready={proposal_ready}, is_complete={is_complete}, pdf_path={pdf_path}, ready_for_proposal={ready_for_proposal}"
+            f"proposal_status={proposal_status}, is_complete={is_complete}, "
+            f"pdf_key={conversation.metadata.get('pdf_key')}, ready_for_proposal={ready_for_proposal}"
         )
 
         if is_pdf_req:
             # Añadir mensaje del usuario al historial
-            await storage_service.add_message_to_conversation(
-                conversation.id, user_message_obj, db
-            )
+            conv_session.add_message(user_message_obj)
 
-            # Inteligencia para manejar diferentes estados de la propuesta
-
-            # CASO 1: Si la propuesta está lista pero metadatos inconsistentes, arreglar
-            if pdf_path and os.path.exists(pdf_path) and not proposal_ready:
-                logger.info(
-                    f"PDF existe pero metadatos inconsistentes. Corrigiendo para {conversation_id}..."
-                )
+            if await _proposal_pdf_ready(conversation.metadata):
+                # Asegurar que todos los metadatos estén consistentes
                 conversation.metadata["has_proposal"] = True
                 conversation.metadata["is_complete"] = True
-                await storage_service.save_conversation(conversation, db)
-                db.commit()
-                proposal_ready = True
-
-            # CASO 2: Si tiene señal de "ready_for_proposal" pero no tiene PDF, generar
-            elif (ready_for_proposal and not pdf_path) or (
-                ready_for_proposal and pdf_path and not os.path.exists(pdf_path)
-            ):
-                logger.info(
-                    f"Marcado como listo para propuesta. Generando PDF para {conversation_id}..."
-                )
-                from app.services.direct_proposal_generator import (
-                    direct_proposal_generator,
-                )
-
-                pdf_path = await direct_proposal_generator.generate_complete_proposal(
-                    conversation
-                )
-                if pdf_path and os.path.exists(pdf_path):
-                    logger.info(f"PDF generado exitosamente: {pdf_path}")
-                    conversation.metadata["pdf_path"] = pdf_path
-                    conversation.metadata["is_complete"] = True
-                    conversation.metadata["has_proposal"] = True
-                    await storage_service.save_conversation(conversation, db)
-                    db.commit()
-                    proposal_ready = True
-
-                    # Recargar conversación para verificar
-                    conversation = await storage_service.get_conversation(
-                        conversation_id, db
-                    )
-                    logger.info(
-                        f"Metadatos después de generar: {conversation.metadata}"
-                    )
-
-            # CASO 3: Si está marcado como completo pero sin PDF, intentar regenerar
-            elif (
-                (is_complete and not proposal_ready)
-                or (is_complete and not pdf_path)
-                or (is_complete and pdf_path and not os.path.exists(pdf_path))
-            ):
-                logger.info(
-                    f"Necesita generar o regenerar PDF para {conversation_id}. Estado: is_complete={is_complete}, proposal_ready={proposal_ready}, pdf_path={pdf_path}"
-                )
-                from app.services.direct_proposal_generator import (
-                    direct_proposal_generator,
-                )
-
-                # Regenerar PDF
-                pdf_path = await direct_proposal_generator.generate_complete_proposal(
-                    conversation
-                )
-
-                if pdf_path and os.path.exists(pdf_path):
-                    logger.info(f"PDF generado exitosamente: {pdf_path}")
-                    # Actualizar metadata explícitamente
-                    conversation.metadata["pdf_path"] = pdf_path
-                    conversation.metadata["is_complete"] = True
-                    conversation.metadata["has_proposal"] = True
-                    await storage_service.save_conversation(conversation, db)
-                    db.commit()
-                    proposal_ready = True
-
-                    # Recargar conversación para verificar
-                    conversation = await storage_service.get_conversation(
-                        conversation_id, db
-                    )
-                    logger.info(
-                        f"Metadatos después de regenerar: {conversation.metadata}"
-                    )
-                else:
-                    logger.error(f"Falló la generación del PDF para {conversation_id}")
-
-            # Verificar nuevamente si tenemos propuesta lista
-            if proposal_ready or (pdf_path and os.path.exists(pdf_path)):
-                # Asegurar que todos los metadatos estén consistentes
-                if pdf_path and os.path.exists(pdf_path) and not proposal_ready:
-                    conversation.metadata["has_proposal"] = True
-                    conversation.metadata["is_complete"] = True
-                    await storage_service.save_conversation(conversation, db)
-                    db.commit()
 
                 # Construir respuesta con URL de descarga
                 download_url = f"{settings.BACKEND_URL}{settings.API_V1_STR}/chat/{conversation.id}/download-pdf"
 
                 response_text = f"Proposal Ready! Type 'download pdf' to get your document or click to download it automatically."
                 assistant_message = Message.assistant(response_text)
-
-                await storage_service.add_message_to_conversation(
-                    conversation.id, assistant_message, db
-                )
+                conv_session.add_message(assistant_message)
 
                 assistant_response_data = {
                     "id": assistant_message.id,
@@ -479,16 +495,28 @@ async def send_message(
                     "action": "download_proposal_pdf",
                     "download_url": download_url,
                 }
-
-                return assistant_response_data
             else:
-                # No hay propuesta disponible
-                response_text = "Todavía no tengo lista tu propuesta. Por favor completa el cuestionario primero."
-                assistant_message = Message.assistant(response_text)
+                # Cuestionario terminado (o propuesta ya generada/fallida) pero sin
+                # PDF disponible: la generación se encola (ver flush más abajo)
+                if proposal_status != "queued" and (
+                    ready_for_proposal
+                    or is_complete
+                    or proposal_status in ("ready", "failed")
+                ):
+                    logger.info(
+                        f"Encolando generación de PDF para {conversation_id}. Estado: is_complete={is_complete}, "
+                        f"ready_for_proposal={ready_for_proposal}, proposal_status={proposal_status}"
+                    )
+                    conversation.metadata["proposal_status"] = "queued"
 
-                await storage_service.add_message_to_conversation(
-                    conversation.id, assistant_message, db
-                )
+                if conversation.metadata.get("proposal_status") == "queued":
+                    # La propuesta se está generando en segundo plano
+                    response_text = PROPOSAL_IN_PROGRESS_MESSAGE
+                else:
+                    # No hay propuesta disponible
+                    response_text = "Todavía no tengo lista tu propuesta. Por favor completa el cuestionario primero."
+                assistant_message = Message.assistant(response_text)
+                conv_session.add_message(assistant_message)
 
                 assistant_response_data = {
                     "id": assistant_message.id,
@@ -497,63 +525,15 @@ async def send_message(
                     "created_at": assistant_message.created_at,
                 }
 
-                return assistant_response_data
-
         else:
             # --- Normal Flow: Continue with questionnaire ---
             logger.info(f"Normal flow for conversation {conversation_id}")
 
             # Add user message to history
-            await storage_service.add_message_to_conversation(
-                conversation_id, user_message_obj, db
-            )
-
-            # Verificar si es la primera interacción y actualizar metadata
-            if conversation.metadata.get("first_interaction", False):
-                logger.info(
-                    f"Primera interacción detectada para conversación {conversation_id}. Actualizando metadata."
-                )
-                conversation.metadata["first_interaction"] = False
-                # Mantenemos is_new_conversation=True para que el asistente sepa que
-                # sigue siendo una conversación nueva aunque ya no sea la primera interacción
-
-            # Save user response immediately
-            current_question_id = conversation.metadata.get("current_question_id")
-
-            if current_question_id:
-                # Update metadata with the response
-                if "collected_data" not in conversation.metadata:
-                    conversation.metadata["collected_data"] = {}
-
-                conversation.metadata["collected_data"][
-                    current_question_id
-                ] = user_input.strip()
-
-                # Save response summary
-                if "response_summaries" not in conversation.metadata:
-                    conversation.metadata["response_summaries"] = {}
-
-                conversation.metadata["response_summaries"][current_question_id] = {
-                    "question": conversation.metadata.get(
-                        "current_question_asked_summary", ""
-                    ),
-                    "answer": user_input.strip(),
-                    "timestamp": datetime.utcnow().isoformat(),
-                }
-
-                # Mark question as answered
-                conversation.metadata["last_answered_question_id"] = current_question_id
+            conv_session.add_message(user_message_obj)
 
-                # CRITICAL: Save immediately before calling AI
-                await storage_service.save_conversation(conversation, db)
-                db.commit()  # Force immediate commit
-
-                logger.info(
-                    f"Response saved for {current_question_id}: '{user_input.strip()}'"
-                )
-
-            # Reload conversation to ensure latest state
-            conversation = await storage_service.get_conversation(conversation_id, db)
+            # Registrar la respuesta a la pregunta actual
+            current_question_id = _record_user_answer(conversation, user_input)
 
             # Check if final answer
             is_final_answer = _is_last_question(
@@ -561,16 +541,8 @@ async def send_message(
             )
 
             if is_final_answer:
-                # Generate proposal
-                logger.info(f"Generando proposal para {conversation_id}")
-                from app.services.direct_proposal_generator import (
-                    direct_proposal_generator,
-                )
-
-                # Intentar generar la propuesta
-                pdf_path = await direct_proposal_generator.generate_complete_proposal(
-                    conversation
-                )
+                # La propuesta (LLM + PDF) se genera en la cola de trabajos
+                logger.info(f"Solicitando propuesta para {conversation_id}")
 
                 # Actualizar metadata de la conversación
                 conversation.metadata["is_complete"] = True
@@ -578,170 +550,30 @@ async def send_message(
                 conversation.metadata["current_question_asked_summary"] = (
                     "Questionnaire Completed"
                 )
+                conversation.metadata["proposal_status"] = "queued"
 
-                # Verificar que el PDF se generó correctamente
-                if pdf_path and os.path.exists(pdf_path):
-                    logger.info(f"Propuesta generada exitosamente: {pdf_path}")
-                    # Establecer explícitamente que hay una propuesta disponible
-                    conversation.metadata["pdf_path"] = pdf_path
-                    conversation.metadata["has_proposal"] = True
-                    # Guardar inmediatamente para persistir estos cambios
-                    await storage_service.save_conversation(conversation, db)
-                    db.commit()
-
-                    # Generar URL de descarga y respuesta
-                    download_url = f"{settings.BACKEND_URL}{settings.API_V1_STR}/chat/{conversation.id}/download-pdf"
-                    assistant_response_data = {
-                        "id": "proposal-complete-" + str(uuid.uuid4())[:8],
-                        "message": "✅ Proposal ready! Type 'download pdf' to get your document.",
-                        "conversation_id": conversation_id,
-                        "created_at": datetime.utcnow(),
-                        "action": "proposal_complete",
-                        "download_url": download_url,
-                    }
-
-                    # Forzar mensaje en inglés para la propuesta lista
-                    assistant_response_data["message"] = "✅ Proposal ready! Type 'download pdf' to get your document."
-                    
-                    # Añadir mensaje al historial
-                    msg_to_add = Message.assistant(assistant_response_data["message"])
-                    await storage_service.add_message_to_conversation(
-                        conversation.id, msg_to_add, db
-                    )
-                else:
-                    # Manejo de error si no se pudo generar el PDF
-                    logger.error(
-                        f"Error generando PDF para {conversation_id}. Path: {pdf_path}"
-                    )
-                    error_message = "Lo siento, hubo un problema generando la propuesta. Por favor intenta de nuevo."
-                    error_msg = Message.assistant(error_message)
-                    await storage_service.add_message_to_conversation(
-                        conversation.id, error_msg, db
-                    )
-                    assistant_response_data = {
-                        "id": error_msg.id,
-                        "message": error_message,
-                        "conversation_id": conversation_id,
-                        "created_at": error_msg.created_at,
-                    }
+                assistant_message = Message.assistant(PROPOSAL_IN_PROGRESS_MESSAGE)
+                conv_session.add_message(assistant_message)
+                assistant_response_data = {
+                    "id": assistant_message.id,
+                    "message": assistant_message.content,
+                    "conversation_id": conversation_id,
+                    "created_at": assistant_message.created_at,
+                }
             else:
                 # Continue with questionnaire
                 ai_response_content = await ai_service.handle_conversation(conversation)
+                # El resumen del historial se actualiza después de responder
+                background_tasks.add_task(
+                    ai_service.refresh_history_summary, conversation.id
+                )
 
-                # Detectar si es una propuesta completa que necesita generación de PDF
-                if "[HYDROUS_INTERNAL_MARKER:GENERATE_PROPOSAL]" in ai_response_content:
-                    logger.info(
-                        f"Detectada propuesta completa que requiere generación de PDF para {conversation_id}"
-                    )
-                    # Extraer el texto de la propuesta (ya guardado en metadata)
-                    proposal_text = conversation.metadata.get("proposal_text")
-                    if not proposal_text and len(ai_response_content) > 40:
-                        # Si no está en metadata, extraerlo del marcador
-                        proposal_text = ai_response_content.replace(
-                            "[HYDROUS_INTERNAL_MARKER:GENERATE_PROPOSAL]", ""
-                        )
-                        conversation.metadata["proposal_text"] = proposal_text
-
-                    # Debugging: registrar estado de metadata antes de cambios
-                    logger.info(
-                        f"METADATA ANTES DE GENERAR PDF: is_complete={conversation.metadata.get('is_complete')}, has_proposal={conversation.metadata.get('has_proposal')}, pdf_path={conversation.metadata.get('pdf_path')}"
-                    )
-
-                    # Guardar los cambios iniciales a la metadata
-                    await storage_service.save_conversation(conversation, db)
-                    db.commit()
-
-                    # Generar el PDF
-                    from app.services.direct_proposal_generator import (
-                        direct_proposal_generator,
-                    )
-
-                    logger.info(
-                        f"Generando PDF para propuesta de conversación {conversation_id}..."
-                    )
-
-                    pdf_path = (
-                        await direct_proposal_generator.generate_complete_proposal(
-                            conversation
-                        )
-                    )
-
-                    if pdf_path and os.path.exists(pdf_path):
-                        logger.info(f"PDF generado exitosamente en: {pdf_path}")
-                        # Actualizar metadata explícitamente
-                        conversation.metadata["pdf_path"] = pdf_path
-                        conversation.metadata["is_complete"] = True
-                        conversation.metadata["has_proposal"] = True
-
-                        # Verificar permisos del archivo
-                        try:
-                            os.chmod(pdf_path, 0o644)  # rw-r--r--
-                            logger.info(f"Permisos del PDF establecidos correctamente")
-                        except Exception as perm_err:
-                            logger.warning(
-                                f"No se pudieron establecer permisos en {pdf_path}: {perm_err}"
-                            )
-
-                        # Guardar inmediatamente los cambios
-                        await storage_service.save_conversation(conversation, db)
-                        db.commit()
-
-                        # Volver a cargar la conversación para asegurar que los cambios se guardaron
-                        conversation = await storage_service.get_conversation(
-                            conversation_id, db
-                        )
-
-                        # Verificar que los cambios se guardaron correctamente
-                        logger.info(
-                            f"METADATA DESPUÉS DE GENERAR PDF: is_complete={conversation.metadata.get('is_complete')}, has_proposal={conversation.metadata.get('has_proposal')}, pdf_path={conversation.metadata.get('pdf_path')}"
-                        )
-
-                        # Preparar respuesta para el usuario
-                        download_url = f"{settings.BACKEND_URL}{settings.API_V1_STR}/chat/{conversation.id}/download-pdf"
-                        # Forzar mensaje en inglés, independientemente de lo que genere el modelo
-                        ai_response_content = "✅ Proposal ready! Type 'download pdf' to get your document."
-
-                        # Log detallado para seguimiento
-                        logger.info(
-                            f"Propuesta lista para {conversation_id}. URL de descarga: {download_url}"
-                        )
-                    else:
-                        logger.error(
-                            f"❌ Error generando PDF para {conversation_id}. Ruta: {pdf_path}"
-                        )
-                        logger.error(
-                            f"Detalles: proposal_text existe: {bool(proposal_text)}, longitud: {len(proposal_text) if proposal_text else 0}"
-                        )
-                        ai_response_content = "Lo siento, hubo un problema generando la propuesta. Por favor intenta de nuevo."
-
-                # Anti-repetition check
-                new_question_id = None
-                lines = ai_response_content.split("\n")
-                for i, line in enumerate(lines):
-                    if "**QUESTION:**" in line or "**PREGUNTA:**" in line:
-                        new_question_id = f"q_{i}"
-                        break
-
-                # Check if AI is repeating a question
-                if new_question_id and new_question_id in conversation.metadata.get(
-                    "collected_data", {}
-                ):
-                    logger.warning(
-                        f"AI attempted to repeat answered question: {new_question_id}"
-                    )
-                    ai_response_content = (
-                        "I already have your answer to that question. Let me continue with the next one:\n\n"
-                        "**QUESTION:** [Next relevant question from questionnaire]"
-                    )
-
-                # Update current question ID if new
-                if new_question_id and new_question_id != current_question_id:
-                    conversation.metadata["current_question_id"] = new_question_id
+                ai_response_content = await _finalize_assistant_response(
+                    conversation, ai_response_content, current_question_id
+                )
 
                 assistant_message = Message.assistant(ai_response_content)
-                await storage_service.add_message_to_conversation(
-                    conversation.id, assistant_message, db
-                )
+                conv_session.add_message(assistant_message)
 
                 assistant_response_data = {
                     "id": assistant_message.id,
@@ -750,42 +582,251 @@ async def send_message(
                     "created_at": assistant_message.created_at,
                 }
 
-        # Save final state
-        await storage_service.save_conversation(conversation, db)
-        db.commit()
+        # Save final state: una sola transacción para todo el turno
+        if not await conv_session.flush(db):
+            logger.error(f"No se pudo guardar el turno de {conversation_id}")
+
+        # Encolar la propuesta si el turno la solicitó (el worker lee el estado guardado)
+        job_id = await _enqueue_requested_proposal(
+            conversation, current_user["id"], db
+        )
+        assistant_response_data.update(
+            _proposal_in_progress_data(conversation_id, job_id)
+        )
         background_tasks.add_task(storage_service.cleanup_old_conversations)
 
         return assistant_response_data
 
-    except HTTPException as http_exc:
-        raise http_exc
     except Exception as e:
         logger.error(
             f"Fatal error in send_message for {conversation_id}: {str(e)}",
             exc_info=True,
         )
-        error_response = {
-            "id": "error-fatal-" + str(uuid.uuid4())[:8],
-            "message": "Sorry, an unexpected server error occurred.",
-            "conversation_id": conversation_id,
-            "created_at": datetime.utcnow(),
-        }
         try:
-            if "conversation" in locals() and isinstance(conversation, Conversation):
-                conversation.metadata["last_error"] = f"Fatal: {str(e)[:200]}"
-                await storage_service.save_conversation(conversation, db)
+            conv_session.metadata["last_error"] = f"Fatal: {str(e)[:200]}"
+            await conv_session.flush(db)
         except Exception as save_err:
             logger.error(f"Additional error saving error: {save_err}")
 
-        return error_response
+        return _fatal_error_response(conversation_id)
+
+
+@router.post("/message")
+async def send_message(
+    request: Request,
+    data: MessageCreate,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Process user message."""
+    # Extraer datos del mensaje
+    conversation_id = (
+        data.conversation_id if hasattr(data, "conversation_id") else "unknown"
+    )
+    user_input = data.message if hasattr(data, "message") else ""
+
+    # Verificar si es un mensaje de verificación silenciosa (para cargar mensajes)
+    is_verification_message = user_input == VERIFICATION_MESSAGE
+
+    if is_verification_message:
+        # Cargar conversación (solo si es del usuario autenticado)
+        current_user = get_current_user(request)
+        conversation = await storage_service.get_conversation(
+            conversation_id, db, current_user["id"]
+        )
+        if not conversation:
+            logger.error(f"Conversation not found: {conversation_id}")
+            return {
+                "id": "error-conv-not-found",
+                "message": "Error: Conversation not found. Please restart.",
+                "conversation_id": conversation_id,
+                "created_at": datetime.utcnow(),
+            }
+
+        # Retornar mensajes actuales sin procesar el mensaje de verificación
+        return _verification_response(conversation, conversation_id)
+
+    try:
+        # Get authenticated user
+        current_user = get_current_user(request)
+
+        # Load conversation owned by the user (los cambios se guardan con un
+        # único flush al final)
+        logger.debug(f"Received /message request for conv: {conversation_id}")
+        conv_session = await storage_service.open_session(
+            conversation_id, db, current_user["id"]
+        )
+        if not conv_session:
+            logger.error(
+                f"Conversation not found for user {current_user['id']}: {conversation_id}"
+            )
+            return {
+                "id": "error-conv-not-found",
+                "message": "Error: Conversation not found. Please restart.",
+                "conversation_id": conversation_id,
+                "created_at": datetime.utcnow(),
+            }
+    except HTTPException as http_exc:
+        raise http_exc
+    except Exception as e:
+        logger.error(
+            f"Fatal error in send_message for {conversation_id}: {str(e)}",
+            exc_info=True,
+        )
+        return _fatal_error_response(conversation_id)
+
+    return await _process_message(
+        conv_session, conversation_id, user_input, current_user, background_tasks, db
+    )
+
+
+def _sse_event(event: str, payload: Dict[str, Any]) -> str:
+    """Formatea un evento Server-Sent Events."""
+    data = json.dumps(payload, default=str, ensure_ascii=False)
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
 
 
-# Endpoint /download-pdf (SIN CAMBIOS)
+@router.post("/message/stream")
+async def send_message_stream(
+    request: Request,
+    data: MessageCreate,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Igual que /message pero devuelve la respuesta como Server-Sent Events.
+
+    Eventos:
+    - `token`: fragmento de texto a medida que lo genera el LLM ({"content": ...})
+    - `done`: respuesta final ya procesada y guardada (mismo formato que /message)
+    - `error`: error inesperado durante el stream
+
+    El contenido del evento `done` es el definitivo (puede diferir de los
+    tokens si se generó la propuesta o se detectó una pregunta repetida).
+    """
+    conversation_id = data.conversation_id
+    user_input = data.message
+    current_user = get_current_user(request)
+
+    # Solo se carga si es del usuario: una conversación ajena es un 404
+    conv_session = await storage_service.open_session(
+        conversation_id, db, current_user["id"]
+    )
+    if not conv_session:
+        logger.error(
+            f"Conversation not found for user {current_user['id']}: {conversation_id}"
+        )
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    conversation = conv_session.conversation
+
+    # Solicitudes de PDF, verificación y última pregunta no pasan por el LLM:
+    # se reutiliza el flujo normal (con la conversación ya cargada) y se emite
+    # un único evento `done`.
+    result = None
+    if user_input == VERIFICATION_MESSAGE:
+        result = _verification_response(conversation, conversation_id)
+    elif is_pdf_request(user_input) or _is_last_question(
+        conversation.metadata.get("current_question_id"), conversation.metadata
+    ):
+        result = await _process_message(
+            conv_session, conversation_id, user_input, current_user, background_tasks, db
+        )
+
+    if result is not None:
+
+        async def single_event():
+            yield _sse_event("done", result)
+
+        return StreamingResponse(
+            single_event(), media_type="text/event-stream", headers=SSE_HEADERS
+        )
+
+    # Mensaje del usuario y su respuesta quedan en memoria hasta el flush final
+    conv_session.add_message(Message.user(user_input))
+    current_question_id = _record_user_answer(conversation, user_input)
+
+    async def event_stream():
+        # La sesión de la dependencia se cierra antes de que se envíe el cuerpo,
+        # así que el stream usa su propia sesión.
+        stream_db = AsyncSessionLocal()
+        try:
+            ai_response_content = ""
+            async for kind, content in ai_service.stream_conversation(conversation):
+                if kind == "token":
+                    yield _sse_event("token", {"content": content})
+                else:
+                    ai_response_content = content
+
+            final_content = await _finalize_assistant_response(
+                conversation, ai_response_content, current_question_id
+            )
+
+            assistant_message = Message.assistant(final_content)
+            conv_session.add_message(assistant_message)
+            if not await conv_session.flush(stream_db):
+                logger.error(f"No se pudo guardar el turno de {conversation_id}")
+
+            job_id = await _enqueue_requested_proposal(
+                conversation, current_user["id"], stream_db
+            )
+            yield _sse_event(
+                "done",
+                {
+                    "id": assistant_message.id,
+                    "message": assistant_message.content,
+                    "conversation_id": conversation_id,
+                    "created_at": assistant_message.created_at,
+                    **_proposal_in_progress_data(conversation_id, job_id),
+                },
+            )
+        except Exception as e:
+            logger.error(
+                f"Fatal error in send_message_stream for {conversation_id}: {str(e)}",
+                exc_info=True,
+            )
+            conv_session.metadata["last_error"] = f"Fatal: {str(e)[:200]}"
+            yield _sse_event("error", _fatal_error_response(conversation_id))
+        finally:
+            # Si el cliente se desconecta, el generador se cancela: el guardado de
+            # lo pendiente y el cierre de la sesión se protegen de la cancelación
+            with anyio.CancelScope(shield=True):
+                try:
+                    if conv_session.is_dirty:
+                        await conv_session.flush(stream_db)
+                finally:
+                    await stream_db.close()
+
+    # Se ejecutan al terminar el stream (tras el flush del turno)
+    background_tasks.add_task(ai_service.refresh_history_summary, conversation.id)
+    background_tasks.add_task(storage_service.cleanup_old_conversations)
+    return StreamingResponse(
+        event_stream(), media_type="text/event-stream", headers=SSE_HEADERS
+    )
+
+
+def _proposal_filename(conversation: Conversation, conversation_id: str) -> str:
+    """Nombre de archivo de la propuesta para la descarga."""
+    client_name = conversation.metadata.get("client_name", "Cliente")
+    if client_name == "Cliente" and "[" not in client_name:
+        client_name = "Industrias_Agua_Pura"
+
+    # Limpiar el nombre para asegurar que sea válido como nombre de archivo
+    client_name = "".join(
+        c if c.isalnum() or c in "_- " else "_" for c in client_name
+    ).replace(" ", "_")
+
+    return f"Propuesta_Hydrous_{client_name}_{conversation_id[:8]}.pdf"
+
+
+# Endpoint /download-pdf
 @router.get("/{conversation_id}/download-pdf")
 async def download_pdf(
     request: Request,  # Para acceder a datos del usuario
     conversation_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Descarga PDF. Solo el dueño de la conversación puede descargar."""
     try:
@@ -795,8 +836,12 @@ async def download_pdf(
             f"Intento de descarga PDF para conversación {conversation_id} por usuario {current_user.get('email', 'desconocido')}"
         )
 
-        # Cargar conversación
-        conversation = await storage_service.get_conversation(conversation_id, db)
+        # Cargar conversación: la propiedad se comprueba en la misma consulta
+        # (en modo DEBUG se permite descargar conversaciones ajenas)
+        owner_id = current_user["id"] if current_user and not settings.DEBUG else None
+        conversation = await storage_service.get_conversation(
+            conversation_id, db, owner_id
+        )
         if not conversation:
             logger.error(f"Conversación no encontrada: {conversation_id}")
             raise HTTPException(status_code=404, detail="Conversación no encontrada")
@@ -814,129 +859,86 @@ async def download_pdf(
                     status_code=401, detail="No autenticado para descargar"
                 )
         else:
-            # VERIFICAR PROPIEDAD
-            db_conversation = conversation_repository.get(db, UUID(conversation_id))
-            if (
-                not db_conversation
-                or str(db_conversation.user_id) != current_user["id"]
-            ):
+            # Fuera de DEBUG la consulta ya filtró por propietario
+            if conversation.user_id != current_user["id"]:
                 logger.warning(
-                    f"Usuario {current_user['id']} intentó descargar conversación {conversation_id} no autorizada"
+                    f"Usuario {current_user['id']} descarga la conversación {conversation_id} "
+                    "sin ser el propietario (modo DEBUG)"
+                )
+
+        # Si el PDF está en S3, redirigir a una URL prefirmada: los bytes no pasan por la API
+        pdf_key = conversation.metadata.get("pdf_key")
+        if settings.PDF_DOWNLOAD_REDIRECT and pdf_key:
+            url = await pdf_cache.presigned_url(
+                pdf_key,
+                _proposal_filename(conversation, conversation_id),
+                expires=settings.PDF_PRESIGNED_URL_EXPIRES,
+            )
+            if url:
+                logger.info(f"Redirigiendo descarga de {conversation_id} a S3")
+                return RedirectResponse(
+                    url, status_code=302, headers={"Cache-Control": "no-store"}
                 )
-                if not settings.DEBUG:
-                    raise HTTPException(
-                        status_code=403,
-                        detail="No tienes permisos para descargar esta propuesta",
-                    )
-                else:
-                    logger.warning(
-                        "Permitiendo descarga sin verificación de propiedad en modo DEBUG"
-                    )
 
         # Verificar estado de metadata
         has_proposal = conversation.metadata.get("has_proposal", False)
         is_complete = conversation.metadata.get("is_complete", False)
         ready_for_proposal = conversation.metadata.get("ready_for_proposal", False)
-        pdf_path = conversation.metadata.get("pdf_path")
+        # El PDF puede estar en este contenedor o en la caché compartida (S3)
+        pdf_path = (
+            await pdf_cache.ensure_local(conversation.metadata)
+            or conversation.metadata.get("pdf_path")
+        )
         proposal_text = conversation.metadata.get("proposal_text")
 
         logger.info(
             f"Estado PDF para descarga: has_proposal={has_proposal}, is_complete={is_complete}, ready_for_proposal={ready_for_proposal}, pdf_path={pdf_path}, proposal_text_len={len(proposal_text) if proposal_text else 0}"
         )
 
-        # Si no existe o metadata inconsistente, intentar regenerarlo
-        if not pdf_path or not os.path.exists(pdf_path) or not has_proposal:
+        # El PDF existe pero la metadata no lo refleja: solo corregir la metadata
+        if pdf_path and os.path.exists(pdf_path) and not has_proposal:
+            logger.info(f"PDF existe pero metadata inconsistente, corrigiendo para {conversation_id}")
+            conversation.metadata["has_proposal"] = True
+            conversation.metadata["is_complete"] = True
+            await storage_service.save_conversation(conversation, db)
+
+        # Si no existe, encolar la generación y devolver 202 para que el cliente consulte
+        elif not pdf_path or not os.path.exists(pdf_path):
             logger.info(
-                f"PDF no existe o metadata inconsistente, regenerando para descarga directa"
+                f"PDF no existe, encolando regeneración para descarga de {conversation_id}"
             )
-            from app.services.direct_proposal_generator import direct_proposal_generator
 
             # Si ya tenemos texto de propuesta, mejor asegurarnos que esté en la metadata
             if not proposal_text and is_complete:
                 logger.info(
-                    f"Sin texto de propuesta, pero is_complete=True. Generando PDF de emergencia..."
+                    f"Sin texto de propuesta, pero is_complete=True. Usando texto de emergencia..."
                 )
                 # Usar texto de emergencia o generar
                 conversation.metadata["proposal_text"] = (
                     "# Propuesta de Tratamiento de Agua para Cliente\n\nGenerado automáticamente para descarga directa."
                 )
-                await storage_service.save_conversation(conversation, db)
-                db.commit()
+            conversation.metadata["proposal_status"] = "queued"
+            await storage_service.save_conversation(conversation, db)
 
-            logger.info(f"Regenerando PDF bajo demanda para descarga directa...")
-            pdf_path = await direct_proposal_generator.generate_complete_proposal(
-                conversation
+            job_id = await _enqueue_requested_proposal(
+                conversation, conversation.user_id, db
             )
-
-            if pdf_path and os.path.exists(pdf_path):
-                logger.info(f"PDF regenerado exitosamente para descarga: {pdf_path}")
-                # Asegurar permisos de archivo correctos
-                try:
-                    os.chmod(pdf_path, 0o644)  # rw-r--r--
-                    logger.info(
-                        f"Permisos del PDF establecidos: {oct(os.stat(pdf_path).st_mode)[-3:]}"
-                    )
-                except Exception as e:
-                    logger.warning(
-                        f"No se pudieron establecer permisos en {pdf_path}: {e}"
-                    )
-
-                # Actualizar la metadata de la conversación con la nueva ruta
-                conversation.metadata["pdf_path"] = pdf_path
-                conversation.metadata["has_proposal"] = True
-                conversation.metadata["is_complete"] = True
-                await storage_service.save_conversation(conversation, db)
-                db.commit()
-
-                # Verificar que se actualizó correctamente
-                updated_conv = await storage_service.get_conversation(
-                    conversation_id, db
-                )
-                logger.info(
-                    f"Metadatos actualizados después de regenerar PDF: has_proposal={updated_conv.metadata.get('has_proposal')}, pdf_path={updated_conv.metadata.get('pdf_path')}"
-                )
-            else:
-                logger.error(
-                    f"Regeneración de PDF falló para descarga directa de {conversation_id}"
-                )
+            if not job_id:
                 raise HTTPException(
                     status_code=500,
                     detail="No se pudo generar el PDF. Intente nuevamente.",
                 )
-
-        # Verificar si el archivo existe después de todo
-        if not os.path.exists(pdf_path):
-            logger.error(f"PDF no encontrado en el sistema de archivos: {pdf_path}")
-            raise HTTPException(
-                status_code=404,
-                detail="El archivo PDF no fue encontrado en el servidor",
+            return JSONResponse(
+                status_code=202,
+                content={
+                    "status": "in_progress",
+                    "message": PROPOSAL_IN_PROGRESS_MESSAGE,
+                    "conversation_id": conversation_id,
+                    **_proposal_in_progress_data(conversation_id, job_id),
+                },
             )
 
-        # Verificar permisos de lectura
-        if not os.access(pdf_path, os.R_OK):
-            logger.error(f"Permisos insuficientes para leer el PDF: {pdf_path}")
-            try:
-                logger.warning(f"Intentando corregir permisos de archivo para lectura")
-                os.chmod(pdf_path, 0o644)  # rw-r--r--
-            except Exception as e:
-                logger.error(f"No se pudieron corregir permisos: {e}")
-                raise HTTPException(
-                    status_code=500,
-                    detail="Error de permisos al acceder al archivo PDF",
-                )
-
-        # Preparar nombre personalizado
-        client_name = conversation.metadata.get("client_name", "Cliente")
-        if client_name == "Cliente" and "[" not in client_name:
-            client_name = "Industrias_Agua_Pura"
-
-        # Limpiar el nombre para asegurar que sea válido como nombre de archivo
-        client_name = "".join(
-            c if c.isalnum() or c in "_- " else "_" for c in client_name
-        ).replace(" ", "_")
-
-        # Generar nombre de archivo
-        filename = f"Propuesta_Hydrous_{client_name}_{conversation_id[:8]}.pdf"
+        filename = _proposal_filename(conversation, conversation_id)
         logger.info(f"Enviando archivo PDF: {filename} desde {pdf_path}")
 
         # Verificar tamaño del archivo antes de enviarlo
@@ -949,11 +951,14 @@ async def download_pdf(
         except OSError as e:
             logger.error(f"Error al obtener tamaño del archivo: {e}")
 
-        return FileResponse(
-            path=pdf_path,
-            filename=filename,
+        # ETag/If-None-Match → 304 en descargas repetidas; Range → reanudación (206).
+        # Con pdf_key el ETag es la clave de contenido: igual en todos los contenedores
+        return conditional_file_response(
+            request,
+            pdf_path,
             media_type="application/pdf",
             headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+            etag=f'"{pdf_key}"' if pdf_key else None,
         )
     except HTTPException as http_exc:
         logger.error(f"Error HTTP en descarga PDF: {http_exc.detail}")
@@ -972,7 +977,7 @@ async def download_pdf(
 async def diagnose_conversation(
     request: Request,
     conversation_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Diagnostica y repara una conversación con posibles problemas."""
     try:
@@ -982,19 +987,13 @@ async def diagnose_conversation(
             f"Diagnóstico de conversación {conversation_id} solicitado por {current_user.get('email', 'desconocido')}"
         )
 
-        # Cargar conversación
-        conversation = await storage_service.get_conversation(conversation_id, db)
+        # Cargar conversación (solo si es del usuario)
+        conversation = await storage_service.get_conversation(
+            conversation_id, db, current_user["id"]
+        )
         if not conversation:
             raise HTTPException(status_code=404, detail="Conversación no encontrada")
 
-        # Verificar propiedad
-        db_conversation = conversation_repository.get(db, UUID(conversation_id))
-        if not db_conversation or str(db_conversation.user_id) != current_user["id"]:
-            raise HTTPException(
-                status_code=403,
-                detail="No tienes permisos para diagnosticar esta conversación",
-            )
-
         # Recolectar información de diagnóstico
         diagnostico = {
             "id": conversation.id,
@@ -1022,19 +1021,9 @@ async def diagnose_conversation(
                 "Conversación marcada como completa sin propuesta generada"
             )
 
-            # Intentar generar propuesta
-            from app.services.direct_proposal_generator import direct_proposal_generator
-
-            pdf_path = await direct_proposal_generator.generate_complete_proposal(
-                conversation
-            )
-
-            if pdf_path and os.path.exists(pdf_path):
-                conversation.metadata["pdf_path"] = pdf_path
-                conversation.metadata["has_proposal"] = True
-                reparaciones.append(f"Propuesta generada correctamente en {pdf_path}")
-            else:
-                reparaciones.append("No se pudo generar la propuesta automáticamente")
+            # Encolar la generación de la propuesta (tras guardar los cambios)
+            conversation.metadata["proposal_status"] = "queued"
+            reparaciones.append("Generación de la propuesta encolada")
 
         # Si tiene ruta de PDF pero no está marcada como lista
         elif conversation.metadata.get("pdf_path") and not conversation.metadata.get(
@@ -1052,9 +1041,12 @@ async def diagnose_conversation(
                 )
 
         # Guardar cambios
+        job_id = None
         if reparaciones:
             await storage_service.save_conversation(conversation, db)
-            db.commit()
+            job_id = await _enqueue_requested_proposal(
+                conversation, current_user["id"], db
+            )
 
         # Recopilar estado final
         estado_final = {
@@ -1073,6 +1065,7 @@ async def diagnose_conversation(
             "diagnóstico": diagnostico,
             "reparaciones_realizadas": reparaciones,
             "estado_final": estado_final,
+            **_proposal_in_progress_data(conversation_id, job_id),
             "mensaje": (
                 "Diagnóstico completado"
                 if reparaciones
@@ -1087,3 +1080,25 @@ async def diagnose_conversation(
         raise HTTPException(
             status_code=500, detail=f"Error en diagnóstico: {str(e)[:100]}"
         )
+
+
+@router.get("/proposal-jobs/{job_id}")
+async def get_proposal_job(request: Request, job_id: str):
+    """Estado de un trabajo de generación de propuesta (para polling del cliente)."""
+    current_user = get_current_user(request)
+
+    job = await task_queue.get_job(job_id)
+    if not job or job["payload"].get("user_id") != current_user["id"]:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+
+    response = {
+        "job_id": job["id"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "conversation_id": job["payload"].get("conversation_id"),
+    }
+    if job["status"] == "completed" and job["result"]:
+        response["download_url"] = job["result"].get("download_url")
+    if job["status"] == "failed":
+        response["error"] = "No se pudo generar la propuesta. Intente nuevamente."
+    return response
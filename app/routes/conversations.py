@@ -1,12 +1,12 @@
 # app/routes/conversations.py
 from fastapi import APIRouter, Depends, HTTPException, Request
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 from pydantic import BaseModel
 from uuid import UUID
 from datetime import datetime
 
-from app.db.base import get_db
+from app.db.base import get_async_db
 from app.repositories.conversation_repository import conversation_repository
 from app.routes.chat import get_current_user
 
@@ -25,14 +25,14 @@ async def list_conversations(
     request: Request,
     skip: int = 0, 
     limit: int = 20,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Lista todas las conversaciones del usuario autenticado."""
     # Obtener usuario autenticado
     current_user = get_current_user(request)
     
     # Obtener conversaciones
-    conversations = conversation_repository.get_by_user_id(
+    conversations = await conversation_repository.get_by_user_id(
         db, 
         user_id=UUID(current_user["id"]),
         skip=skip,
@@ -72,14 +72,14 @@ async def list_conversations(
 async def delete_conversation(
     request: Request,
     conversation_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Elimina una conversación del usuario."""
     # Obtener usuario autenticado
     current_user = get_current_user(request)
     
     # Verificar propiedad
-    db_conversation = conversation_repository.get(db, UUID(conversation_id))
+    db_conversation = await conversation_repository.get_async(db, UUID(conversation_id))
     if not db_conversation or str(db_conversation.user_id) != current_user["id"]:
         raise HTTPException(
             status_code=403,
@@ -87,5 +87,5 @@ async def delete_conversation(
         )
     
     # Eliminar conversación
-    conversation_repository.remove(db, id=UUID(conversation_id))
+    await conversation_repository.remove_with_children(db, id=UUID(conversation_id))
     return {"status": "success"}
\ No newline at end of file
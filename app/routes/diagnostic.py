@@ -3,8 +3,11 @@ from sqlalchemy.orm import Session
 from sqlalchemy import text
 import logging
 
-from app.db.base import get_db
+from app.db.base import get_db, get_pool_metrics
 from app.db.models.user import User
+from app.services.ai_service import ai_service
+from app.services.llm_http_client import llm_http_client
+from app.services.pdf_render_pool import pdf_render_pool
 
 router = APIRouter()
 logger = logging.getLogger("hydrous")
@@ -89,3 +92,27 @@ def get_user_sample(db: Session = Depends(get_db)):
     except Exception as e:
         logger.error(f"Error obteniendo muestra de usuarios: {e}")
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@router.get("/llm-pool")
+async def get_llm_pool_metrics():
+    """Métricas del pool de conexiones HTTP hacia el proveedor LLM"""
+    return {"status": "ok", "llm_pool": llm_http_client.get_pool_metrics()}
+
+
+@router.get("/db-pool")
+async def get_db_pool_metrics():
+    """Métricas de los pools de conexiones a PostgreSQL (espera y saturación)"""
+    return {"status": "ok", "db_pool": get_pool_metrics()}
+
+
+@router.get("/pdf-pool")
+async def get_pdf_pool_metrics():
+    """Métricas del pool de procesos de renderizado PDF (cola, timeouts, duración)"""
+    return {"status": "ok", "pdf_pool": pdf_render_pool.get_metrics()}
+
+
+@router.get("/llm-usage")
+async def get_llm_usage_metrics():
+    """Tokens de prompt/completion de este worker y cuántos sirvió la caché del proveedor"""
+    return {"status": "ok", "llm_usage": ai_service.get_usage_metrics()}
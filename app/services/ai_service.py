@@ -1,19 +1,20 @@
 # app/services/ai_service.py
 import logging
-from threading import current_thread
 import httpx
-import os
 import json  # Importar json
-from typing import List, Dict, Any, Optional  # Asegurarse que Optional esté importado
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple  # Asegurarse que Optional esté importado
 
 from app.config import settings
+from app.db.base import AsyncSessionLocal
 from app.models.conversation import Conversation
+from app.services.llm_http_client import llm_http_client
 
 # Importar el prompt LLM-Driven (ajusta el nombre si usaste V4)
-from app.prompts.main_prompt_llm_driven import get_llm_driven_master_prompt
+from app.prompts.main_prompt_llm_driven import get_llm_driven_prompt_parts
 
 # Importar QuestionnaireService SOLO para IDs iniciales/texto de preguntas en metadata
 from app.services.questionnaire_service import questionnaire_service
+from app.services.storage_service import storage_service
 
 logger = logging.getLogger("hydrous")
 
@@ -31,6 +32,43 @@ class AIServiceLLMDriven:
             logger.critical("¡URL de API de IA no configurada!")
         # El prompt maestro ahora se genera dinámicamente en _prepare_messages
 
+        # Uso de tokens reportado por el proveedor (incluye tokens de prompt cacheados)
+        self._usage = {
+            "calls": 0,
+            "prompt_tokens": 0,
+            "cached_tokens": 0,
+            "completion_tokens": 0,
+        }
+
+    def _record_usage(self, usage: Optional[Dict[str, Any]]):
+        """Acumula el `usage` de una respuesta del proveedor (si lo incluye)."""
+        if not usage:
+            return
+        prompt_tokens = usage.get("prompt_tokens") or 0
+        details = usage.get("prompt_tokens_details") or {}
+        cached_tokens = details.get("cached_tokens") or 0
+        self._usage["calls"] += 1
+        self._usage["prompt_tokens"] += prompt_tokens
+        self._usage["cached_tokens"] += cached_tokens
+        self._usage["completion_tokens"] += usage.get("completion_tokens") or 0
+        # Los totales se exponen en GET /diagnostic/llm-usage
+        logger.debug(
+            f"DBG_AI_USAGE: prompt_tokens={prompt_tokens}, cached_tokens={cached_tokens}, "
+            f"completion_tokens={usage.get('completion_tokens')}"
+        )
+
+    def get_usage_metrics(self) -> Dict[str, Any]:
+        """Tokens acumulados en este worker y proporción servida desde la caché del proveedor."""
+        prompt_tokens = self._usage["prompt_tokens"]
+        return {
+            **self._usage,
+            "cached_ratio": (
+                round(self._usage["cached_tokens"] / prompt_tokens, 3)
+                if prompt_tokens
+                else None
+            ),
+        }
+
     async def _call_llm_api(
         self,
         messages: List[Dict[str, str]],
@@ -46,7 +84,8 @@ class AIServiceLLMDriven:
 
         response_text = ""  # Para guardar el texto de respuesta en caso de error JSON
         try:
-            async with httpx.AsyncClient() as client:
+            # Cliente compartido del worker (conexiones keep-alive reutilizadas)
+            async with llm_http_client.acquire() as client:
                 headers = {
                     "Content-Type": "application/json",
                     "Authorization": f"Bearer {self.api_key}",
@@ -65,9 +104,7 @@ class AIServiceLLMDriven:
                 if messages:
                     logger.debug(f"DBG_AI_CALL: Último mensaje enviado: {messages[-1]}")
 
-                response = await client.post(
-                    self.api_url, json=payload, headers=headers, timeout=90.0
-                )
+                response = await client.post(self.api_url, json=payload, headers=headers)
                 response_text = (
                     response.text
                 )  # Guardar texto crudo para posible error JSON
@@ -83,6 +120,8 @@ class AIServiceLLMDriven:
                     f"DBG_AI_CALL: JSON recibido OK (primeros 500 chars): {str(data)[:500]}"
                 )
 
+                self._record_usage(data.get("usage"))
+
                 choices = data.get("choices")
                 if not choices:
                     logger.warning(
@@ -114,15 +153,7 @@ class AIServiceLLMDriven:
                 exc_info=True,
             )
             # Devolver mensaje de error claro al usuario
-            user_error_msg = (
-                f"Error de comunicación con la IA ({e.response.status_code})."
-            )
-            # Incluir más detalles si es un error común (ej. rate limit, auth)
-            if e.response.status_code == 429:
-                user_error_msg += " Límite de solicitudes excedido. Espera un momento."
-            elif e.response.status_code in [401, 403]:
-                user_error_msg += " Problema de autenticación con la API."
-            return user_error_msg
+            return self._http_error_message(e.response.status_code)
         except httpx.RequestError as e:
             logger.error(
                 f"DBG_AI_CALL: Error de red llamando a API LLM: {e}", exc_info=True
@@ -145,6 +176,72 @@ class AIServiceLLMDriven:
                 "Lo siento, ocurrió un error inesperado en el servicio de IA [AIC04]."
             )
 
+    async def _stream_llm_api(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int = 1500,
+        temperature: float = 0.6,
+    ) -> AsyncIterator[str]:
+        """
+        Llama a la API del LLM con `stream=true` y va devolviendo los
+        fragmentos de texto (delta.content) a medida que llegan.
+        Las excepciones (HTTP, red, JSON) se propagan a quien consume el stream.
+        """
+        async with llm_http_client.acquire() as client:
+            headers = {
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {self.api_key}",
+            }
+            payload = {
+                "model": self.model,
+                "messages": messages,
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+                "stream": True,
+            }
+            if settings.LLM_STREAM_INCLUDE_USAGE:
+                # El último chunk trae `usage` (con tokens cacheados) y choices vacío
+                payload["stream_options"] = {"include_usage": True}
+
+            logger.info(
+                f"DBG_AI_STREAM: Iniciando stream con API LLM. URL: {self.api_url}, Model: {self.model}, #Msgs: {len(messages)}"
+            )
+            async with client.stream(
+                "POST", self.api_url, json=payload, headers=headers
+            ) as response:
+                if response.status_code >= 400:
+                    # Leer el cuerpo para que el error tenga detalle
+                    await response.aread()
+                    response.raise_for_status()
+
+                async for line in response.aiter_lines():
+                    line = line.strip()
+                    if not line or not line.startswith("data:"):
+                        continue
+                    data_str = line[len("data:") :].strip()
+                    if data_str == "[DONE]":
+                        break
+
+                    data = json.loads(data_str)  # Puede lanzar JSONDecodeError
+                    self._record_usage(data.get("usage"))
+                    choices = data.get("choices") or []
+                    if not choices:
+                        continue
+                    delta = choices[0].get("delta", {}).get("content")
+                    if delta:
+                        yield delta
+
+            logger.info("DBG_AI_STREAM: Stream de API LLM completado.")
+
+    def _http_error_message(self, status_code: int) -> str:
+        """Mensaje de error para el usuario según el código HTTP del proveedor."""
+        user_error_msg = f"Error de comunicación con la IA ({status_code})."
+        if status_code == 429:
+            user_error_msg += " Límite de solicitudes excedido. Espera un momento."
+        elif status_code in [401, 403]:
+            user_error_msg += " Problema de autenticación con la API."
+        return user_error_msg
+
     def _prepare_messages(self, conversation: Conversation) -> List[Dict[str, str]]:
         """Prepara los mensajes para la API, incluyendo el prompt dinámico e informacion del usuario."""
         logger.debug("DBG_AI_PREP: Iniciando preparación de mensajes...")
@@ -198,9 +295,13 @@ class AIServiceLLMDriven:
                 f"nueva_conversacion={is_new_conversation}, primera_interaccion={first_interaction}"
             )
 
-            # Generar prompt principal
-            system_prompt = get_llm_driven_master_prompt(current_metadata)
-            messages = [{"role": "system", "content": system_prompt}]
+            # Orden de más estable a más volátil para que el proveedor pueda
+            # cachear el prefijo y el historial: prefijo estático, contexto de la
+            # conversación, historial y, al final, el estado del turno
+            static_prefix, conversation_context, turn_context = (
+                get_llm_driven_prompt_parts(current_metadata)
+            )
+            messages = [{"role": "system", "content": static_prefix}]
 
             # Añadir SIEMPRE contexto adicional del usuario si hay datos relevantes
             user_name = current_metadata.get("user_name")
@@ -211,26 +312,7 @@ class AIServiceLLMDriven:
             client_name = current_metadata.get("client_name")
             company_name = current_metadata.get("company_name")
 
-            context_info = []
-
-            # Agregar instrucciones específicas para primera interacción
-            if is_new_conversation:
-                context_info.append(
-                    "THIS IS A NEW CONVERSATION. DO NOT say 'welcome back' or similar phrases."
-                )
-                if first_interaction:
-                    context_info.append(
-                        "This is the user's first message in this conversation."
-                    )
-                    context_info.append(
-                        "DO NOT introduce yourself again. The user has already seen your welcome message."
-                    )
-                    context_info.append(
-                        "Instead, acknowledge their response and proceed with the questionnaire or conversation."
-                    )
-                    context_info.append(
-                        "If they are confirming their information, thank them and continue with the first question."
-                    )
+            context_info = [conversation_context]
 
             # Información del usuario
             context_info.append("\nUser pre-information:")
@@ -248,28 +330,77 @@ class AIServiceLLMDriven:
                 context_info.append(f"- Client Name: {client_name}")
             if company_name:
                 context_info.append(f"- Company Name: {company_name}")
+            context_info.append(
+                "\nPlease adapt your responses considering this information and avoid asking for data we already know."
+            )
+            messages.append({"role": "system", "content": "\n".join(context_info)})
 
-            if context_info:
-                context_info.append(
-                    "\nPlease adapt your responses considering this information and avoid asking for data we already know."
+            # Estado del turno: se añade después del historial
+            turn_info = [turn_context]
+
+            # Agregar instrucciones específicas para primera interacción
+            if is_new_conversation:
+                turn_info.append(
+                    "THIS IS A NEW CONVERSATION. DO NOT say 'welcome back' or similar phrases."
                 )
-                if is_new_conversation and first_interaction:
-                    context_info.append(
+                if first_interaction:
+                    turn_info.append(
+                        "This is the user's first message in this conversation."
+                    )
+                    turn_info.append(
+                        "DO NOT introduce yourself again. The user has already seen your welcome message."
+                    )
+                    turn_info.append(
+                        "Instead, acknowledge their response and proceed with the questionnaire or conversation."
+                    )
+                    turn_info.append(
+                        "If they are confirming their information, thank them and continue with the first question."
+                    )
+                    turn_info.append(
                         "Remember, this is a NEW conversation but NOT your first message - the user has already seen your welcome."
                     )
-                context_message = {"role": "system", "content": "\n".join(context_info)}
-                messages.append(context_message)
-                logger.info(
-                    "Added additional user context and conversation state to the prompt."
-                )
+            turn_message = {"role": "system", "content": "\n".join(turn_info)}
+            logger.info(
+                "Added additional user context and conversation state to the prompt."
+            )
 
             # Añadir historial de conversación (si existe)
             if conversation.messages:
-                MAX_HISTORY_MSGS = 15  # Ajustar según necesidad y límites de tokens
-                start_index = max(0, len(conversation.messages) - MAX_HISTORY_MSGS)
+                # Ventana reciente que cabe en el presupuesto de tokens; lo anterior
+                # va compactado en el resumen incremental de la metadata
+                start_index = self._history_window_start(
+                    conversation.messages, settings.HISTORY_TOKEN_BUDGET
+                )
+                history_summary = current_metadata.get("history_summary")
+                summary_upto = (
+                    int(current_metadata.get("history_summary_upto") or 0)
+                    if history_summary
+                    else 0
+                )
+                if summary_upto < start_index:
+                    # El resumen se actualiza después de responder: mientras se pone
+                    # al día, la ventana crece (hasta 2× el presupuesto) para no
+                    # omitir los mensajes que aún no están resumidos
+                    catch_up_start = self._history_window_start(
+                        conversation.messages, settings.HISTORY_TOKEN_BUDGET * 2
+                    )
+                    start_index = max(summary_upto, catch_up_start)
+                else:
+                    start_index = summary_upto
+                if history_summary:
+                    messages.append(
+                        {
+                            "role": "system",
+                            "content": f"Summary of the earlier conversation:\n{history_summary}",
+                        }
+                    )
+                elif start_index > 0:
+                    logger.warning(
+                        f"DBG_AI_PREP: {start_index} mensajes antiguos fuera de la ventana sin resumen"
+                    )
 
                 # Si es primera interacción, marcar el primer mensaje como ya enviado
-                if first_interaction and len(conversation.messages) > 0:
+                if first_interaction and start_index == 0:
                     welcome_msg = conversation.messages[0]
                     if hasattr(welcome_msg, "role") and welcome_msg.role == "assistant":
                         messages.append(
@@ -295,19 +426,268 @@ class AIServiceLLMDriven:
                         )
 
                 logger.debug(
-                    f"DBG_AI_PREP: Mensajes preparados (Total: {len(messages)}). Historial añadido."
+                    f"DBG_AI_PREP: Mensajes preparados (Total: {len(messages) + 1}). Historial añadido."
                 )
             else:
                 logger.debug(
-                    "DBG_AI_PREP: Mensajes preparados (Total: 1). Sin historial previo."
+                    "DBG_AI_PREP: Mensajes preparados. Sin historial previo."
                 )
 
+            messages.append(turn_message)
             return messages
         except Exception as e:
             logger.error(f"Error fatal en _prepare_messages: {e}", exc_info=True)
             # Lanzar excepción para que handle_conversation la capture
             raise ValueError(f"Fallo al preparar mensajes: {e}")
 
+    def _message_tokens(self, message: Any) -> int:
+        """
+        Tokens de un mensaje del historial: el `token_count` guardado con el mensaje
+        o, en mensajes antiguos, se calcula una vez y se deja en memoria.
+        Estimación por longitud si tiktoken falla.
+        """
+        token_count = getattr(message, "token_count", None)
+        if token_count is not None:
+            return token_count
+        content = message.content
+        try:
+            from app.utils.token_counter import count_message_tokens
+
+            token_count = count_message_tokens(message.role, content, model=self.model)
+        except Exception:
+            return len(content) // 4 + 4
+        if hasattr(message, "token_count"):
+            message.token_count = token_count
+        return token_count
+
+    def _history_window_start(self, history: List[Any], budget: int) -> int:
+        """
+        Índice del primer mensaje de la ventana reciente: se recorren los mensajes
+        desde el final mientras quepan en `budget` tokens (los últimos
+        HISTORY_MIN_RECENT_MSGS entran siempre).
+        """
+        used = 0
+        included = 0
+        start = len(history)
+        for index in range(len(history) - 1, -1, -1):
+            role = getattr(history[index], "role", None)
+            content = getattr(history[index], "content", None)
+            if not role or not content or role == "system":
+                start = index
+                continue
+            tokens = self._message_tokens(history[index])
+            if used + tokens > budget and included >= settings.HISTORY_MIN_RECENT_MSGS:
+                break
+            used += tokens
+            included += 1
+            start = index
+        return start
+
+    async def refresh_history_summary(self, conversation_id: str):
+        """
+        Actualiza el resumen del historial de una conversación ya guardada.
+        Se ejecuta en segundo plano tras enviar la respuesta (BackgroundTasks),
+        así la llamada extra al LLM no retrasa el turno. Los errores solo se
+        registran: el siguiente turno lo intenta de nuevo.
+        """
+        try:
+            async with AsyncSessionLocal() as db:
+                conv_session = await storage_service.open_session(conversation_id, db)
+                if not conv_session:
+                    return
+                await self._update_history_summary(conv_session.conversation)
+                if conv_session.is_dirty:
+                    await conv_session.flush(db)
+        except Exception as e:
+            logger.warning(
+                f"DBG_AI_SUMMARY: Error actualizando el resumen de {conversation_id}: {e}",
+                exc_info=True,
+            )
+
+    async def _update_history_summary(self, conversation: Conversation):
+        """
+        Compacta en `history_summary` (metadata) los mensajes que ya no caben en la
+        ventana reciente. El resumen es incremental: solo se envían al LLM el
+        resumen anterior y los mensajes nuevos que salen de la ventana.
+        Si falla, el historial se recorta igualmente al presupuesto.
+        """
+        metadata = conversation.metadata
+        history = conversation.messages or []
+        budget = settings.HISTORY_TOKEN_BUDGET
+        summary_upto = int(metadata.get("history_summary_upto") or 0)
+
+        if self._history_window_start(history, budget) <= summary_upto:
+            return
+
+        # Compactar con holgura para no tener que resumir en cada turno
+        target = max(
+            self._history_window_start(
+                history, int(budget * settings.HISTORY_SUMMARY_KEEP_RATIO)
+            ),
+            summary_upto,
+        )
+        transcript = []
+        for msg in history[summary_upto:target]:
+            role = getattr(msg, "role", None)
+            content = getattr(msg, "content", None)
+            if role in ("user", "assistant") and content:
+                transcript.append(f"{role.upper()}: {content[:2000]}")
+        if not transcript:
+            metadata["history_summary_upto"] = target
+            return
+
+        previous_summary = metadata.get("history_summary") or "None"
+        summary_messages = [
+            {
+                "role": "system",
+                "content": (
+                    "You maintain a running summary of a water-treatment consultation. "
+                    "Merge the previous summary with the new turns. Keep every fact the "
+                    "user provided (names, sector, location, volumes, parameters, costs, "
+                    "answers to questionnaire questions) and which questions were already "
+                    "asked. Be concise, use bullet points, no greetings or commentary."
+                ),
+            },
+            {
+                "role": "user",
+                "content": (
+                    f"PREVIOUS SUMMARY:\n{previous_summary}\n\n"
+                    f"NEW TURNS:\n" + "\n\n".join(transcript)
+                ),
+            },
+        ]
+
+        try:
+            chunks = [
+                delta
+                async for delta in self._stream_llm_api(
+                    summary_messages,
+                    max_tokens=settings.HISTORY_SUMMARY_MAX_TOKENS,
+                    temperature=0.2,
+                )
+            ]
+        except Exception as e:
+            logger.warning(
+                f"DBG_AI_SUMMARY: No se pudo actualizar el resumen de {conversation.id}: {e}"
+            )
+            return
+
+        summary = "".join(chunks).strip()
+        if summary:
+            metadata["history_summary"] = summary
+            metadata["history_summary_upto"] = target
+            logger.info(
+                f"DBG_AI_SUMMARY: Resumen de {conversation.id} actualizado hasta el mensaje {target}"
+            )
+
+    def _process_llm_response(self, conversation: Conversation, llm_response: str) -> str:
+        """
+        Procesa la respuesta completa del LLM: extrae el resumen de la pregunta
+        (**QUESTION:**), detecta el marcador [PROPOSAL_COMPLETE: y actualiza metadata.
+        Devuelve la respuesta (con el marcador interno si hay propuesta).
+        """
+        possible_error_prefixes = (
+            "Error",
+            "Lo siento",
+            "(Respuesta inválida",
+            "(El asistente no",
+        )
+
+        if not llm_response.startswith(possible_error_prefixes):
+            logger.debug(
+                f"DBG_AI_HANDLE: Actualizando metadata para {conversation.id}..."
+            )
+
+            try:
+                lines = llm_response.split("\n")
+                last_q_summary = conversation.metadata.get(
+                    "current_question_asked_summary", "Desconocida"
+                )
+                first_question_id = None
+                is_proposal = "[PROPOSAL_COMPLETE:" in llm_response
+                question_found_in_response = False
+
+                # Buscar pregunta en la respuesta
+                for i, line in enumerate(lines):
+                    if line.strip().startswith(
+                        "**PREGUNTA:**"
+                    ) or line.strip().startswith("**QUESTION:**"):
+                        last_q_summary = (
+                            line.strip()
+                            .replace("**PREGUNTA:**", "")
+                            .replace("**QUESTION:**", "")
+                            .strip()[:100]
+                        )
+                        question_found_in_response = True
+
+                        # Si es la primera pregunta, asignar ID
+                        if conversation.metadata.get("current_question_id") is None:
+                            # Solo usar preguntas iniciales si no tenemos ya información del usuario
+                            if not conversation.metadata.get("selected_sector"):
+                                initial_q_id = (
+                                    questionnaire_service.get_initial_question_id()
+                                )
+                                if initial_q_id:
+                                    first_question_id = initial_q_id
+                        break
+
+                # Actualizar metadata solo si es necesario
+                if (
+                    first_question_id
+                    and conversation.metadata.get("current_question_id") is None
+                ):
+                    conversation.metadata["current_question_id"] = first_question_id
+                    logger.info(
+                        f"Metadata[current_question_id] actualizada a (inicio): '{first_question_id}'"
+                    )
+
+                if question_found_in_response:
+                    conversation.metadata["current_question_asked_summary"] = (
+                        last_q_summary
+                    )
+                    conversation.metadata["is_complete"] = False
+                    conversation.metadata["has_proposal"] = False
+                    logger.info(
+                        f"Metadata[current_question_asked_summary] actualizada a: '{last_q_summary}'"
+                    )
+
+                if is_proposal:
+                    proposal_clean_text = llm_response.split("[PROPOSAL_COMPLETE:")[
+                        0
+                    ].strip()
+                    # Guardar el texto de la propuesta en metadata
+                    conversation.metadata["proposal_text"] = proposal_clean_text
+                    # También guardar que está listo para generar PDF, pero no establecer has_proposal
+                    # hasta que realmente se genere exitosamente
+                    conversation.metadata["ready_for_proposal"] = True
+                    # Log detallado para seguimiento
+                    logger.info(
+                        f"Propuesta detectada para {conversation.id} - Texto: {len(proposal_clean_text)} caracteres"
+                    )
+                    logger.info(
+                        f"Metadatos actualizados: ready_for_proposal=True, is_complete=False, has_proposal=False"
+                    )
+                    # Añadir marcador para que chat.py sepa que debe generar el PDF
+                    llm_response = (
+                        "[HYDROUS_INTERNAL_MARKER:GENERATE_PROPOSAL]"
+                        + proposal_clean_text
+                    )
+
+                logger.debug(
+                    f"DBG_AI_HANDLE: Metadata actualizada OK para {conversation.id}."
+                )
+
+            except Exception as meta_err:
+                logger.error(
+                    f"Error actualizando metadata para {conversation.id}: {meta_err}",
+                    exc_info=True,
+                )
+        else:
+            logger.warning(
+                f"DBG_AI_HANDLE: Respuesta de LLM fue un mensaje de error: '{llm_response}'"
+            )
+        return llm_response
+
     async def handle_conversation(self, conversation: Conversation) -> str:
         """
         Prepara los mensajes y obtiene la respuesta del LLM.
@@ -350,130 +730,122 @@ class AIServiceLLMDriven:
             )
 
             # 3. Procesar respuesta y actualizar metadata
-            possible_error_prefixes = (
-                "Error",
-                "Lo siento",
-                "(Respuesta inválida",
-                "(El asistente no",
+            llm_response = self._process_llm_response(conversation, llm_response)
+
+        except ValueError as e:
+            logger.error(
+                f"DBG_AI_HANDLE: Error preparando mensajes: {e}", exc_info=True
+            )
+            llm_response = f"Error interno preparando la solicitud [AIH05]."
+        except Exception as e:
+            logger.error(
+                f"DBG_AI_HANDLE: Error inesperado en handle_conversation: {e}",
+                exc_info=True,
+            )
+            llm_response = (
+                "Lo siento, ocurrió un error general al procesar tu solicitud [AIH06]."
             )
 
-            if not llm_response.startswith(possible_error_prefixes):
-                logger.debug(
-                    f"DBG_AI_HANDLE: Actualizando metadata para {conversation.id}..."
-                )
+        logger.info(
+            f"DBG_AI_HANDLE: Finalizando handle_conversation para {conversation.id}. "
+            f"Respuesta final: '{llm_response[:50]}...'"
+        )
+        return llm_response
 
-                try:
-                    lines = llm_response.split("\n")
-                    last_q_summary = conversation.metadata.get(
-                        "current_question_asked_summary", "Desconocida"
-                    )
-                    first_question_id = None
-                    is_proposal = "[PROPOSAL_COMPLETE:" in llm_response
-                    question_found_in_response = False
-
-                    # Buscar pregunta en la respuesta
-                    for i, line in enumerate(lines):
-                        if line.strip().startswith(
-                            "**PREGUNTA:**"
-                        ) or line.strip().startswith("**QUESTION:**"):
-                            last_q_summary = (
-                                line.strip()
-                                .replace("**PREGUNTA:**", "")
-                                .replace("**QUESTION:**", "")
-                                .strip()[:100]
-                            )
-                            question_found_in_response = True
-
-                            # Si es la primera pregunta, asignar ID
-                            if conversation.metadata.get("current_question_id") is None:
-                                # Solo usar preguntas iniciales si no tenemos ya información del usuario
-                                if not conversation.metadata.get("selected_sector"):
-                                    initial_q_ids = [
-                                        q["id"]
-                                        for q in questionnaire_service.structure.get(
-                                            "initial_questions", []
-                                        )
-                                        if "id" in q
-                                    ]
-                                    if initial_q_ids:
-                                        first_question_id = initial_q_ids[0]
-                            break
-
-                    # Actualizar metadata solo si es necesario
-                    if (
-                        first_question_id
-                        and conversation.metadata.get("current_question_id") is None
-                    ):
-                        conversation.metadata["current_question_id"] = first_question_id
-                        logger.info(
-                            f"Metadata[current_question_id] actualizada a (inicio): '{first_question_id}'"
-                        )
 
-                    if question_found_in_response:
-                        conversation.metadata["current_question_asked_summary"] = (
-                            last_q_summary
-                        )
-                        conversation.metadata["is_complete"] = False
-                        conversation.metadata["has_proposal"] = False
-                        logger.info(
-                            f"Metadata[current_question_asked_summary] actualizada a: '{last_q_summary}'"
-                        )
+    async def stream_conversation(
+        self, conversation: Conversation
+    ) -> AsyncIterator[Tuple[str, str]]:
+        """
+        Versión en streaming de handle_conversation.
+        Emite ("token", fragmento) mientras el LLM genera y al final
+        ("final", respuesta_procesada), ya con la metadata actualizada
+        (resumen **QUESTION:** y marcador de propuesta).
+        """
+        logger.info(
+            f"DBG_AI_STREAM: Iniciando stream_conversation para conv {conversation.id if conversation else 'N/A'}"
+        )
 
-                    if is_proposal:
-                        proposal_clean_text = llm_response.split("[PROPOSAL_COMPLETE:")[
-                            0
-                        ].strip()
-                        # Guardar el texto de la propuesta en metadata
-                        conversation.metadata["proposal_text"] = proposal_clean_text
-                        # También guardar que está listo para generar PDF, pero no establecer has_proposal
-                        # hasta que realmente se genere exitosamente
-                        conversation.metadata["ready_for_proposal"] = True
-                        # Log detallado para seguimiento
-                        logger.info(
-                            f"Propuesta detectada para {conversation.id} - Texto: {len(proposal_clean_text)} caracteres"
-                        )
-                        logger.info(
-                            f"Metadatos actualizados: ready_for_proposal=True, is_complete=False, has_proposal=False"
-                        )
-                        # Añadir marcador para que chat.py sepa que debe generar el PDF
-                        llm_response = (
-                            "[HYDROUS_INTERNAL_MARKER:GENERATE_PROPOSAL]"
-                            + proposal_clean_text
-                        )
+        if not conversation:
+            logger.error("DBG_AI_STREAM: Objeto conversation es None.")
+            yield ("final", "Error interno: Conversación inválida [AIH01].")
+            return
 
-                    logger.debug(
-                        f"DBG_AI_HANDLE: Metadata actualizada OK para {conversation.id}."
-                    )
+        if not isinstance(conversation.metadata, dict):
+            logger.error(f"DBG_AI_STREAM: Metadata inválida para {conversation.id}")
+            yield ("final", "Error interno: Metadata de conversación corrupta [AIH02].")
+            return
 
-                except Exception as meta_err:
-                    logger.error(
-                        f"Error actualizando metadata para {conversation.id}: {meta_err}",
-                        exc_info=True,
-                    )
-            else:
-                logger.warning(
-                    f"DBG_AI_HANDLE: Respuesta de LLM fue un mensaje de error: '{llm_response}'"
-                )
+        if not self.api_key or not self.api_url:
+            logger.error("Error de configuración: Clave API o URL no proporcionada.")
+            yield ("final", "Error de Configuración Interna [AIC01].")
+            return
 
+        try:
+            messages = self._prepare_messages(conversation)
         except ValueError as e:
             logger.error(
-                f"DBG_AI_HANDLE: Error preparando mensajes: {e}", exc_info=True
+                f"DBG_AI_STREAM: Error preparando mensajes: {e}", exc_info=True
             )
-            llm_response = f"Error interno preparando la solicitud [AIH05]."
-        except Exception as e:
+            yield ("final", "Error interno preparando la solicitud [AIH05].")
+            return
+
+        chunks: List[str] = []
+        try:
+            async for delta in self._stream_llm_api(messages):
+                chunks.append(delta)
+                yield ("token", delta)
+        except httpx.HTTPStatusError as e:
             logger.error(
-                f"DBG_AI_HANDLE: Error inesperado en handle_conversation: {e}",
+                f"DBG_AI_STREAM: Error HTTP {e.response.status_code} en API LLM: {e.response.text}",
                 exc_info=True,
             )
+            yield ("final", self._http_error_message(e.response.status_code))
+            return
+        except httpx.RequestError as e:
+            logger.error(
+                f"DBG_AI_STREAM: Error de red llamando a API LLM: {e}", exc_info=True
+            )
+            yield ("final", "Error de red al contactar la IA. Verifica tu conexión.")
+            return
+        except json.JSONDecodeError as e:
+            logger.error(
+                f"DBG_AI_STREAM: Error decodificando chunk de API LLM: {e}",
+                exc_info=True,
+            )
+            yield ("final", "Error interno al procesar la respuesta de la IA [AIC03].")
+            return
+        except Exception as e:
+            logger.error(
+                f"DBG_AI_STREAM: Error inesperado en stream: {str(e)}", exc_info=True
+            )
+            yield (
+                "final",
+                "Lo siento, ocurrió un error inesperado en el servicio de IA [AIC04].",
+            )
+            return
+
+        llm_response = "".join(chunks).strip()
+        if not llm_response:
+            logger.warning("DBG_AI_STREAM: Respuesta del LLM con contenido vacío.")
+            yield ("final", "(El asistente no proporcionó texto en la respuesta)")
+            return
+
+        try:
+            llm_response = self._process_llm_response(conversation, llm_response)
+        except Exception as e:
+            logger.error(
+                f"DBG_AI_STREAM: Error procesando respuesta: {e}", exc_info=True
+            )
             llm_response = (
                 "Lo siento, ocurrió un error general al procesar tu solicitud [AIH06]."
             )
 
         logger.info(
-            f"DBG_AI_HANDLE: Finalizando handle_conversation para {conversation.id}. "
+            f"DBG_AI_STREAM: Finalizando stream_conversation para {conversation.id}. "
             f"Respuesta final: '{llm_response[:50]}...'"
         )
-        return llm_response
+        yield ("final", llm_response)
 
 
 # Instancia global
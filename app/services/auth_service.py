@@ -6,11 +6,13 @@ from passlib.context import CryptContext
 import uuid
 from uuid import UUID
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import Depends
 
 from app.models.user import UserCreate, UserInDB, User, TokenData
 from app.repositories.user_repository import user_repository
 from app.services.blacklist_service import blacklist_service
+from app.services.token_cache import verified_token_cache
 from app.db.base import get_db
 from app.config import settings
 
@@ -153,15 +155,16 @@ class AuthService:
             logger.error(f"Error creando token: {str(e)}")
             raise
 
-    async def verify_token(self, token: str, db: Session) -> Optional[Dict[str, Any]]:
-        """Verifica y decodifica un token JWT"""
+    async def verify_token(
+        self, token: str, db: AsyncSession
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Verifica y decodifica un token JWT.
+        Si el token (jti) ya se verificó hace poco, se usa la caché y se
+        evitan la consulta a Redis (blacklist) y a la base de datos.
+        """
         try:
-            # Verificar si el token esta en la blacklist
-            if await blacklist_service.is_blacklisted(token):
-                logger.warning("Token intentado pero esta en blacklist")
-                return None
-
-            # Decodificar token
+            # Decodificar token (firma y expiración; solo CPU)
             payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
             user_id = payload.get("sub")
 
@@ -169,10 +172,21 @@ class AuthService:
                 logger.warning("Token sin id de usuario")
                 return None
 
+            jti = payload.get("jti")
+            if jti:
+                cached_user = verified_token_cache.get(jti)
+                if cached_user and cached_user.get("id") == user_id:
+                    return cached_user
+
+            # Verificar si el token esta en la blacklist
+            if await blacklist_service.is_blacklisted(token):
+                logger.warning("Token intentado pero esta en blacklist")
+                return None
+
             # Verificar si el usuario existe
             try:
                 user_uuid = UUID(user_id)
-                db_user = user_repository.get(db, id=user_uuid)
+                db_user = await user_repository.get_async(db, id=user_uuid)
                 if not db_user:
                     logger.warning(f"Token con id de usuario no existente: {user_id}")
                     return None
@@ -181,7 +195,7 @@ class AuthService:
                 return None
 
             # Devolver datos básicos del usuario (sin incluir password_hash)
-            return {
+            user_data = {
                 "id": user_id,
                 "email": db_user.email,
                 "first_name": db_user.first_name,
@@ -191,6 +205,9 @@ class AuthService:
                 "sector": db_user.sector,
                 "subsector": db_user.subsector,
             }
+            if jti:
+                verified_token_cache.set(jti, user_data, token_exp=payload.get("exp"))
+            return user_data
         except jwt.ExpiredSignatureError:
             logger.warning("Token expirado")
             return None
@@ -255,7 +272,7 @@ class AuthService:
         except:
             return None
 
-    def get_user_by_id(self, user_id: str, db: Session) -> Optional[User]:
+    async def get_user_by_id(self, user_id: str, db: AsyncSession) -> Optional[User]:
         """Obtiene un usuario por su ID"""
         try:
             # Validar ID
@@ -265,7 +282,7 @@ class AuthService:
                 logger.warning(f"ID de usuario inválido: {user_id}")
                 return None
 
-            db_user = user_repository.get(db, id=user_uuid)
+            db_user = await user_repository.get_async(db, id=user_uuid)
             if not db_user:
                 return None
 
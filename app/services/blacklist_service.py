@@ -27,8 +27,11 @@ class TokenBlacklistService:
     def __init__(self):
         """Inicializar servicio"""
         from app.db.redis_client import redis_client
+        from app.services.token_cache import INVALIDATION_CHANNEL, verified_token_cache
 
         self.redis_client = redis_client
+        self.token_cache = verified_token_cache
+        self.invalidation_channel = INVALIDATION_CHANNEL
 
         # Prefijos para las claves en Redis
         self.BLACKLIST_PREFIX = "blacklist:"
@@ -72,6 +75,10 @@ class TokenBlacklistService:
             blacklist_key = f"{self.BLACKLIST_PREFIX}{jti}"
             await self.redis_client.setex(blacklist_key, ttl, "1")
 
+            # Quitar de la caché de tokens verificados (aquí y en los demás workers)
+            self.token_cache.invalidate(jti)
+            await self._publish_invalidation({"jti": jti})
+
             logger.info(f"Token añadido a blacklist: {jti[:8]}... TTL: {ttl}s")
             return True
 
@@ -79,6 +86,13 @@ class TokenBlacklistService:
             logger.error(f"Error añadiendo token a blacklist: {e}")
             return False
 
+    async def _publish_invalidation(self, message: Dict[str, Any]):
+        """Difunde una invalidación a la caché de tokens de todos los workers."""
+        try:
+            await self.redis_client.publish(self.invalidation_channel, json.dumps(message))
+        except Exception as e:
+            logger.error(f"Error publicando invalidación de token: {e}")
+
     async def is_blacklisted(self, token: str) -> bool:
         """
         Verifica si un token está en la blacklist.
@@ -183,6 +197,13 @@ class TokenBlacklistService:
         Returns:
             int: Número de sesiones invalidadas
         """
+        # Quitar de la caché de tokens verificados las sesiones del usuario
+        # (aquí y en los demás workers)
+        self.token_cache.invalidate_user(user_id, exclude_jti=exclude_session)
+        await self._publish_invalidation(
+            {"user_id": str(user_id), "exclude_jti": exclude_session}
+        )
+
         try:
             # Obtener datos de sesiones para añadir tokens a blacklist
             user_sessions_key = f"{self.USER_SESSIONS_PREFIX}{user_id}"
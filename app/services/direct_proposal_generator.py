@@ -3,6 +3,7 @@ import logging
 import json
 import re
 from datetime import datetime
+from typing import Any, Dict, Optional
 from reportlab.lib.pagesizes import A4
 from reportlab.lib import colors
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
@@ -11,6 +12,9 @@ from reportlab.lib.units import cm
 
 from app.config import settings
 from app.models.conversation import Conversation
+from app.services.pdf_cache import pdf_cache
+from app.services.pdf_render_pool import pdf_render_pool
+from app.services.single_flight import single_flight
 
 logger = logging.getLogger("hydrous")
 
@@ -21,13 +25,58 @@ class DirectProposalGenerator:
     y crea la propuesta directamente con valores específicos.
     """
 
+    # Subir al cambiar el diseño del PDF (invalida la caché por contenido)
+    PDF_TEMPLATE_VERSION = "reportlab-1"
+
     async def generate_complete_proposal(self, conversation: Conversation) -> str:
-        """Genera la propuesta y el PDF directamente, devuelve la ruta al PDF."""
+        """
+        Genera la propuesta y el PDF directamente, devuelve la ruta al PDF.
+
+        Single-flight por conversación: si ya hay una generación en curso (en este
+        u otro worker), se espera su resultado en lugar de repetir LLM y PDF.
+        """
+
+        async def generate() -> Optional[Dict[str, Any]]:
+            pdf_path = await self._generate_complete_proposal(conversation)
+            if not pdf_path:
+                return None
+            return {
+                "pdf_path": pdf_path,
+                "pdf_key": conversation.metadata.get("pdf_key"),
+                "proposal_text": conversation.metadata.get("proposal_text"),
+            }
+
+        result = await single_flight.run(
+            f"proposal:{conversation.id}",
+            generate,
+            lock_ttl=settings.PROPOSAL_LOCK_TTL,
+        )
+        if not result:
+            return None
+
+        # Llamadas tardías: aplicar a su copia de la conversación lo que generó la primera
+        if result.get("proposal_text"):
+            conversation.metadata["proposal_text"] = result["proposal_text"]
+        if result.get("pdf_key"):
+            conversation.metadata["pdf_key"] = result["pdf_key"]
+        pdf_path = result["pdf_path"]
+        if not os.path.exists(pdf_path):
+            # Generado en otro worker/contenedor: traerlo de la caché compartida
+            pdf_path = await pdf_cache.ensure_local(conversation.metadata) or pdf_path
+        conversation.metadata["pdf_path"] = pdf_path
+        conversation.metadata["has_proposal"] = True
+        conversation.metadata["is_complete"] = True
+        return pdf_path
+
+    async def _generate_complete_proposal(self, conversation: Conversation) -> str:
+        """Genera la propuesta (LLM) y el PDF. Llamar vía generate_complete_proposal."""
         try:
             # 1. Verificar si ya existe una propuesta para esta conversación
-            existing_pdf_path = conversation.metadata.get("pdf_path")
-            if existing_pdf_path and os.path.exists(existing_pdf_path):
+            # (en este contenedor o en la caché compartida por contenido)
+            existing_pdf_path = await pdf_cache.ensure_local(conversation.metadata)
+            if existing_pdf_path:
                 logger.info(f"Usando PDF existente: {existing_pdf_path}")
+                conversation.metadata["pdf_path"] = existing_pdf_path
                 conversation.metadata["has_proposal"] = True
                 return existing_pdf_path
                 
@@ -59,9 +108,19 @@ class DirectProposalGenerator:
                 
             logger.info(f"Texto de propuesta guardado en {debug_file}")
 
-            # 5. Generar PDF directamente
-            logger.info(f"Generando PDF para conversación {conversation.id}")
-            pdf_path = self._generate_pdf(proposal_text, conversation.id)
+            # 5. Reutilizar el PDF si esta misma propuesta ya se renderizó
+            pdf_key = pdf_cache.content_key(proposal_text, self.PDF_TEMPLATE_VERSION)
+            pdf_path = await pdf_cache.get(pdf_key)
+            if pdf_path:
+                logger.info(f"PDF encontrado en caché para conversación {conversation.id}: {pdf_path}")
+            else:
+                # Generar PDF en el pool de procesos (no bloquea el event loop)
+                logger.info(f"Generando PDF para conversación {conversation.id}")
+                rendered_path = await pdf_render_pool.run(
+                    self._generate_pdf, proposal_text, conversation.id
+                )
+                if rendered_path and os.path.exists(rendered_path):
+                    pdf_path = await pdf_cache.put(pdf_key, rendered_path)
 
             # 6. Verificar que el PDF se haya creado correctamente
             if pdf_path and os.path.exists(pdf_path):
@@ -78,6 +137,7 @@ class DirectProposalGenerator:
                 
                 # Actualizar metadata
                 conversation.metadata["proposal_text"] = proposal_text
+                conversation.metadata["pdf_key"] = pdf_key
                 conversation.metadata["pdf_path"] = pdf_path
                 conversation.metadata["has_proposal"] = True
                 conversation.metadata["is_complete"] = True
@@ -87,54 +147,65 @@ class DirectProposalGenerator:
             else:
                 # Si falló la generación con el módulo principal, intentar con PDF de emergencia
                 logger.error(f"❌ Falló la generación del PDF principal para {conversation.id}. Intentando solución de emergencia...")
+
+                # Conservar el texto para que un reintento no repita la llamada al LLM
+                conversation.metadata["proposal_text"] = proposal_text
                 
                 # Crear un PDF mínimo de emergencia
                 pdf_filename = f"propuesta_emergencia_{conversation.id}.pdf"
                 output_path = os.path.join(settings.UPLOAD_DIR, pdf_filename)
                 
-                try:
-                    # Importaciones requeridas
-                    from reportlab.lib.pagesizes import A4
-                    from reportlab.platypus import SimpleDocTemplate, Paragraph
-                    from reportlab.lib.styles import getSampleStyleSheet
-                    
-                    # Crear documento básico
-                    styles = getSampleStyleSheet()
-                    doc = SimpleDocTemplate(output_path, pagesize=A4)
-                    
-                    # Contenido mínimo
-                    elements = [
-                        Paragraph("PROPUESTA DE TRATAMIENTO DE AGUA", styles["Title"]),
-                        Paragraph(f"Cliente: {conversation.metadata.get('client_name', 'Cliente')}", styles["Normal"]),
-                        Paragraph(f"Sector: {conversation.metadata.get('selected_sector', 'No especificado')}", styles["Normal"]),
-                        Paragraph(f"Fecha: {datetime.now().strftime('%Y-%m-%d')}", styles["Normal"]),
-                        Paragraph("", styles["Normal"]),
-                        Paragraph("PROPUESTA DE EMERGENCIA", styles["Heading1"]),
-                        Paragraph("Este documento se ha generado en modo de emergencia debido a un error en el sistema.", styles["Normal"]),
-                        Paragraph("Por favor contacte a soporte para obtener la propuesta completa.", styles["Normal"]),
-                        Paragraph("", styles["Normal"]),
-                        Paragraph("Equipo de Hydrous", styles["Normal"]),
-                    ]
-                    
-                    # Construir PDF
-                    doc.build(elements)
-                    
-                    # Verificar resultado
-                    if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-                        logger.info(f"PDF de emergencia generado con éxito: {output_path}")
-                        conversation.metadata["pdf_path"] = output_path
-                        conversation.metadata["has_proposal"] = True
-                        conversation.metadata["is_complete"] = True
-                        return output_path
-                except Exception as e:
-                    logger.error(f"❌ Falló también la generación del PDF de emergencia: {e}", exc_info=True)
-                
+                generated = await pdf_render_pool.run(
+                    self._generate_emergency_pdf,
+                    output_path,
+                    conversation.metadata.get("client_name", "Cliente"),
+                    conversation.metadata.get("selected_sector", "No especificado"),
+                )
+                if generated:
+                    logger.info(f"PDF de emergencia generado con éxito: {output_path}")
+                    conversation.metadata["pdf_path"] = output_path
+                    conversation.metadata["has_proposal"] = True
+                    conversation.metadata["is_complete"] = True
+                    return output_path
+
                 logger.error(f"❌ No se pudo generar ningún PDF para {conversation.id}")
                 return None
         except Exception as e:
             logger.error(f"Error en generación directa de propuesta: {e}", exc_info=True)
             return None
 
+    def _generate_emergency_pdf(
+        self, output_path: str, client_name: str, sector: str
+    ) -> bool:
+        """Crea un PDF mínimo de emergencia. Se ejecuta en el pool de renderizado."""
+        try:
+            # Crear documento básico
+            styles = getSampleStyleSheet()
+            doc = SimpleDocTemplate(output_path, pagesize=A4)
+
+            # Contenido mínimo
+            elements = [
+                Paragraph("PROPUESTA DE TRATAMIENTO DE AGUA", styles["Title"]),
+                Paragraph(f"Cliente: {client_name}", styles["Normal"]),
+                Paragraph(f"Sector: {sector}", styles["Normal"]),
+                Paragraph(f"Fecha: {datetime.now().strftime('%Y-%m-%d')}", styles["Normal"]),
+                Paragraph("", styles["Normal"]),
+                Paragraph("PROPUESTA DE EMERGENCIA", styles["Heading1"]),
+                Paragraph("Este documento se ha generado en modo de emergencia debido a un error en el sistema.", styles["Normal"]),
+                Paragraph("Por favor contacte a soporte para obtener la propuesta completa.", styles["Normal"]),
+                Paragraph("", styles["Normal"]),
+                Paragraph("Equipo de Hydrous", styles["Normal"]),
+            ]
+
+            # Construir PDF
+            doc.build(elements)
+
+            # Verificar resultado
+            return os.path.exists(output_path) and os.path.getsize(output_path) > 0
+        except Exception as e:
+            logger.error(f"❌ Falló también la generación del PDF de emergencia: {e}", exc_info=True)
+            return False
+
     def _extract_conversation_text(self, conversation: Conversation) -> str:
         """Extrae el texto de la conversación."""
         conversation_text = ""
@@ -0,0 +1,145 @@
+# app/services/llm_http_client.py
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+import httpx
+
+from app.config import settings
+
+logger = logging.getLogger("hydrous")
+
+
+class LLMHttpClient:
+    """
+    Cliente HTTP compartido (uno por worker) para las llamadas al LLM.
+
+    - Mantiene conexiones keep-alive con el proveedor (sin handshake TCP+TLS por turno)
+    - HTTP/2 opcional (requiere el paquete `h2`)
+    - Limita las peticiones simultáneas al tamaño del pool y mide el tiempo de espera
+    """
+
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.max_connections = settings.LLM_HTTP_MAX_CONNECTIONS
+        self.http2_enabled = False
+
+        # Métricas
+        self._in_flight = 0
+        self._waiting = 0
+        self._total_requests = 0
+        self._total_wait_seconds = 0.0
+        self._max_wait_seconds = 0.0
+
+    def _build_client(self) -> httpx.AsyncClient:
+        """Crea el AsyncClient con límites de pool y keep-alive configurables."""
+        http2 = settings.LLM_HTTP2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning(
+                    "LLM_HTTP2 activado pero el paquete 'h2' no está instalado. Usando HTTP/1.1."
+                )
+                http2 = False
+        self.http2_enabled = http2
+
+        limits = httpx.Limits(
+            max_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.LLM_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=settings.LLM_HTTP_KEEPALIVE_EXPIRY,
+        )
+        timeout = httpx.Timeout(
+            settings.LLM_HTTP_TIMEOUT, pool=settings.LLM_HTTP_POOL_TIMEOUT
+        )
+        return httpx.AsyncClient(http2=http2, limits=limits, timeout=timeout)
+
+    async def start(self):
+        """Inicializa el cliente (llamado desde el lifespan de FastAPI)."""
+        if self._client is not None and not self._client.is_closed:
+            return
+        self._client = self._build_client()
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_connections)
+        logger.info(
+            f"Cliente HTTP LLM iniciado (max_connections={self.max_connections}, "
+            f"keepalive={settings.LLM_HTTP_MAX_KEEPALIVE}, http2={self.http2_enabled})"
+        )
+
+    async def close(self):
+        """Cierra el cliente y sus conexiones (llamado al apagar el worker)."""
+        if self._client is not None:
+            await self._client.aclose()
+            logger.info("Cliente HTTP LLM cerrado")
+        self._client = None
+        # El semáforo se conserva: las peticiones en curso aún lo liberan
+
+    @asynccontextmanager
+    async def acquire(self):
+        """
+        Reserva un hueco del pool y devuelve el cliente compartido.
+        Si el lifespan no lo inició (ej. scripts), se crea bajo demanda.
+        """
+        if self._client is None or self._client.is_closed:
+            await self.start()
+
+        # Referencia local: se libera el mismo semáforo aunque se cierre el cliente
+        slots = self._slots
+        self._waiting += 1
+        wait_started = time.perf_counter()
+        try:
+            await slots.acquire()
+        finally:
+            self._waiting -= 1
+        wait_seconds = time.perf_counter() - wait_started
+
+        self._in_flight += 1
+        self._total_requests += 1
+        self._total_wait_seconds += wait_seconds
+        self._max_wait_seconds = max(self._max_wait_seconds, wait_seconds)
+        if wait_seconds > 1.0:
+            logger.warning(
+                f"Espera de {wait_seconds:.2f}s por conexión del pool LLM (pool saturado)"
+            )
+        try:
+            yield self._client
+        finally:
+            self._in_flight -= 1
+            slots.release()
+
+    def _connection_counts(self) -> Dict[str, Optional[int]]:
+        """Conexiones abiertas/ociosas según el pool de httpcore (si es accesible)."""
+        try:
+            pool = self._client._transport._pool
+            connections = list(pool.connections)
+            idle = sum(1 for conn in connections if conn.is_idle())
+            return {"open_connections": len(connections), "idle_connections": idle}
+        except Exception:
+            return {"open_connections": None, "idle_connections": None}
+
+    def get_pool_metrics(self) -> Dict[str, Any]:
+        """Métricas del pool para diagnóstico y dimensionamiento."""
+        metrics: Dict[str, Any] = {
+            "started": self._client is not None and not self._client.is_closed,
+            "http2": self.http2_enabled,
+            "max_connections": self.max_connections,
+            "in_use": self._in_flight,
+            "waiting": self._waiting,
+            "total_requests": self._total_requests,
+            "avg_wait_ms": (
+                round(self._total_wait_seconds / self._total_requests * 1000, 2)
+                if self._total_requests
+                else 0.0
+            ),
+            "max_wait_ms": round(self._max_wait_seconds * 1000, 2),
+        }
+        if metrics["started"]:
+            metrics.update(self._connection_counts())
+        return metrics
+
+
+# Instancia global
+llm_http_client = LLMHttpClient()
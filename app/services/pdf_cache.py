@@ -0,0 +1,162 @@
+# app/services/pdf_cache.py
+import asyncio
+import hashlib
+import os
+import logging
+import uuid
+from typing import Any, Dict, Optional
+
+from app.config import settings
+from app.services import s3_service
+
+logger = logging.getLogger("hydrous")
+
+
+class ProposalPdfCache:
+    """
+    Caché de PDFs de propuesta direccionada por contenido.
+
+    - La clave es sha256(versión de plantilla + texto de la propuesta): la misma
+      propuesta con la misma plantilla se renderiza una sola vez.
+    - Nivel 1: disco local (`PDF_CACHE_DIR/{clave}.pdf`) con expulsión LRU por tamaño.
+    - Nivel 2: S3 (`proposals/{clave}.pdf`), compartido por todos los contenedores
+      y persistente entre despliegues. Si S3 no está configurado, solo disco local.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, s3_prefix: str = "proposals/"):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.s3_prefix = s3_prefix
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @property
+    def s3_enabled(self) -> bool:
+        return bool(s3_service.S3_BUCKET)
+
+    @staticmethod
+    def content_key(proposal_text: str, template_version: str) -> str:
+        """Clave de contenido del PDF (cambia si cambia el texto o la plantilla)."""
+        digest = hashlib.sha256()
+        digest.update(template_version.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(proposal_text.strip().encode("utf-8"))
+        return digest.hexdigest()
+
+    def local_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.pdf")
+
+    def s3_key(self, key: str) -> str:
+        return f"{self.s3_prefix}{key}.pdf"
+
+    async def get(self, key: str) -> Optional[str]:
+        """Ruta local del PDF cacheado (descargándolo de S3 si hace falta) o None."""
+        path = self.local_path(key)
+        if os.path.exists(path):
+            try:
+                os.utime(path)  # Marca de uso para el LRU
+            except OSError:
+                pass
+            return path
+
+        if not self.s3_enabled:
+            return None
+
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                found = await s3_service.download_file_from_s3(self.s3_key(key), f)
+            if not found:
+                return None
+            os.replace(tmp_path, path)
+            logger.info(f"PDF {key[:12]} descargado de S3 a la caché local")
+            await asyncio.to_thread(self._evict)
+            return path
+        except Exception as e:
+            logger.error(f"Error descargando PDF {key[:12]} de S3: {e}")
+            return None
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    async def put(self, key: str, rendered_path: str) -> str:
+        """
+        Mueve el PDF recién renderizado a la caché, lo sube a S3 y devuelve su ruta local.
+        Si la subida a S3 falla, el PDF queda igualmente en la caché local.
+        """
+        path = self.local_path(key)
+        os.replace(rendered_path, path)
+
+        if self.s3_enabled:
+            try:
+                with open(path, "rb") as f:
+                    await s3_service.upload_file_to_s3(
+                        f, self.s3_key(key), "application/pdf"
+                    )
+                logger.info(f"PDF {key[:12]} subido a S3 ({self.s3_key(key)})")
+            except Exception as e:
+                logger.error(f"Error subiendo PDF {key[:12]} a S3: {e}")
+
+        await asyncio.to_thread(self._evict)
+        return path
+
+    async def presigned_url(
+        self, key: str, download_name: str, expires: int = 300
+    ) -> Optional[str]:
+        """URL prefirmada de S3 para descargar el PDF sin pasar por la API (None si no está en S3)."""
+        if not self.s3_enabled:
+            return None
+        try:
+            if not await s3_service.object_exists(self.s3_key(key)):
+                return None
+            return await s3_service.get_presigned_url(
+                self.s3_key(key), expires=expires, download_name=download_name
+            )
+        except Exception as e:
+            logger.error(f"Error generando URL prefirmada para PDF {key[:12]}: {e}")
+            return None
+
+    async def ensure_local(self, metadata: Dict[str, Any]) -> Optional[str]:
+        """
+        Ruta local del PDF de una conversación: `pdf_path` si existe en este
+        contenedor, o el PDF cacheado por `pdf_key` (local o S3).
+        """
+        pdf_path = metadata.get("pdf_path")
+        if pdf_path and os.path.exists(pdf_path):
+            return pdf_path
+        pdf_key = metadata.get("pdf_key")
+        if pdf_key:
+            return await self.get(pdf_key)
+        return None
+
+    def _evict(self):
+        """Elimina los PDFs menos usados hasta quedar por debajo de `max_bytes`."""
+        try:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith(".pdf"):
+                    continue
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        except OSError as e:
+            logger.warning(f"No se pudo revisar la caché de PDFs: {e}")
+            return
+
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        for _, size, name in sorted(entries):
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+                total -= size
+            except OSError:
+                continue
+            if total <= self.max_bytes:
+                break
+        logger.info(f"Caché de PDFs reducida a {total / 1024 / 1024:.1f} MB")
+
+
+# Instancia global
+pdf_cache = ProposalPdfCache(
+    cache_dir=settings.PDF_CACHE_DIR,
+    max_bytes=settings.PDF_CACHE_MAX_MB * 1024 * 1024,
+)
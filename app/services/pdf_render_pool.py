@@ -0,0 +1,149 @@
+# app/services/pdf_render_pool.py
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+
+from app.config import settings
+
+logger = logging.getLogger("hydrous")
+
+
+class PdfRenderPool:
+    """
+    Pool de procesos acotado para renderizar PDFs (ReportLab / xhtml2pdf).
+
+    El renderizado es CPU puro y bloquearía el event loop del worker durante
+    segundos; aquí se ejecuta en procesos aparte para que los turnos de chat
+    de otros usuarios sigan fluyendo.
+
+    - `max_queue` limita los renders pendientes + en curso; por encima se rechaza
+    - `timeout` corta renders colgados (el pool se recrea y se terminan sus procesos)
+    - Las funciones enviadas deben ser importables (funciones de módulo o
+      métodos de instancias serializables) y devolver valores serializables
+    """
+
+    def __init__(self, max_workers: int = 2, max_queue: int = 8, timeout: float = 120.0):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+        # Métricas
+        self._pending = 0
+        self._total_renders = 0
+        self._rejected = 0
+        self._timeouts = 0
+        self._failures = 0
+        self._total_seconds = 0.0
+        self._max_seconds = 0.0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Crea el pool bajo demanda (después del fork del worker de gunicorn)."""
+        if self._executor is None:
+            # forkserver: los procesos hijos no heredan hilos ni conexiones del worker
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("forkserver"),
+            )
+            logger.info(f"Pool de renderizado PDF iniciado ({self.max_workers} procesos)")
+        return self._executor
+
+    def _reset_executor(self):
+        """Descarta el pool actual terminando sus procesos (render colgado o pool roto)."""
+        executor, self._executor = self._executor, None
+        if executor is None:
+            return
+        processes = list(getattr(executor, "_processes", {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            try:
+                process.terminate()
+            except Exception:
+                pass
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """
+        Ejecuta `func(*args)` en el pool y devuelve su resultado.
+        Devuelve None si la cola está llena, se excede el timeout o el render falla.
+        """
+        if self._pending >= self.max_queue:
+            self._rejected += 1
+            logger.warning(
+                f"Cola de renderizado PDF llena ({self._pending}/{self.max_queue}), "
+                f"se rechaza {getattr(func, '__name__', func)}"
+            )
+            return None
+
+        self._pending += 1
+        started = time.perf_counter()
+        try:
+            if self.max_workers <= 0:
+                future = asyncio.to_thread(func, *args)
+            else:
+                loop = asyncio.get_running_loop()
+                future = loop.run_in_executor(self._get_executor(), func, *args)
+            result = await asyncio.wait_for(future, timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            logger.error(
+                f"Renderizado PDF excedió {self.timeout:.0f}s, reiniciando el pool"
+            )
+            if self.max_workers > 0:
+                self._reset_executor()
+            return None
+        except BrokenProcessPool as e:
+            self._failures += 1
+            logger.error(f"Pool de renderizado PDF roto, se recreará: {e}")
+            self._reset_executor()
+            return None
+        except Exception as e:
+            self._failures += 1
+            logger.error(f"Error renderizando PDF en el pool: {e}", exc_info=True)
+            return None
+        finally:
+            self._pending -= 1
+
+        elapsed = time.perf_counter() - started
+        self._total_renders += 1
+        self._total_seconds += elapsed
+        self._max_seconds = max(self._max_seconds, elapsed)
+        return result
+
+    def close(self):
+        """Cierra el pool (llamado al apagar el worker)."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            logger.info("Pool de renderizado PDF cerrado")
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Métricas del pool para diagnóstico y dimensionamiento."""
+        return {
+            "started": self._executor is not None,
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "timeout_seconds": self.timeout,
+            "pending": self._pending,
+            "total_renders": self._total_renders,
+            "rejected": self._rejected,
+            "timeouts": self._timeouts,
+            "failures": self._failures,
+            "avg_render_ms": (
+                round(self._total_seconds / self._total_renders * 1000, 2)
+                if self._total_renders
+                else 0.0
+            ),
+            "max_render_ms": round(self._max_seconds * 1000, 2),
+        }
+
+
+# Instancia global
+pdf_render_pool = PdfRenderPool(
+    max_workers=settings.PDF_RENDER_WORKERS,
+    max_queue=settings.PDF_RENDER_MAX_QUEUE,
+    timeout=settings.PDF_RENDER_TIMEOUT,
+)
@@ -11,6 +11,7 @@ from typing import Optional
 # -------------------------------
 
 from app.config import settings
+from app.services.pdf_render_pool import pdf_render_pool
 
 logger = logging.getLogger("hydrous")
 
@@ -121,7 +122,14 @@ class PDFService:
             autoescape=select_autoescape(["html", "xml"]),
         )
 
-    def _html_to_pdf(self, html_content: str, output_path: str) -> bool:
+    async def html_to_pdf(self, html_content: str, output_path: str) -> bool:
+        """Convierte HTML a PDF en el pool de renderizado (sin bloquear el event loop)."""
+        return bool(
+            await pdf_render_pool.run(PDFService._html_to_pdf, html_content, output_path)
+        )
+
+    @staticmethod
+    def _html_to_pdf(html_content: str, output_path: str) -> bool:
         """Convierte contenido HTML a un archivo PDF."""
         try:
             output_dir = os.path.dirname(output_path)
@@ -229,6 +237,13 @@ class PDFService:
         self, conversation_id: str, proposal_text: str
     ) -> Optional[str]:
         """Genera un PDF a partir del texto de la propuesta ya generado."""
+        return await pdf_render_pool.run(
+            PDFService._render_pdf_from_text, conversation_id, proposal_text
+        )
+
+    @staticmethod
+    def _render_pdf_from_text(conversation_id: str, proposal_text: str) -> Optional[str]:
+        """Renderiza el PDF básico con ReportLab. Se ejecuta en el pool de renderizado."""
         try:
             from reportlab.lib.pagesizes import A4
             from reportlab.lib import colors
@@ -309,6 +324,13 @@ class PDFService:
         Genera un PDF directamente usando ReportLab, sin conversión a HTML.
         Esta es una alternativa directa cuando el proceso normal falla.
         """
+        return await pdf_render_pool.run(
+            PDFService._render_direct_pdf, conversation_id, proposal_text
+        )
+
+    @staticmethod
+    def _render_direct_pdf(conversation_id: str, proposal_text: str) -> Optional[str]:
+        """Renderiza el PDF con tablas usando ReportLab. Se ejecuta en el pool de renderizado."""
         try:
             from reportlab.lib.pagesizes import A4
             from reportlab.lib import colors
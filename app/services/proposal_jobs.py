@@ -0,0 +1,97 @@
+# app/services/proposal_jobs.py
+import os
+import logging
+from typing import Any, Dict, Optional
+
+from app.config import settings
+from app.db.base import AsyncSessionLocal
+from app.models.message import Message
+from app.services.direct_proposal_generator import direct_proposal_generator
+from app.services.storage_service import storage_service
+from app.services.task_queue import PermanentJobError, task_queue
+
+logger = logging.getLogger("hydrous")
+
+GENERATE_PROPOSAL = "generate_proposal"
+
+PROPOSAL_READY_MESSAGE = "✅ Proposal ready! Type 'download pdf' to get your document."
+PROPOSAL_FAILED_MESSAGE = (
+    "Lo siento, hubo un problema generando la propuesta. Por favor intenta de nuevo."
+)
+PROPOSAL_IN_PROGRESS_MESSAGE = (
+    "⏳ Generating your proposal. I'll let you know here as soon as it's ready."
+)
+
+
+def proposal_download_url(conversation_id: str) -> str:
+    return f"{settings.BACKEND_URL}{settings.API_V1_STR}/chat/{conversation_id}/download-pdf"
+
+
+def proposal_job_status_url(job_id: str) -> str:
+    return f"{settings.BACKEND_URL}{settings.API_V1_STR}/chat/proposal-jobs/{job_id}"
+
+
+async def enqueue_proposal(
+    conversation_id: str, user_id: Optional[str] = None, notify: bool = True
+) -> str:
+    """
+    Encola la generación de la propuesta (LLM + PDF) de una conversación.
+    Solo hay un trabajo activo por conversación: si ya existe, devuelve su ID.
+    Debe llamarse después de guardar el turno (el worker lee la conversación de BD).
+    """
+    return await task_queue.enqueue(
+        GENERATE_PROPOSAL,
+        {"conversation_id": conversation_id, "user_id": user_id, "notify": notify},
+        dedup_key=f"proposal:{conversation_id}",
+    )
+
+
+async def generate_proposal_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Handler del trabajo: genera la propuesta y guarda el resultado en la conversación."""
+    conversation_id = payload["conversation_id"]
+    async with AsyncSessionLocal() as db:
+        conv_session = await storage_service.open_session(conversation_id, db)
+        if not conv_session:
+            raise PermanentJobError(f"Conversación no encontrada: {conversation_id}")
+        conversation = conv_session.conversation
+
+        pdf_path = await direct_proposal_generator.generate_complete_proposal(
+            conversation
+        )
+        if not pdf_path or not os.path.exists(pdf_path):
+            # Guardar el texto de la propuesta para que el reintento no repita el LLM
+            await conv_session.flush(db)
+            raise RuntimeError(f"No se pudo generar el PDF para {conversation_id}")
+
+        conversation.metadata["pdf_path"] = pdf_path
+        conversation.metadata["has_proposal"] = True
+        conversation.metadata["is_complete"] = True
+        conversation.metadata["proposal_status"] = "ready"
+        if payload.get("notify", True):
+            conv_session.add_message(Message.assistant(PROPOSAL_READY_MESSAGE))
+
+        if not await conv_session.flush(db):
+            raise RuntimeError(f"No se pudo guardar la propuesta de {conversation_id}")
+
+    logger.info(f"Propuesta generada para {conversation_id}: {pdf_path}")
+    return {
+        "conversation_id": conversation_id,
+        "download_url": proposal_download_url(conversation_id),
+    }
+
+
+async def on_proposal_failed(payload: Dict[str, Any], error: str):
+    """Tras agotar los reintentos, deja constancia en la conversación."""
+    conversation_id = payload["conversation_id"]
+    async with AsyncSessionLocal() as db:
+        conv_session = await storage_service.open_session(conversation_id, db)
+        if not conv_session:
+            return
+        conv_session.metadata["proposal_status"] = "failed"
+        conv_session.metadata["last_error"] = f"Proposal: {error[:200]}"
+        if payload.get("notify", True):
+            conv_session.add_message(Message.assistant(PROPOSAL_FAILED_MESSAGE))
+        await conv_session.flush(db)
+
+
+task_queue.register(GENERATE_PROPOSAL, generate_proposal_job, on_failure=on_proposal_failed)
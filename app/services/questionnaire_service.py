@@ -1,76 +1,111 @@
 # app/services/questionnaire_service.py
 import logging
-from typing import Optional, List, Dict, Any
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Optional, List, Dict, Any, Mapping, Tuple
 
 # Quitar: from app.models.conversation_state import ConversationState
-from app.services.questionnaire_data import QUESTIONNAIRE_STRUCTURE
+from app.services.questionnaire_store import QuestionnaireStore, questionnaire_store
 
 # Quitar: import copy
 
 logger = logging.getLogger("hydrous")
 
 
+@dataclass(frozen=True)
+class QuestionnairePath:
+    """Ruta ordenada e inmutable de preguntas de un sector/subsector, con índice por ID."""
+
+    questions: Tuple[Dict[str, Any], ...]
+    question_ids: Tuple[str, ...]
+    positions: Mapping[str, int]
+
+    @classmethod
+    def build(cls, questions: List[Dict[str, Any]]) -> "QuestionnairePath":
+        question_ids = tuple(q["id"] for q in questions)
+        positions: Dict[str, int] = {}
+        for index, question_id in enumerate(question_ids):
+            # Si un ID se repite, cuenta su primera aparición (como list.index)
+            positions.setdefault(question_id, index)
+        return cls(
+            questions=tuple(questions),
+            question_ids=question_ids,
+            positions=MappingProxyType(positions),
+        )
+
+    def __len__(self) -> int:
+        return len(self.question_ids)
+
+    def position(self, question_id: Optional[str]) -> Optional[int]:
+        """Posición (desde 0) de la pregunta en la ruta, o None si no pertenece a ella."""
+        return self.positions.get(question_id) if question_id else None
+
+    def next_question_id(self, question_id: Optional[str]) -> Optional[str]:
+        """ID de la pregunta siguiente (la primera si no hay actual; None al final)."""
+        if not question_id:
+            return self.question_ids[0] if self.question_ids else None
+        index = self.position(question_id)
+        if index is None or index + 1 >= len(self.question_ids):
+            return None
+        return self.question_ids[index + 1]
+
+    def is_last(self, question_id: Optional[str]) -> bool:
+        index = self.position(question_id)
+        return index is not None and index == len(self.question_ids) - 1
+
+
 class QuestionnaireService:
     """Servicio simplificado para acceder a la estructura del cuestionario."""
 
-    def __init__(self):
-        self.structure = QUESTIONNAIRE_STRUCTURE
-        self.all_questions_base: Dict[str, Dict[str, Any]] = self._flatten_questions()
-        logger.info(
-            f"Servicio de Cuestionario (Simplificado) inicializado con {len(self.all_questions_base)} preguntas base."
-        )
+    def __init__(self, store: QuestionnaireStore = questionnaire_store):
+        # El cuestionario compilado se carga de forma perezosa (índice y sectores)
+        self.store = store
+        self._initial_path: Optional[QuestionnairePath] = None
+        # Rutas por (sector, subsector), construidas una vez al primer uso;
+        # no se copian a la metadata
+        self._paths: Dict[Tuple[str, str], QuestionnairePath] = {}
+        logger.info("Servicio de Cuestionario (Simplificado) inicializado.")
 
-    def _flatten_questions(self) -> Dict[str, Dict[str, Any]]:
-        """Crea un diccionario plano de todas las preguntas por ID (sin cambios)."""
-        # ... (La lógica de _flatten_questions se mantiene igual que antes) ...
-        flat_questions = {}
-        # Añadir preguntas iniciales
-        for q in self.structure.get("initial_questions", []):
-            if "id" in q:
-                flat_questions[q["id"]] = q
-            else:
-                logger.error(
-                    f"Pregunta inicial sin ID encontrada: {q.get('text', 'N/A')}"
-                )
-
-        # Añadir preguntas de sector/subsector
-        for sector, subsectors in self.structure.get(
-            "sector_questionnaires", {}
-        ).items():
-            for subsector, questions in subsectors.items():
-                if not isinstance(questions, list):
-                    logger.error(
-                        f"Estructura inválida para {sector}/{subsector}. Se esperaba lista, se encontró {type(questions)}"
-                    )
-                    continue
-                for q in questions:
-                    if "id" in q:
-                        flat_questions[q["id"]] = q
-                    else:
-                        logger.error(
-                            f"Pregunta sin ID en {sector}/{subsector}: {q.get('text', 'N/A')}"
-                        )
-        return flat_questions
+    @property
+    def initial_path(self) -> QuestionnairePath:
+        if self._initial_path is None:
+            self._initial_path = QuestionnairePath.build(self.store.initial_questions)
+        return self._initial_path
+
+    def _build_path(self, sector: str, subsector: str) -> Optional[QuestionnairePath]:
+        """Ruta (iniciales + sector/subsector) de un subsector, memorizada."""
+        key = (sector, subsector)
+        path = self._paths.get(key)
+        if path is None:
+            questions = self.store.get_subsector_questions(sector, subsector)
+            if questions is None:
+                return None
+            path = QuestionnairePath.build(self.store.initial_questions + questions)
+            self._paths[key] = path
+        return path
+
+    def warm(self):
+        """Carga todos los sectores y construye todas las rutas (p. ej. antes del fork)."""
+        self.initial_path
+        for sector, entry in self.store.index["sectors"].items():
+            for subsector in entry["subsectors"]:
+                self._build_path(sector, subsector)
 
     def get_initial_greeting(self) -> str:
         """Devuelve el saludo inicial (sin cambios)."""
-        return self.structure.get("initial_greeting", "¡Bienvenido!")
+        return self.store.initial_greeting
 
     def get_initial_question_id(self) -> Optional[str]:
         """Devuelve el ID de la primera pregunta inicial (sin cambios)."""
-        initial_questions = self.structure.get("initial_questions", [])
-        return (
-            initial_questions[0]["id"]
-            if initial_questions and "id" in initial_questions[0]
-            else None
-        )
+        initial_questions = self.store.initial_questions
+        return initial_questions[0]["id"] if initial_questions else None
 
     def get_question_details(self, question_id: str) -> Optional[Dict[str, Any]]:
         """
         Obtiene los detalles BASE de una pregunta por su ID.
         NO resuelve condicionales ni formato aquí. Devuelve una copia.
         """
-        question_base = self.all_questions_base.get(question_id)
+        question_base = self.store.get_question(question_id)
         if not question_base:
             logger.error(
                 f"get_question_details: No se encontró pregunta con ID: {question_id}"
@@ -81,6 +116,27 @@ class QuestionnaireService:
 
         return copy.deepcopy(question_base)
 
+    def get_path(
+        self, sector: Optional[str], subsector: Optional[str]
+    ) -> QuestionnairePath:
+        """
+        Ruta precalculada (iniciales + sector/subsector).
+        Si el subsector no existe, usa el cuestionario 'Otro' del sector.
+        """
+        if not sector or not subsector:
+            return self.initial_path
+        return (
+            self._build_path(sector, subsector)
+            or self._build_path(sector, "Otro")
+            or self.initial_path
+        )
+
+    def get_sector_questions(
+        self, sector: Optional[str], subsector: Optional[str]
+    ) -> List[Dict[str, Any]]:
+        """Devuelve la lista ordenada de preguntas (iniciales + sector/subsector)."""
+        return list(self.get_path(sector, subsector).questions)
+
     # --- ELIMINAR LAS SIGUIENTES FUNCIONES ---
     # def get_question(...) # La que resolvía condicionales
     # def _determine_questionnaire_path(...)
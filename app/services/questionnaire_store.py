@@ -0,0 +1,232 @@
+# app/services/questionnaire_store.py
+"""
+Artefacto compilado del cuestionario.
+
+La fuente canónica es `questionnaire_data.py` (editable, con comentarios). Se
+compila a `questionnaire_compiled/`:
+
+- `index.json`: versión, saludo, preguntas iniciales, sectores/subsectores y
+  ubicación de cada ID de pregunta (pequeño, se carga al primer uso).
+- `{sector}.json`: preguntas de un sector; se carga solo cuando se necesita.
+
+Así los workers no importan el dict de ~4.000 líneas al arrancar ni mantienen
+en memoria los sectores que no usan.
+
+Compilar (también se hace en el build de Docker):
+    python -m app.services.questionnaire_store
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("hydrous")
+
+FORMAT_VERSION = 1
+SERVICES_DIR = os.path.dirname(__file__)
+SOURCE_PATH = os.path.join(SERVICES_DIR, "questionnaire_data.py")
+COMPILED_DIR = os.path.join(SERVICES_DIR, "questionnaire_compiled")
+INDEX_FILENAME = "index.json"
+
+
+def _sector_filename(sector: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", sector)
+    slug = re.sub(r"[^a-z0-9]+", "_", decomposed.encode("ascii", "ignore").decode().lower())
+    return f"{slug.strip('_') or 'sector'}.json"
+
+
+def source_version(source_path: str = SOURCE_PATH) -> str:
+    """Hash del archivo fuente: identifica la versión del artefacto compilado."""
+    with open(source_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def _json_default(value: Any) -> Any:
+    # La fuente usa `...` como marcador en algunas opciones pendientes
+    if value is Ellipsis:
+        return "..."
+    raise TypeError(f"Valor no serializable en el cuestionario: {value!r}")
+
+
+def _dump(data: Any, path: str):
+    """Escribe JSON compacto de forma atómica."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                data, f, ensure_ascii=False, separators=(",", ":"), default=_json_default
+            )
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def compile_questionnaire(
+    source_path: str = SOURCE_PATH, compiled_dir: str = COMPILED_DIR
+) -> Dict[str, Any]:
+    """Compila QUESTIONNAIRE_STRUCTURE al índice + un archivo por sector. Devuelve el índice."""
+    from app.services.questionnaire_data import QUESTIONNAIRE_STRUCTURE
+
+    os.makedirs(compiled_dir, exist_ok=True)
+
+    initial_questions = []
+    question_locations: Dict[str, List[Optional[str]]] = {}
+    for q in QUESTIONNAIRE_STRUCTURE.get("initial_questions", []):
+        if "id" not in q:
+            logger.error(f"Pregunta inicial sin ID encontrada: {q.get('text', 'N/A')}")
+            continue
+        initial_questions.append(q)
+        question_locations.setdefault(q["id"], [None, None])
+
+    sectors: Dict[str, Dict[str, Any]] = {}
+    for sector, subsectors in QUESTIONNAIRE_STRUCTURE.get(
+        "sector_questionnaires", {}
+    ).items():
+        sector_data: Dict[str, List[Dict[str, Any]]] = {}
+        for subsector, questions in subsectors.items():
+            if not isinstance(questions, list):
+                logger.error(
+                    f"Estructura inválida para {sector}/{subsector}. Se esperaba lista, se encontró {type(questions)}"
+                )
+                continue
+            valid_questions = []
+            for q in questions:
+                if "id" not in q:
+                    logger.error(
+                        f"Pregunta sin ID en {sector}/{subsector}: {q.get('text', 'N/A')}"
+                    )
+                    continue
+                valid_questions.append(q)
+                question_locations[q["id"]] = [sector, subsector]
+            sector_data[subsector] = valid_questions
+
+        filename = _sector_filename(sector)
+        _dump(sector_data, os.path.join(compiled_dir, filename))
+        sectors[sector] = {"file": filename, "subsectors": list(sector_data)}
+
+    index = {
+        "format_version": FORMAT_VERSION,
+        "version": source_version(source_path),
+        "initial_greeting": QUESTIONNAIRE_STRUCTURE.get("initial_greeting", "¡Bienvenido!"),
+        "initial_questions": initial_questions,
+        "sectors": sectors,
+        "question_locations": question_locations,
+    }
+    # El índice se escribe al final: si existe, los archivos de sector ya están
+    _dump(index, os.path.join(compiled_dir, INDEX_FILENAME))
+    return index
+
+
+class QuestionnaireStore:
+    """
+    Acceso perezoso al cuestionario compilado: el índice al primer uso y cada
+    sector la primera vez que se pide. Si el artefacto falta o no corresponde
+    a la fuente actual, se recompila (con aviso) en el primer acceso.
+    """
+
+    def __init__(self, compiled_dir: str = COMPILED_DIR, source_path: str = SOURCE_PATH):
+        self.compiled_dir = compiled_dir
+        self.source_path = source_path
+        self._index: Optional[Dict[str, Any]] = None
+        self._sectors: Dict[str, Dict[str, List[Dict[str, Any]]]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def index(self) -> Dict[str, Any]:
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = self._load_index()
+        return self._index
+
+    def _load_index(self) -> Dict[str, Any]:
+        index_path = os.path.join(self.compiled_dir, INDEX_FILENAME)
+        expected_version = None
+        if os.path.exists(self.source_path):
+            expected_version = source_version(self.source_path)
+        try:
+            with open(index_path, encoding="utf-8") as f:
+                index = json.load(f)
+            if index.get("format_version") == FORMAT_VERSION and (
+                expected_version is None or index.get("version") == expected_version
+            ):
+                return index
+            logger.warning("Cuestionario compilado desactualizado, recompilando...")
+        except (OSError, ValueError) as e:
+            logger.warning(f"Cuestionario compilado no disponible ({e}), compilando...")
+        return compile_questionnaire(self.source_path, self.compiled_dir)
+
+    @property
+    def version(self) -> str:
+        return self.index["version"]
+
+    @property
+    def initial_greeting(self) -> str:
+        return self.index.get("initial_greeting", "¡Bienvenido!")
+
+    @property
+    def initial_questions(self) -> List[Dict[str, Any]]:
+        return self.index.get("initial_questions", [])
+
+    def has_sector(self, sector: Optional[str]) -> bool:
+        return bool(sector) and sector in self.index["sectors"]
+
+    def _load_sector(self, sector: str) -> Dict[str, List[Dict[str, Any]]]:
+        sector_data = self._sectors.get(sector)
+        if sector_data is not None:
+            return sector_data
+        entry = self.index["sectors"].get(sector)
+        if not entry:
+            return {}
+        with self._lock:
+            sector_data = self._sectors.get(sector)
+            if sector_data is None:
+                with open(
+                    os.path.join(self.compiled_dir, entry["file"]), encoding="utf-8"
+                ) as f:
+                    sector_data = json.load(f)
+                self._sectors[sector] = sector_data
+                logger.info(f"Cuestionario del sector '{sector}' cargado")
+        return sector_data
+
+    def get_subsector_questions(
+        self, sector: Optional[str], subsector: Optional[str]
+    ) -> Optional[List[Dict[str, Any]]]:
+        """Preguntas propias del subsector (sin las iniciales), o None si no existe."""
+        if not self.has_sector(sector) or not subsector:
+            return None
+        return self._load_sector(sector).get(subsector)
+
+    def locate(self, question_id: str) -> Optional[Tuple[Optional[str], Optional[str]]]:
+        """(sector, subsector) donde está la pregunta; (None, None) si es inicial."""
+        location = self.index["question_locations"].get(question_id)
+        return tuple(location) if location else None
+
+    def get_question(self, question_id: str) -> Optional[Dict[str, Any]]:
+        location = self.locate(question_id)
+        if location is None:
+            return None
+        sector, subsector = location
+        if sector is None:
+            questions = self.initial_questions
+        else:
+            questions = self.get_subsector_questions(sector, subsector) or []
+        return next((q for q in questions if q["id"] == question_id), None)
+
+
+# Instancia global
+questionnaire_store = QuestionnaireStore()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    compiled = compile_questionnaire()
+    print(
+        f"Cuestionario compilado (versión {compiled['version']}): "
+        f"{len(compiled['sectors'])} sectores en {COMPILED_DIR}"
+    )
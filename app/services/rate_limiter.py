@@ -0,0 +1,287 @@
+# app/services/rate_limiter.py
+import logging
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from app.config import settings
+
+logger = logging.getLogger("hydrous")
+
+
+@dataclass
+class RateLimitResult:
+    """Resultado de consumir tokens de un bucket."""
+
+    allowed: bool
+    remaining: float
+    retry_after: float
+    backend: str
+
+
+# Recarga + consumo atómicos en Redis.
+# KEYS[1] = clave del bucket
+# ARGV = capacidad, tasa de recarga (tokens/s), coste, TTL de la clave (s)
+# Se usa el reloj del servidor Redis para que todos los workers compartan la misma hora.
+TOKEN_BUCKET_LUA = """
+local key = KEYS[1]
+local capacity = tonumber(ARGV[1])
+local refill_rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local ttl = tonumber(ARGV[4])
+
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+
+local data = redis.call('HMGET', key, 'tokens', 'ts')
+local tokens = tonumber(data[1])
+local ts = tonumber(data[2])
+if tokens == nil or ts == nil then
+    tokens = capacity
+    ts = now
+end
+
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * refill_rate)
+
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = (cost - tokens) / refill_rate
+end
+
+redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', key, ttl)
+
+return {allowed, tostring(tokens), tostring(retry_after)}
+"""
+
+
+# Contador de peticiones en curso por clave.
+# KEYS[1] = clave del contador
+# ARGV = límite, TTL de seguridad (s) por si un worker muere sin liberar
+CONCURRENCY_ACQUIRE_LUA = """
+local current = redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[2]))
+if current > tonumber(ARGV[1]) then
+    redis.call('DECR', KEYS[1])
+    return {0, current - 1}
+end
+return {1, current}
+"""
+
+CONCURRENCY_RELEASE_LUA = """
+local current = redis.call('DECR', KEYS[1])
+if current <= 0 then
+    redis.call('DEL', KEYS[1])
+    return 0
+end
+return current
+"""
+
+
+class InMemoryTokenBucket:
+    """
+    Token bucket en memoria del proceso (respaldo cuando Redis no está disponible).
+    Los buckets inactivos se eliminan periódicamente para no crecer sin límite.
+    """
+
+    def __init__(self, idle_ttl: float = 3600.0, cleanup_interval: float = 300.0):
+        self.buckets: Dict[str, Dict[str, float]] = {}
+        self.idle_ttl = idle_ttl
+        self.cleanup_interval = cleanup_interval
+        self._last_cleanup = time.monotonic()
+
+    def consume(
+        self, key: str, capacity: float, refill_rate: float, cost: float = 1.0
+    ) -> RateLimitResult:
+        now = time.monotonic()
+        self._maybe_cleanup(now)
+
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = {"tokens": capacity, "last_refill": now}
+            self.buckets[key] = bucket
+
+        # Recargar según el tiempo transcurrido (sin exceder la capacidad)
+        time_passed = now - bucket["last_refill"]
+        bucket["tokens"] = min(capacity, bucket["tokens"] + time_passed * refill_rate)
+        bucket["last_refill"] = now
+
+        if bucket["tokens"] >= cost:
+            bucket["tokens"] -= cost
+            return RateLimitResult(True, bucket["tokens"], 0.0, "memory")
+
+        retry_after = (cost - bucket["tokens"]) / refill_rate
+        return RateLimitResult(False, bucket["tokens"], retry_after, "memory")
+
+    def _maybe_cleanup(self, now: float):
+        if now - self._last_cleanup < self.cleanup_interval:
+            return
+        self._last_cleanup = now
+        expired = [
+            key
+            for key, bucket in self.buckets.items()
+            if now - bucket["last_refill"] > self.idle_ttl
+        ]
+        for key in expired:
+            del self.buckets[key]
+        if expired:
+            logger.debug(f"Rate limit cleanup: {len(expired)} buckets removidos")
+
+
+class RedisTokenBucket:
+    """Token bucket compartido entre workers/tareas mediante un script Lua atómico."""
+
+    def __init__(self, redis_client, key_prefix: str = "ratelimit:"):
+        self.redis_client = redis_client
+        self.key_prefix = key_prefix
+        self._script = None
+
+    async def consume(
+        self, key: str, capacity: float, refill_rate: float, cost: float = 1.0
+    ) -> RateLimitResult:
+        if self._script is None:
+            # AttributeError si el cliente es el MockRedis (sin scripting)
+            self._script = self.redis_client.register_script(TOKEN_BUCKET_LUA)
+
+        # La clave expira cuando el bucket se habría rellenado por completo
+        ttl = max(60, int(capacity / refill_rate * 2) + 1)
+        allowed, remaining, retry_after = await self._script(
+            keys=[f"{self.key_prefix}{key}"],
+            args=[capacity, refill_rate, cost, ttl],
+        )
+        return RateLimitResult(
+            bool(int(allowed)), float(remaining), float(retry_after), "redis"
+        )
+
+
+class RateLimiter:
+    """
+    Limitador con Redis como backend principal y memoria como respaldo.
+
+    Si Redis falla, se usa el bucket en memoria durante `redis_retry_interval`
+    segundos antes de volver a intentarlo (para no pagar el timeout en cada petición).
+    """
+
+    def __init__(self, redis_client=None, redis_retry_interval: float = 30.0):
+        self.memory = InMemoryTokenBucket()
+        self.redis: Optional[RedisTokenBucket] = (
+            RedisTokenBucket(redis_client) if redis_client is not None else None
+        )
+        self.redis_retry_interval = redis_retry_interval
+        self._redis_disabled_until = 0.0
+
+    async def consume(
+        self, key: str, capacity: float, refill_rate: float, cost: float = 1.0
+    ) -> RateLimitResult:
+        if self.redis is not None and time.monotonic() >= self._redis_disabled_until:
+            try:
+                return await self.redis.consume(key, capacity, refill_rate, cost)
+            except Exception as e:
+                self._redis_disabled_until = (
+                    time.monotonic() + self.redis_retry_interval
+                )
+                logger.warning(
+                    f"Rate limit en Redis no disponible, usando memoria durante "
+                    f"{self.redis_retry_interval:.0f}s: {e}"
+                )
+        return self.memory.consume(key, capacity, refill_rate, cost)
+
+
+class ConcurrencyLimiter:
+    """
+    Límite de peticiones simultáneas por clave (ej. llamadas al LLM por usuario).
+
+    Usa un contador en Redis compartido entre workers; si Redis falla, cuenta
+    en memoria del proceso. `acquire` devuelve el backend que concedió el hueco
+    (o None si se rechaza) y `release` debe recibirlo para liberar el mismo contador.
+    """
+
+    def __init__(
+        self,
+        redis_client=None,
+        key_prefix: str = "inflight:",
+        ttl: int = 300,
+        redis_retry_interval: float = 30.0,
+    ):
+        self.redis_client = redis_client
+        self.key_prefix = key_prefix
+        self.ttl = ttl
+        self.redis_retry_interval = redis_retry_interval
+        self._redis_disabled_until = 0.0
+        self._acquire_script = None
+        self._release_script = None
+        self.counts: Dict[str, int] = {}
+
+    def _redis_available(self) -> bool:
+        return (
+            self.redis_client is not None
+            and time.monotonic() >= self._redis_disabled_until
+        )
+
+    def _disable_redis(self, e: Exception):
+        self._redis_disabled_until = time.monotonic() + self.redis_retry_interval
+        logger.warning(
+            f"Límite de concurrencia en Redis no disponible, usando memoria durante "
+            f"{self.redis_retry_interval:.0f}s: {e}"
+        )
+
+    async def acquire(self, key: str, limit: int) -> Optional[str]:
+        if self._redis_available():
+            try:
+                if self._acquire_script is None:
+                    self._acquire_script = self.redis_client.register_script(
+                        CONCURRENCY_ACQUIRE_LUA
+                    )
+                allowed, _ = await self._acquire_script(
+                    keys=[f"{self.key_prefix}{key}"], args=[limit, self.ttl]
+                )
+                return "redis" if int(allowed) else None
+            except Exception as e:
+                self._disable_redis(e)
+
+        current = self.counts.get(key, 0)
+        if current >= limit:
+            return None
+        self.counts[key] = current + 1
+        return "memory"
+
+    async def release(self, key: str, backend: str):
+        if backend == "redis":
+            try:
+                if self._release_script is None:
+                    self._release_script = self.redis_client.register_script(
+                        CONCURRENCY_RELEASE_LUA
+                    )
+                await self._release_script(keys=[f"{self.key_prefix}{key}"])
+            except Exception as e:
+                # El contador caduca solo tras `ttl` segundos
+                logger.warning(f"No se pudo liberar el contador {key} en Redis: {e}")
+            return
+
+        current = self.counts.get(key, 0) - 1
+        if current > 0:
+            self.counts[key] = current
+        else:
+            self.counts.pop(key, None)
+
+
+def create_rate_limiter() -> RateLimiter:
+    """Crea el limitador según RATE_LIMIT_BACKEND ("redis" o "memory")."""
+    if settings.RATE_LIMIT_BACKEND == "redis":
+        from app.db.redis_client import redis_client
+
+        return RateLimiter(redis_client)
+    return RateLimiter()
+
+
+def create_concurrency_limiter() -> ConcurrencyLimiter:
+    """Crea el limitador de concurrencia según RATE_LIMIT_BACKEND."""
+    if settings.RATE_LIMIT_BACKEND == "redis":
+        from app.db.redis_client import redis_client
+
+        return ConcurrencyLimiter(redis_client)
+    return ConcurrencyLimiter()
@@ -19,7 +19,13 @@ async def upload_file_to_s3(file_obj: IO[bytes], filename: str, content_type: Op
         await s3.upload_fileobj(file_obj, S3_BUCKET, filename, ExtraArgs=extra_args)
     return filename  # La key en S3
 
-async def get_presigned_url(filename: str, expires: int = 3600) -> str:
+async def get_presigned_url(
+    filename: str, expires: int = 3600, download_name: Optional[str] = None
+) -> str:
+    params = {"Bucket": S3_BUCKET, "Key": filename}
+    if download_name:
+        # Nombre con el que el navegador guarda el archivo
+        params["ResponseContentDisposition"] = f'attachment; filename="{download_name}"'
     session = aioboto3.Session()
     async with session.client(
         "s3",
@@ -29,7 +35,40 @@ async def get_presigned_url(filename: str, expires: int = 3600) -> str:
     ) as s3:
         url = await s3.generate_presigned_url(
             "get_object",
-            Params={"Bucket": S3_BUCKET, "Key": filename},
+            Params=params,
             ExpiresIn=expires,
         )
         return url
+
+async def object_exists(filename: str) -> bool:
+    session = aioboto3.Session()
+    async with session.client(
+        "s3",
+        region_name=S3_REGION,
+        aws_access_key_id=S3_ACCESS_KEY,
+        aws_secret_access_key=S3_SECRET_KEY,
+    ) as s3:
+        try:
+            await s3.head_object(Bucket=S3_BUCKET, Key=filename)
+        except s3.exceptions.ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                return False
+            raise
+    return True
+
+async def download_file_from_s3(filename: str, file_obj: IO[bytes]) -> bool:
+    """Descarga el objeto en file_obj. Devuelve False si la key no existe."""
+    session = aioboto3.Session()
+    async with session.client(
+        "s3",
+        region_name=S3_REGION,
+        aws_access_key_id=S3_ACCESS_KEY,
+        aws_secret_access_key=S3_SECRET_KEY,
+    ) as s3:
+        try:
+            await s3.download_fileobj(S3_BUCKET, filename, file_obj)
+        except s3.exceptions.ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                return False
+            raise
+    return True
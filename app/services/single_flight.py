@@ -0,0 +1,165 @@
+# app/services/single_flight.py
+import asyncio
+import json
+import time
+import uuid
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+logger = logging.getLogger("hydrous")
+
+# Libera el lock solo si sigue siendo nuestro (no el de otro worker tras expirar)
+RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class SingleFlight:
+    """
+    Ejecuta una sola vez una operación costosa por clave aunque haya llamadas concurrentes.
+
+    - En el proceso: las llamadas tardías esperan el Future de la primera.
+    - Entre workers: lock en Redis con SET NX; los demás esperan a que se libere
+      y leen el resultado que dejó el primero (JSON, con TTL corto).
+
+    Si el primero falla (excepción o resultado None), en otros workers no se
+    publica resultado y el siguiente en adquirir el lock lo intenta de nuevo.
+    Sin Redis, el dedup es solo dentro del proceso.
+    """
+
+    def __init__(
+        self,
+        redis_client=None,
+        key_prefix: str = "singleflight:",
+        poll_interval: float = 0.5,
+    ):
+        self.redis_client = redis_client
+        self.key_prefix = key_prefix
+        self.poll_interval = poll_interval
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._release_script = None
+
+    async def run(
+        self,
+        key: str,
+        func: Callable[[], Awaitable[Any]],
+        lock_ttl: int = 300,
+        result_ttl: int = 120,
+    ) -> Any:
+        """Devuelve el resultado de `func()`, compartido con las llamadas concurrentes de `key`."""
+        future = self._inflight.get(key)
+        if future is not None:
+            logger.info(f"Single-flight: esperando la ejecución en curso de '{key}'")
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await self._run_distributed(key, func, lock_ttl, result_ttl)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Marcar como recuperada si nadie más la esperaba
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _run_distributed(
+        self,
+        key: str,
+        func: Callable[[], Awaitable[Any]],
+        lock_ttl: int,
+        result_ttl: int,
+    ) -> Any:
+        if self.redis_client is None:
+            return await func()
+
+        lock_key = f"{self.key_prefix}lock:{key}"
+        result_key = f"{self.key_prefix}result:{key}"
+        token = str(uuid.uuid4())
+        deadline = time.monotonic() + lock_ttl
+
+        while True:
+            try:
+                acquired = await self.redis_client.set(
+                    lock_key, token, nx=True, ex=lock_ttl
+                )
+            except Exception as e:
+                logger.warning(f"Single-flight sin Redis para '{key}', solo dedup local: {e}")
+                return await func()
+
+            if acquired:
+                return await self._run_as_leader(
+                    key, func, lock_key, result_key, token, result_ttl
+                )
+
+            # Otro worker lo está ejecutando: esperar a que libere el lock
+            logger.info(f"Single-flight: '{key}' en curso en otro worker, esperando")
+            try:
+                while (
+                    await self.redis_client.exists(lock_key)
+                    and time.monotonic() < deadline
+                ):
+                    await asyncio.sleep(self.poll_interval)
+                cached = await self.redis_client.get(result_key)
+            except Exception as e:
+                logger.warning(f"Single-flight: error esperando '{key}', ejecutando localmente: {e}")
+                return await func()
+
+            if cached:
+                return json.loads(cached)
+            if time.monotonic() >= deadline:
+                logger.warning(f"Single-flight: timeout esperando '{key}', ejecutando localmente")
+                return await func()
+            # El otro worker falló sin resultado: intentar adquirir el lock de nuevo
+
+    async def _run_as_leader(
+        self,
+        key: str,
+        func: Callable[[], Awaitable[Any]],
+        lock_key: str,
+        result_key: str,
+        token: str,
+        result_ttl: int,
+    ) -> Any:
+        try:
+            await self.redis_client.delete(result_key)
+            result = await func()
+            if result is not None:
+                try:
+                    await self.redis_client.set(
+                        result_key, json.dumps(result, default=str), ex=result_ttl
+                    )
+                except Exception as e:
+                    logger.warning(f"Single-flight: no se pudo publicar el resultado de '{key}': {e}")
+            return result
+        finally:
+            try:
+                if self._release_script is None:
+                    self._release_script = self.redis_client.register_script(
+                        RELEASE_LOCK_LUA
+                    )
+                await self._release_script(keys=[lock_key], args=[token])
+            except Exception as e:
+                # El lock expira solo tras lock_ttl
+                logger.warning(f"Single-flight: no se pudo liberar el lock de '{key}': {e}")
+
+
+def create_single_flight() -> SingleFlight:
+    """Single-flight con Redis para dedup entre workers (y dentro del proceso)."""
+    from app.db.redis_client import redis_client
+
+    return SingleFlight(redis_client)
+
+
+# Instancia global
+single_flight = create_single_flight()
@@ -5,13 +5,14 @@ from typing import Dict, Optional, Any, List
 from uuid import UUID
 
 from fastapi import Depends
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import SQLAlchemyError
 
 from app.models.conversation import Conversation as PydanticConversation
 from app.models.message import Message as PydanticMessage
 from app.db.models.conversation import Conversation as DBConversation
 from app.db.models.message import Message as DBMessage, RoleEnum
-from app.db.base import get_db
+from app.db.base import AsyncSessionLocal
 from app.repositories.conversation_repository import conversation_repository
 from app.repositories.message_repository import message_repository
 from app.config import settings
@@ -19,19 +20,36 @@ from app.config import settings
 logger = logging.getLogger("hydrous")
 
 
+
+def ensure_token_count(message: PydanticMessage) -> Optional[int]:
+    """
+    Calcula (una sola vez) los tokens del mensaje y los deja en `message.token_count`.
+    Devuelve None si no se pueden contar (p. ej. tiktoken no disponible).
+    """
+    if message.token_count is None:
+        try:
+            from app.utils.token_counter import count_message_tokens
+
+            message.token_count = count_message_tokens(
+                message.role, message.content, model=settings.MODEL
+            )
+        except Exception as e:
+            logger.warning(f"DBG_SS: No se pudieron contar tokens del mensaje: {e}")
+    return message.token_count
+
+
 class StorageService:
     """
     Servicio de almacenamiento refactorizado para usar PostgreSQL
     """
 
-    async def create_conversation(self, db: Session) -> PydanticConversation:
+    async def create_conversation(self, db: AsyncSession) -> PydanticConversation:
         """Crea y almacena una nueva conversación con metadata inicial."""
         initial_metadata = {
             "current_question_id": None,
             "collected_data": {},
             "selected_sector": None,
             "selected_subsector": None,
-            "questionnaire_path": [],
             "is_complete": False,
             "has_proposal": False,
             "proposal_text": None,
@@ -41,7 +59,7 @@ class StorageService:
         }
 
         # Crear en base de datos
-        db_conversation = conversation_repository.create_with_metadata(
+        db_conversation = await conversation_repository.create_with_metadata(
             db,
             obj_in={
                 "selected_sector": None,
@@ -75,39 +93,41 @@ class StorageService:
         return conversation
 
     async def get_conversation(
-        self, conversation_id: str, db: Session
+        self, conversation_id: str, db: AsyncSession, user_id: Optional[str] = None
     ) -> Optional[PydanticConversation]:
-        """Obtiene una conversación por su ID desde la base de datos."""
-        # Validar ID
+        """
+        Obtiene una conversación por su ID desde la base de datos.
+
+        Con user_id solo se devuelve si pertenece a ese usuario (None si no).
+        """
+        # Validar IDs
         try:
             conversation_uuid = UUID(conversation_id)
+            user_uuid = UUID(user_id) if user_id is not None else None
         except ValueError:
             logger.warning(f"DBG_SS: ID de conversación inválido: {conversation_id}")
             return None
 
-        # Obtener conversación y sus mensajes
-        db_conversation = conversation_repository.get(db, conversation_uuid)
+        # Conversación, mensajes y metadata (y propiedad) en una sola consulta
+        db_conversation = await conversation_repository.get_full(
+            db, conversation_uuid, user_uuid
+        )
 
         if not db_conversation:
             logger.warning(f"DBG_SS: Conversación {conversation_id} NO encontrada.")
             return None
 
-        # Obtener mensajes
-        db_messages = message_repository.get_by_conversation_id(db, conversation_uuid)
-
-        # Obtener metadata
-        metadata = conversation_repository.get_metadata(
-            db, conversation_id=conversation_uuid
-        )
+        db_messages = db_conversation["messages"]
+        metadata = db_conversation["metadata"]
 
         # Si no hay metadata, usar valores predeterminados
+        metadata_loaded = bool(metadata)
         if not metadata:
             metadata = {
                 "current_question_id": None,
                 "collected_data": {},
                 "selected_sector": None,
                 "selected_subsector": None,
-                "questionnaire_path": [],
                 "is_complete": False,
                 "has_proposal": False,
                 "proposal_text": None,
@@ -121,19 +141,24 @@ class StorageService:
         for msg in db_messages:
             pydantic_messages.append(
                 PydanticMessage(
-                    id=str(msg.id),
-                    role=msg.role.value,
-                    content=msg.content,
-                    created_at=msg.created_at,
+                    id=str(msg["id"]),
+                    role=msg["role"],
+                    content=msg["content"],
+                    created_at=msg["created_at"],
+                    token_count=msg.get("token_count"),
                 )
             )
 
+        user_id = db_conversation["user_id"]
         conversation = PydanticConversation(
-            id=str(db_conversation.id),
-            created_at=db_conversation.created_at,
+            id=str(db_conversation["id"]),
+            created_at=db_conversation["created_at"],
+            user_id=str(user_id) if user_id else None,
             messages=pydantic_messages,
             metadata=metadata,
         )
+        if metadata_loaded:
+            conversation.mark_metadata_persisted()
 
         logger.info(
             f"DBG_SS: Conversación {conversation_id} RECUPERADA. Metadata actual: {metadata}"
@@ -141,7 +166,7 @@ class StorageService:
         return conversation
 
     async def add_message_to_conversation(
-        self, conversation_id: str, message: PydanticMessage, db: Session
+        self, conversation_id: str, message: PydanticMessage, db: AsyncSession
     ) -> bool:
         """Añade un mensaje a la conversación en la base de datos."""
         # Validar ID
@@ -152,7 +177,7 @@ class StorageService:
             return False
 
         # Verificar que la conversación existe
-        db_conversation = conversation_repository.get(db, conversation_uuid)
+        db_conversation = await conversation_repository.get_async(db, conversation_uuid)
         if not db_conversation:
             logger.error(
                 f"DBG_SS: Error al añadir mensaje, conversación {conversation_id} no encontrada."
@@ -162,18 +187,21 @@ class StorageService:
         # Crear mensaje según el rol
         role = getattr(message, "role", "user")
         content = getattr(message, "content", "")
+        token_count = (
+            ensure_token_count(message) if isinstance(message, PydanticMessage) else None
+        )
 
         if role == "user":
-            db_message = message_repository.create_user_message(
-                db, conversation_id=conversation_uuid, content=content
+            db_message = await message_repository.create_user_message(
+                db, conversation_id=conversation_uuid, content=content, token_count=token_count
             )
         elif role == "assistant":
-            db_message = message_repository.create_assistant_message(
-                db, conversation_id=conversation_uuid, content=content
+            db_message = await message_repository.create_assistant_message(
+                db, conversation_id=conversation_uuid, content=content, token_count=token_count
             )
         elif role == "system":
-            db_message = message_repository.create_system_message(
-                db, conversation_id=conversation_uuid, content=content
+            db_message = await message_repository.create_system_message(
+                db, conversation_id=conversation_uuid, content=content, token_count=token_count
             )
         else:
             logger.error(f"DBG_SS: Rol de mensaje inválido: {role}")
@@ -186,8 +214,51 @@ class StorageService:
         logger.debug(f"DBG_SS: Mensaje '{role}' añadido a {conversation_id}.")
         return True
 
+    async def _write_conversation(
+        self, conversation: PydanticConversation, conversation_id: UUID, db: AsyncSession
+    ) -> bool:
+        """
+        Escribe columnas principales y metadata modificada SIN hacer commit:
+        un UPDATE + un upsert por lotes dentro de la transacción actual.
+        """
+        # Actualizar datos principales
+        update_data = {
+            "selected_sector": conversation.metadata.get("selected_sector"),
+            "selected_subsector": conversation.metadata.get("selected_subsector"),
+            "current_question_id": conversation.metadata.get("current_question_id"),
+            "is_complete": conversation.metadata.get("is_complete", False),
+            "has_proposal": conversation.metadata.get("has_proposal", False),
+            "client_name": conversation.metadata.get("client_name", "Cliente"),
+            "proposal_text": conversation.metadata.get("proposal_text"),
+            "pdf_path": conversation.metadata.get("pdf_path"),
+        }
+
+        # Solo guardar en tabla metadata lo que no está en campos principales
+        # y ha cambiado desde que se cargó la conversación
+        changed_metadata = {
+            key: value
+            for key, value in conversation.get_changed_metadata().items()
+            if key not in update_data
+        }
+
+        if not await conversation_repository.update_fields(
+            db, conversation_id=conversation_id, values=update_data, commit=False
+        ):
+            logger.error(
+                f"DBG_SS: Conversación {conversation.id} no encontrada para actualizar."
+            )
+            return False
+
+        if not await conversation_repository.upsert_metadata(
+            db, conversation_id=conversation_id, items=changed_metadata, commit=False
+        ):
+            logger.error(f"DBG_SS: Error al actualizar metadata de {conversation.id}")
+            return False
+
+        return True
+
     async def save_conversation(
-        self, conversation: PydanticConversation, db: Session
+        self, conversation: PydanticConversation, db: AsyncSession
     ) -> bool:
         """Guarda/Actualiza la conversación completa en la base de datos."""
         if not isinstance(conversation, PydanticConversation):
@@ -203,63 +274,48 @@ class StorageService:
             logger.error(f"DBG_SS: ID de conversación inválido: {conversation.id}")
             return False
 
-        # Verificar que la conversación existe
-        db_conversation = conversation_repository.get(db, conversation_id)
-        if not db_conversation:
-            logger.error(
-                f"DBG_SS: Conversación {conversation.id} no encontrada para actualizar."
-            )
-            return False
-
-        # Actualizar datos principales
-        update_data = {
-            "selected_sector": conversation.metadata.get("selected_sector"),
-            "selected_subsector": conversation.metadata.get("selected_subsector"),
-            "current_question_id": conversation.metadata.get("current_question_id"),
-            "is_complete": conversation.metadata.get("is_complete", False),
-            "has_proposal": conversation.metadata.get("has_proposal", False),
-            "client_name": conversation.metadata.get("client_name", "Cliente"),
-            "proposal_text": conversation.metadata.get("proposal_text"),
-            "pdf_path": conversation.metadata.get("pdf_path"),
-        }
-
-        # Actualizar conversación
-        updated_conversation = conversation_repository.update(
-            db, db_obj=db_conversation, obj_in=update_data
-        )
-        if not updated_conversation:
-            logger.error(f"DBG_SS: Error al actualizar conversación {conversation.id}")
+        try:
+            if not await self._write_conversation(conversation, conversation_id, db):
+                await db.rollback()
+                return False
+            await db.commit()
+        except SQLAlchemyError as e:
+            logger.error(f"DBG_SS: Error al guardar conversación {conversation.id}: {e}")
+            await db.rollback()
             return False
 
-        # Actualizar metadata
-        for key, value in conversation.metadata.items():
-            # Solo guardar en tabla metadata lo que no está en campos principales
-            if key not in update_data:
-                conversation_repository.update_metadata(
-                    db, conversation_id=conversation_id, key=key, value=value
-                )
-
+        conversation.mark_metadata_persisted()
         logger.info(
             f"DBG_SS: Conversación {conversation.id} actualizada en base de datos."
         )
         return True
 
+    async def open_session(
+        self, conversation_id: str, db: AsyncSession, user_id: Optional[str] = None
+    ) -> Optional["ConversationSession"]:
+        """Carga la conversación y devuelve su unidad de trabajo para la petición."""
+        conversation = await self.get_conversation(conversation_id, db, user_id)
+        if not conversation:
+            return None
+        return ConversationSession(self, conversation)
+
     async def cleanup_old_conversations(self):
         """Elimina conversaciones más antiguas que el timeout."""
         # Obtener nueva sesión
-        db = conversation_repository.get_session()
-        try:
+        async with AsyncSessionLocal() as db:
             # Obtener conversaciones antiguas
-            old_conversations = conversation_repository.get_old_conversations(
+            old_conversations = await conversation_repository.get_old_conversations(
                 db, older_than_seconds=settings.CONVERSATION_TIMEOUT
             )
 
             removed_count = 0
             for conv in old_conversations:
                 try:
-                    # Eliminar conversación (cascada elimina mensajes y metadata)
-                    conversation_repository.remove(db, id=conv.id)
-                    removed_count += 1
+                    # Eliminar conversación con mensajes y metadata
+                    if await conversation_repository.remove_with_children(
+                        db, id=conv.id
+                    ):
+                        removed_count += 1
                 except Exception as e:
                     logger.error(
                         f"Error eliminando conversación antigua {conv.id}: {e}"
@@ -269,8 +325,87 @@ class StorageService:
                 logger.info(
                     f"Limpieza completada. {removed_count} conversaciones antiguas eliminadas."
                 )
-        finally:
-            db.close()
+
+class ConversationSession:
+    """
+    Unidad de trabajo de una conversación durante una petición.
+
+    Los mensajes nuevos se añaden en memoria (con el mismo ID que tendrán
+    en BD) y la metadata se modifica directamente en `conversation.metadata`.
+    `flush()` escribe todo en una única transacción al final de la petición,
+    sin necesidad de recargar la conversación entre pasos.
+    """
+
+    def __init__(self, storage: StorageService, conversation: PydanticConversation):
+        self.storage = storage
+        self.conversation = conversation
+        self._pending_messages: List[PydanticMessage] = []
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        return self.conversation.metadata
+
+    def add_message(self, message: PydanticMessage):
+        """Añade el mensaje al historial en memoria y lo deja pendiente de guardar."""
+        self.conversation.add_message(message)
+        self._pending_messages.append(message)
+
+    @property
+    def is_dirty(self) -> bool:
+        return bool(self._pending_messages) or bool(
+            self.conversation.get_changed_metadata()
+        )
+
+    async def flush(self, db: AsyncSession) -> bool:
+        """Escribe mensajes nuevos y metadata modificada con un solo commit."""
+        try:
+            conversation_id = UUID(self.conversation.id)
+        except ValueError:
+            logger.error(
+                f"DBG_SS: ID de conversación inválido: {self.conversation.id}"
+            )
+            return False
+
+        try:
+            if not await message_repository.create_many(
+                db,
+                conversation_id=conversation_id,
+                messages=[
+                    {
+                        "id": msg.id,
+                        "role": msg.role,
+                        "content": msg.content,
+                        "created_at": msg.created_at,
+                        "token_count": ensure_token_count(msg),
+                    }
+                    for msg in self._pending_messages
+                ],
+                commit=False,
+            ):
+                await db.rollback()
+                return False
+
+            if not await self.storage._write_conversation(
+                self.conversation, conversation_id, db
+            ):
+                await db.rollback()
+                return False
+
+            await db.commit()
+        except SQLAlchemyError as e:
+            logger.error(
+                f"DBG_SS: Error en flush de conversación {self.conversation.id}: {e}"
+            )
+            await db.rollback()
+            return False
+
+        logger.info(
+            f"DBG_SS: Conversación {self.conversation.id} guardada "
+            f"({len(self._pending_messages)} mensajes nuevos)."
+        )
+        self._pending_messages = []
+        self.conversation.mark_metadata_persisted()
+        return True
 
 
 # Instancia global
@@ -1,79 +1,443 @@
 # app/services/task_queue.py
 import asyncio
-from typing import Dict, Any, Callable, Coroutine
+import json
+import time
 import uuid
 import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from app.config import settings
 
 logger = logging.getLogger("hydrous")
 
+JobHandler = Callable[[Dict[str, Any]], Awaitable[Any]]
+FailureHandler = Callable[[Dict[str, Any], str], Awaitable[None]]
+
+# Estados de un trabajo
+QUEUED = "queued"
+RUNNING = "running"
+RETRYING = "retrying"
+COMPLETED = "completed"
+FAILED = "failed"
+ACTIVE_STATUSES = (QUEUED, RUNNING, RETRYING)
+
+
+class PermanentJobError(Exception):
+    """Error de un trabajo que no tiene sentido reintentar (ej. conversación inexistente)."""
+
+
+# Mueve a la cola los trabajos reintentables cuya hora ya llegó.
+# KEYS[1] = zset de diferidos, KEYS[2] = cola; ARGV[1] = ahora (epoch)
+PROMOTE_DELAYED_LUA = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, 100)
+for _, job_id in ipairs(due) do
+    redis.call('ZREM', KEYS[1], job_id)
+    redis.call('LPUSH', KEYS[2], job_id)
+end
+return #due
+"""
+
+
 class TaskQueue:
-    """Gestor de tareas asíncronas con seguimiento de estado."""
-    
-    def __init__(self):
-        self.tasks: Dict[str, Dict[str, Any]] = {}
-        
-    async def add_task(self, coroutine: Coroutine, task_name: str = None) -> str:
-        """Añade una tarea a la cola y retorna su ID."""
-        task_id = str(uuid.uuid4())
-        task_name = task_name or f"task-{task_id[:8]}"
-        
-        self.tasks[task_id] = {
-            "name": task_name,
-            "status": "pending",
-            "result": None,
-            "error": None,
-            "created_at": asyncio.get_event_loop().time()
+    """
+    Cola de trabajos durable en Redis, compartida por todos los workers.
+
+    - Cada trabajo tiene un ID y su estado en un hash (`jobs:job:{id}`) que se
+      puede consultar desde cualquier worker web (polling).
+    - Los consumidores (`python -m app.worker` o, con JOB_WORKER_IN_PROCESS,
+      cada worker de la API) usan BRPOPLPUSH hacia una lista de "en proceso";
+      si un proceso muere, el trabajo se recupera cuando caduca su lease.
+    - Reintentos con backoff exponencial hasta `max_attempts`.
+    - `dedup_key` evita encolar dos veces el mismo trabajo activo
+      (ej. una propuesta por conversación).
+
+    Con JOB_QUEUE_BACKEND="local" (sin Redis) los trabajos se ejecutan como
+    tareas asyncio en el propio proceso, con el mismo API. Con Redis no hay
+    respaldo en proceso: si Redis falla, `enqueue` lanza la excepción.
+    """
+
+    def __init__(
+        self,
+        redis_client=None,
+        key_prefix: str = "jobs:",
+        max_attempts: int = 3,
+        retry_backoff: float = 10.0,
+        lease_seconds: int = 300,
+        result_ttl: int = 86400,
+    ):
+        self.redis_client = redis_client
+        self.key_prefix = key_prefix
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.lease_seconds = lease_seconds
+        self.result_ttl = result_ttl
+
+        self.handlers: Dict[str, JobHandler] = {}
+        self.failure_handlers: Dict[str, FailureHandler] = {}
+        self._promote_script = None
+
+        # Backend local (JOB_QUEUE_BACKEND="local")
+        self.local_jobs: Dict[str, Dict[str, Any]] = {}
+        self.local_dedup: Dict[str, str] = {}
+        self._local_tasks: set = set()
+
+    # --- Claves ---
+
+    @property
+    def queue_key(self) -> str:
+        return f"{self.key_prefix}queue"
+
+    @property
+    def processing_key(self) -> str:
+        return f"{self.key_prefix}processing"
+
+    @property
+    def delayed_key(self) -> str:
+        return f"{self.key_prefix}delayed"
+
+    def _job_key(self, job_id: str) -> str:
+        return f"{self.key_prefix}job:{job_id}"
+
+    def _lease_key(self, job_id: str) -> str:
+        return f"{self.key_prefix}lease:{job_id}"
+
+    def _dedup_key(self, dedup_key: str) -> str:
+        return f"{self.key_prefix}dedup:{dedup_key}"
+
+    # --- Registro de handlers ---
+
+    def register(
+        self,
+        job_type: str,
+        handler: JobHandler,
+        on_failure: Optional[FailureHandler] = None,
+    ):
+        """Registra la corrutina que procesa un tipo de trabajo (y opcionalmente su fallo final)."""
+        self.handlers[job_type] = handler
+        if on_failure is not None:
+            self.failure_handlers[job_type] = on_failure
+
+    # --- Productor ---
+
+    async def enqueue(
+        self,
+        job_type: str,
+        payload: Dict[str, Any],
+        dedup_key: Optional[str] = None,
+        max_attempts: Optional[int] = None,
+    ) -> str:
+        """
+        Encola un trabajo y devuelve su ID.
+        Si hay un trabajo activo con el mismo `dedup_key`, devuelve el existente.
+        """
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        job = {
+            "id": job_id,
+            "type": job_type,
+            "payload": json.dumps(payload, default=str),
+            "status": QUEUED,
+            "attempts": 0,
+            "max_attempts": max_attempts or self.max_attempts,
+            "dedup_key": dedup_key or "",
+            "error": "",
+            "result": "",
+            "created_at": now,
+            "updated_at": now,
         }
-        
-        # Crear y ejecutar la tarea
-        task = asyncio.create_task(self._run_task(task_id, coroutine))
-        asyncio.ensure_future(task)
-        
-        return task_id
-        
-    async def _run_task(self, task_id: str, coroutine: Coroutine):
-        """Ejecuta la tarea y actualiza su estado."""
+
+        if self.redis_client is not None:
+            # Sin respaldo en proceso: el trabajo no sería visible desde otros workers
+            return await self._enqueue_redis(job, dedup_key)
+        return self._enqueue_local(job, dedup_key)
+
+    async def _enqueue_redis(self, job: Dict[str, Any], dedup_key: Optional[str]) -> str:
+        if dedup_key:
+            dedup_redis_key = self._dedup_key(dedup_key)
+            ttl = self.lease_seconds * job["max_attempts"] * 2
+            acquired = await self.redis_client.set(
+                dedup_redis_key, job["id"], nx=True, ex=ttl
+            )
+            if not acquired:
+                existing_id = await self.redis_client.get(dedup_redis_key)
+                if existing_id:
+                    status = await self.redis_client.hget(
+                        self._job_key(existing_id), "status"
+                    )
+                    if status in ACTIVE_STATUSES:
+                        logger.info(
+                            f"Trabajo '{dedup_key}' ya activo ({existing_id}), no se duplica"
+                        )
+                        return existing_id
+                # El trabajo anterior terminó sin limpiar la clave: reemplazarla
+                await self.redis_client.set(dedup_redis_key, job["id"], ex=ttl)
+
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.hset(self._job_key(job["id"]), mapping=job)
+        pipe.lpush(self.queue_key, job["id"])
+        await pipe.execute()
+        logger.info(f"Trabajo {job['id']} ({job['type']}) encolado en Redis")
+        return job["id"]
+
+    # --- Consulta ---
+
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Estado de un trabajo (None si no existe o ya caducó)."""
+        job = self.local_jobs.get(job_id)
+        if job is None and self.redis_client is not None:
+            try:
+                job = await self.redis_client.hgetall(self._job_key(job_id)) or None
+            except Exception as e:
+                logger.error(f"Error consultando trabajo {job_id}: {e}")
+                return None
+        if not job:
+            return None
+
+        result = job.get("result")
+        return {
+            "id": job["id"],
+            "type": job["type"],
+            "status": job["status"],
+            "attempts": int(job.get("attempts", 0)),
+            "max_attempts": int(job.get("max_attempts", self.max_attempts)),
+            "payload": json.loads(job["payload"]) if job.get("payload") else {},
+            "result": json.loads(result) if result else None,
+            "error": job.get("error") or None,
+            "created_at": float(job["created_at"]),
+            "updated_at": float(job["updated_at"]),
+        }
+
+    # --- Consumidor (python -m app.worker o en proceso, ver app.main) ---
+
+    async def run_worker(
+        self, concurrency: int = 1, stop_event: Optional[asyncio.Event] = None
+    ):
+        """Consume trabajos de Redis hasta que se active `stop_event`."""
+        if self.redis_client is None:
+            raise RuntimeError("El worker de trabajos requiere JOB_QUEUE_BACKEND=redis")
+
+        stop_event = stop_event or asyncio.Event()
+        self._promote_script = self.redis_client.register_script(PROMOTE_DELAYED_LUA)
+        logger.info(
+            f"Worker de trabajos iniciado (concurrencia={concurrency}, "
+            f"tipos={sorted(self.handlers)})"
+        )
+
+        loops = [
+            asyncio.create_task(self._consume_loop(stop_event))
+            for _ in range(concurrency)
+        ]
+        loops.append(asyncio.create_task(self._maintenance_loop(stop_event)))
         try:
-            # Marcar como en ejecución
-            self.tasks[task_id]["status"] = "running"
-            
-            # Ejecutar la tarea
-            result = await coroutine
-            
-            # Actualizar con resultado exitoso
-            self.tasks[task_id]["status"] = "completed"
-            self.tasks[task_id]["result"] = result
-            
-            return result
+            await stop_event.wait()
+        finally:
+            # Los trabajos en curso terminan; los consumidores salen en su próximo ciclo
+            await asyncio.gather(*loops, return_exceptions=True)
+            logger.info("Worker de trabajos detenido")
+
+    async def _consume_loop(self, stop_event: asyncio.Event):
+        while not stop_event.is_set():
+            try:
+                job_id = await self.redis_client.brpoplpush(
+                    self.queue_key, self.processing_key, timeout=2
+                )
+            except Exception as e:
+                logger.error(f"Error leyendo la cola de trabajos: {e}")
+                await asyncio.sleep(2)
+                continue
+            if job_id:
+                await self._process(job_id)
+
+    async def _maintenance_loop(self, stop_event: asyncio.Event):
+        """Promueve reintentos diferidos y recupera trabajos de workers caídos."""
+        while not stop_event.is_set():
+            try:
+                await self._promote_script(
+                    keys=[self.delayed_key, self.queue_key], args=[time.time()]
+                )
+                await self._requeue_stale()
+            except Exception as e:
+                logger.error(f"Error en mantenimiento de la cola de trabajos: {e}")
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _requeue_stale(self):
+        """Devuelve a la cola los trabajos en proceso cuyo lease caducó (worker caído)."""
+        grace = 60
+        for job_id in await self.redis_client.lrange(self.processing_key, 0, -1):
+            if await self.redis_client.exists(self._lease_key(job_id)):
+                continue
+            updated_at = await self.redis_client.hget(self._job_key(job_id), "updated_at")
+            if updated_at and time.time() - float(updated_at) < grace:
+                continue
+            if await self.redis_client.lrem(self.processing_key, 1, job_id):
+                await self.redis_client.lpush(self.queue_key, job_id)
+                logger.warning(f"Trabajo {job_id} sin lease, devuelto a la cola")
+
+    async def _process(self, job_id: str):
+        job_key = self._job_key(job_id)
+        job = await self.redis_client.hgetall(job_key)
+        if not job:
+            await self.redis_client.lrem(self.processing_key, 1, job_id)
+            return
+
+        attempts = int(job.get("attempts", 0)) + 1
+        await self.redis_client.set(self._lease_key(job_id), "1", ex=self.lease_seconds)
+        await self.redis_client.hset(
+            job_key, mapping={"status": RUNNING, "attempts": attempts, "updated_at": time.time()}
+        )
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        try:
+            result = await self._execute(job)
+            await self.redis_client.hset(
+                job_key,
+                mapping={
+                    "status": COMPLETED,
+                    "result": json.dumps(result, default=str),
+                    "error": "",
+                    "updated_at": time.time(),
+                },
+            )
+            await self._finish(job, job_key)
+            logger.info(f"Trabajo {job_id} ({job['type']}) completado")
         except Exception as e:
-            logger.error(f"Error en tarea {task_id}: {str(e)}", exc_info=True)
-            
-            # Actualizar con error
-            self.tasks[task_id]["status"] = "failed"
-            self.tasks[task_id]["error"] = str(e)
-            
-            return None
-    
-    def get_task_status(self, task_id: str) -> Dict[str, Any]:
-        """Obtiene el estado actual de una tarea."""
-        if task_id not in self.tasks:
-            return {"status": "not_found"}
-        
-        return self.tasks[task_id]
-    
-    def clear_old_tasks(self, max_age_seconds: int = 3600):
-        """Limpia tareas antiguas completadas o fallidas."""
-        current_time = asyncio.get_event_loop().time()
-        
-        to_delete = []
-        for task_id, task_info in self.tasks.items():
-            if task_info["status"] in ["completed", "failed"]:
-                task_age = current_time - task_info["created_at"]
-                if task_age > max_age_seconds:
-                    to_delete.append(task_id)
-        
-        for task_id in to_delete:
-            del self.tasks[task_id]
+            error = str(e)[:500]
+            retryable = not isinstance(e, PermanentJobError)
+            if retryable and attempts < int(job.get("max_attempts", self.max_attempts)):
+                delay = self.retry_backoff * 2 ** (attempts - 1)
+                await self.redis_client.hset(
+                    job_key, mapping={"status": RETRYING, "error": error, "updated_at": time.time()}
+                )
+                await self.redis_client.zadd(self.delayed_key, {job_id: time.time() + delay})
+                logger.warning(
+                    f"Trabajo {job_id} falló (intento {attempts}), reintento en {delay:.0f}s: {error}"
+                )
+            else:
+                await self.redis_client.hset(
+                    job_key, mapping={"status": FAILED, "error": error, "updated_at": time.time()}
+                )
+                await self._finish(job, job_key)
+                logger.error(f"Trabajo {job_id} falló definitivamente: {error}")
+                await self._on_failure(job, error)
+        finally:
+            heartbeat.cancel()
+            await self.redis_client.delete(self._lease_key(job_id))
+            await self.redis_client.lrem(self.processing_key, 1, job_id)
+
+    async def _heartbeat(self, job_id: str):
+        """Renueva el lease mientras el trabajo sigue en ejecución."""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await self.redis_client.expire(self._lease_key(job_id), self.lease_seconds)
+            except Exception as e:
+                logger.warning(f"No se pudo renovar el lease de {job_id}: {e}")
+
+    async def _finish(self, job: Dict[str, Any], job_key: str):
+        """Caduca el estado del trabajo y libera la clave de deduplicación."""
+        await self.redis_client.expire(job_key, self.result_ttl)
+        dedup_key = job.get("dedup_key")
+        if dedup_key:
+            dedup_redis_key = self._dedup_key(dedup_key)
+            if await self.redis_client.get(dedup_redis_key) == job["id"]:
+                await self.redis_client.delete(dedup_redis_key)
+
+    async def _execute(self, job: Dict[str, Any]) -> Any:
+        handler = self.handlers.get(job["type"])
+        if handler is None:
+            raise PermanentJobError(f"Tipo de trabajo desconocido: {job['type']}")
+        return await handler(json.loads(job["payload"]))
+
+    async def _on_failure(self, job: Dict[str, Any], error: str):
+        on_failure = self.failure_handlers.get(job["type"])
+        if on_failure is None:
+            return
+        try:
+            await on_failure(json.loads(job["payload"]), error)
+        except Exception as e:
+            logger.error(f"Error en el handler de fallo de {job['id']}: {e}", exc_info=True)
+
+    # --- Backend local (JOB_QUEUE_BACKEND="local") ---
+
+    def _enqueue_local(self, job: Dict[str, Any], dedup_key: Optional[str]) -> str:
+        if dedup_key:
+            existing_id = self.local_dedup.get(dedup_key)
+            existing = self.local_jobs.get(existing_id) if existing_id else None
+            if existing and existing["status"] in ACTIVE_STATUSES:
+                return existing_id
+            self.local_dedup[dedup_key] = job["id"]
+
+        self._clear_old_local_jobs()
+        self.local_jobs[job["id"]] = job
+        task = asyncio.create_task(self._run_local(job))
+        # Mantener referencia hasta que termine (evita que el GC la cancele)
+        self._local_tasks.add(task)
+        task.add_done_callback(self._local_tasks.discard)
+        logger.info(f"Trabajo {job['id']} ({job['type']}) ejecutándose en proceso")
+        return job["id"]
+
+    async def _run_local(self, job: Dict[str, Any]):
+        max_attempts = int(job["max_attempts"])
+        while True:
+            job["attempts"] += 1
+            job.update(status=RUNNING, updated_at=time.time())
+            try:
+                result = await self._execute(job)
+                job.update(
+                    status=COMPLETED,
+                    result=json.dumps(result, default=str),
+                    error="",
+                    updated_at=time.time(),
+                )
+                break
+            except Exception as e:
+                error = str(e)[:500]
+                job.update(error=error, updated_at=time.time())
+                if isinstance(e, PermanentJobError) or job["attempts"] >= max_attempts:
+                    job["status"] = FAILED
+                    logger.error(f"Trabajo {job['id']} falló definitivamente: {error}")
+                    await self._on_failure(job, error)
+                    break
+                job["status"] = RETRYING
+                await asyncio.sleep(self.retry_backoff * 2 ** (job["attempts"] - 1))
+
+        if job["dedup_key"] and self.local_dedup.get(job["dedup_key"]) == job["id"]:
+            del self.local_dedup[job["dedup_key"]]
+
+    def _clear_old_local_jobs(self):
+        """Limpia trabajos locales terminados más antiguos que `result_ttl`."""
+        now = time.time()
+        expired = [
+            job_id
+            for job_id, job in self.local_jobs.items()
+            if job["status"] in (COMPLETED, FAILED)
+            and now - job["updated_at"] > self.result_ttl
+        ]
+        for job_id in expired:
+            del self.local_jobs[job_id]
+
+
+def create_task_queue() -> TaskQueue:
+    """Crea la cola según JOB_QUEUE_BACKEND ("redis" o "local")."""
+    redis_client = None
+    if settings.JOB_QUEUE_BACKEND == "redis":
+        from app.db.redis_client import redis_client
+    else:
+        logger.warning(
+            "Cola de trabajos local: los trabajos solo existen en este proceso "
+            "(no usar con varios workers ni en producción)"
+        )
+
+    return TaskQueue(
+        redis_client,
+        max_attempts=settings.JOB_MAX_ATTEMPTS,
+        retry_backoff=settings.JOB_RETRY_BACKOFF,
+        lease_seconds=settings.JOB_LEASE_SECONDS,
+        result_ttl=settings.JOB_RESULT_TTL,
+    )
+
 
 # Instancia global
-task_queue = TaskQueue()
\ No newline at end of file
+task_queue = create_task_queue()
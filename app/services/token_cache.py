@@ -0,0 +1,200 @@
+# app/services/token_cache.py
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set
+
+from app.config import settings
+
+logger = logging.getLogger("hydrous")
+
+# Canal de Redis por el que se difunden logouts e invalidaciones de sesiones
+INVALIDATION_CHANNEL = "auth:token_invalidations"
+
+
+class VerifiedTokenCache:
+    """
+    Caché en proceso de tokens ya verificados (jti -> datos del usuario).
+
+    - Las revocaciones de cualquier worker llegan por Redis pub/sub
+      (`TokenInvalidationSubscriber`) y se aplican al momento.
+    - Solo se sirven aciertos mientras la suscripción está activa: sin ella
+      no se recibirían revocaciones de otros workers.
+    - TTL corto como red de seguridad; tamaño acotado con expulsión LRU.
+    - Índice por usuario para invalidar todas sus sesiones.
+    """
+
+    def __init__(self, ttl: float = 30.0, max_size: int = 10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._by_user: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        # Lo activa el suscriptor de invalidaciones mientras está conectado
+        self.invalidations_live = False
+
+    def get(self, jti: str) -> Optional[Dict[str, Any]]:
+        """Devuelve una copia de los datos del usuario si el token sigue en caché."""
+        if self.ttl <= 0 or not self.invalidations_live:
+            return None
+        with self._lock:
+            entry = self._entries.get(jti)
+            if entry is None:
+                self._misses += 1
+                return None
+            if entry["expires_at"] <= time.monotonic():
+                self._remove(jti)
+                self._misses += 1
+                return None
+            self._entries.move_to_end(jti)
+            self._hits += 1
+            return dict(entry["user"])
+
+    def set(self, jti: str, user: Dict[str, Any], token_exp: Optional[float] = None):
+        """Guarda el resultado de una verificación (nunca más allá del exp del token)."""
+        if self.ttl <= 0 or not self.invalidations_live:
+            return
+        expires_at = time.monotonic() + self.ttl
+        if token_exp:
+            remaining = token_exp - time.time()
+            if remaining <= 0:
+                return
+            expires_at = min(expires_at, time.monotonic() + remaining)
+
+        with self._lock:
+            self._remove(jti)
+            self._entries[jti] = {"user": dict(user), "expires_at": expires_at}
+            self._by_user.setdefault(str(user.get("id")), set()).add(jti)
+            while len(self._entries) > self.max_size:
+                oldest_jti = next(iter(self._entries))
+                self._remove(oldest_jti)
+
+    def invalidate(self, jti: str):
+        """Elimina un token (logout)."""
+        with self._lock:
+            self._remove(jti)
+
+    def invalidate_user(self, user_id: str, exclude_jti: Optional[str] = None) -> int:
+        """Elimina todos los tokens en caché de un usuario, salvo `exclude_jti`."""
+        with self._lock:
+            jtis = [j for j in self._by_user.get(str(user_id), set()) if j != exclude_jti]
+            for jti in jtis:
+                self._remove(jti)
+            return len(jtis)
+
+    def apply_invalidation(self, message: Dict[str, Any]):
+        """Aplica una invalidación recibida por pub/sub (de este u otro worker)."""
+        if message.get("jti"):
+            self.invalidate(message["jti"])
+        elif message.get("user_id"):
+            self.invalidate_user(
+                message["user_id"], exclude_jti=message.get("exclude_jti")
+            )
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "invalidations_live": self.invalidations_live,
+            "hits": self._hits,
+            "misses": self._misses,
+        }
+
+    def _remove(self, jti: str):
+        """Quita una entrada (llamar con el lock tomado)."""
+        entry = self._entries.pop(jti, None)
+        if entry is None:
+            return
+        user_id = str(entry["user"].get("id"))
+        user_jtis = self._by_user.get(user_id)
+        if user_jtis is not None:
+            user_jtis.discard(jti)
+            if not user_jtis:
+                del self._by_user[user_id]
+
+
+class TokenInvalidationSubscriber:
+    """
+    Escucha INVALIDATION_CHANNEL y aplica cada mensaje a la caché del worker.
+
+    Mientras no hay suscripción (arranque, Redis caído) la caché queda vacía y
+    desactivada; al (re)conectar se vacía otra vez por si se perdió algún mensaje.
+    """
+
+    RECONNECT_DELAY = 5.0
+
+    def __init__(self, cache: VerifiedTokenCache):
+        self.cache = cache
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self.cache.ttl <= 0 or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._set_live(False)
+
+    def _set_live(self, live: bool):
+        self.cache.invalidations_live = live
+        self.cache.clear()
+
+    async def _run(self):
+        from app.db.redis_client import redis_client
+
+        while True:
+            pubsub = None
+            try:
+                pubsub = redis_client.pubsub()
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                self._set_live(True)
+                logger.info("Caché de tokens suscrita a invalidaciones")
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    try:
+                        self.cache.apply_invalidation(json.loads(message["data"]))
+                    except (ValueError, TypeError) as e:
+                        logger.warning(f"Invalidación de token no válida: {e}")
+                raise ConnectionError("suscripción cerrada")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._set_live(False)
+                logger.warning(
+                    f"Sin suscripción a invalidaciones de tokens ({e}): "
+                    f"caché desactivada, reintento en {self.RECONNECT_DELAY}s"
+                )
+                await asyncio.sleep(self.RECONNECT_DELAY)
+            finally:
+                if pubsub is not None:
+                    try:
+                        await pubsub.reset()
+                    except Exception:
+                        pass
+
+
+# Instancia global
+verified_token_cache = VerifiedTokenCache(
+    ttl=settings.AUTH_TOKEN_CACHE_TTL, max_size=settings.AUTH_TOKEN_CACHE_SIZE
+)
+token_invalidation_subscriber = TokenInvalidationSubscriber(verified_token_cache)
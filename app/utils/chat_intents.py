@@ -0,0 +1,33 @@
+# app/utils/chat_intents.py
+"""
+Tipos de mensaje de chat que no pasan por el LLM. Los usan las rutas de chat
+y el rate limiting (para no cobrarlos en el bucket "llm").
+"""
+
+# Mensaje que envía el frontend para recargar el historial sin procesar nada
+VERIFICATION_MESSAGE = "VERIFICACIÓN_SILENCIOSA"
+
+PDF_REQUEST_PHRASES = (
+    "descargar pdf",
+    "download pdf",
+    "obtener pdf",
+    "get pdf",
+    "pdf",
+    "descargar",
+    "download",
+    "quiero el pdf",
+    "quiero mi pdf",
+    "dame el pdf",
+    "dame mi pdf",
+)
+
+
+def is_pdf_request(message_content: str) -> bool:
+    """Determina si el mensaje del usuario es una solicitud de descarga del PDF."""
+    normalized = message_content.lower().strip()
+    return any(request in normalized for request in PDF_REQUEST_PHRASES)
+
+
+def skips_llm(message_content: str) -> bool:
+    """True si el mensaje se responde sin llamar al LLM (verificación o PDF)."""
+    return message_content == VERIFICATION_MESSAGE or is_pdf_request(message_content)
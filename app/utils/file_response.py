@@ -0,0 +1,131 @@
+# app/utils/file_response.py
+import hashlib
+import os
+import re
+from typing import Dict, Optional, Tuple
+
+import anyio
+from fastapi import Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+CHUNK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def file_etag(stat: os.stat_result) -> str:
+    """
+    ETag fuerte basado en mtime + tamaño. Solo es estable para el mismo archivo
+    en disco: si el contenido tiene una clave propia, mejor pasarla como `etag`.
+    """
+    digest = hashlib.md5(f"{stat.st_mtime_ns}-{stat.st_size}".encode()).hexdigest()
+    return f'"{digest}"'
+
+
+class RangeNotSatisfiable(Exception):
+    """Range de un solo intervalo válido pero fuera del archivo (→ 416)."""
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Interpreta un Range de un solo intervalo ("bytes=inicio-fin", "bytes=-sufijo").
+    Devuelve (inicio, fin) inclusivos, o None si el header no se soporta o no
+    se entiende (varios intervalos, sintaxis inválida): según RFC 7233 se
+    ignora y se sirve el archivo completo. Lanza RangeNotSatisfiable si el
+    intervalo es válido pero no cae dentro del archivo.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if start == "":
+        if end == "":
+            return None
+        if int(end) == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        start_pos = max(0, size - int(end))
+        end_pos = size - 1
+    else:
+        start_pos = int(start)
+        if end and int(end) < start_pos:
+            return None
+        if start_pos >= size:
+            raise RangeNotSatisfiable()
+        end_pos = min(int(end), size - 1) if end else size - 1
+    return start_pos, end_pos
+
+
+async def _iter_file_range(path: str, start: int, end: int):
+    async with await anyio.open_file(path, "rb") as f:
+        await f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def conditional_file_response(
+    request: Request,
+    path: str,
+    media_type: str,
+    headers: Optional[Dict[str, str]] = None,
+    etag: Optional[str] = None,
+) -> Response:
+    """
+    Sirve un archivo local con soporte de revalidación y descargas parciales:
+
+    - `If-None-Match` con el ETag actual → 304 sin cuerpo
+    - `Range` (un intervalo; respetando `If-Range`) → 206 con solo esos bytes
+    - Range de un intervalo fuera del archivo → 416
+    - En otro caso (también Range con varios intervalos o mal formado, que se
+      ignora) → 200 con el archivo completo
+
+    `etag` (ya entre comillas) sustituye al calculado con mtime + tamaño.
+    """
+    stat = os.stat(path)
+    etag = etag or file_etag(stat)
+    base_headers = {
+        **(headers or {}),
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        # El navegador guarda el PDF pero revalida siempre (puede regenerarse)
+        "Cache-Control": "private, no-cache",
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        candidates = {tag.strip() for tag in if_none_match.split(",")}
+        if etag in candidates or "*" in candidates:
+            return Response(status_code=304, headers=base_headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == etag):
+        try:
+            byte_range = _parse_range(range_header, stat.st_size)
+        except RangeNotSatisfiable:
+            return Response(
+                status_code=416,
+                headers={**base_headers, "Content-Range": f"bytes */{stat.st_size}"},
+            )
+    else:
+        byte_range = None
+
+    if byte_range is not None:
+        start, end = byte_range
+        return StreamingResponse(
+            _iter_file_range(path, start, end),
+            status_code=206,
+            media_type=media_type,
+            headers={
+                **base_headers,
+                "Content-Range": f"bytes {start}-{end}/{stat.st_size}",
+                "Content-Length": str(end - start + 1),
+            },
+        )
+
+    return FileResponse(
+        path=path, media_type=media_type, headers=base_headers, stat_result=stat
+    )
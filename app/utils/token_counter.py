@@ -1,53 +1,96 @@
 # Añadir en app/utils/token_counter.py
 
+import logging
+import threading
 import tiktoken
-from typing import List, Dict, Union, Any, Optional
+from typing import List, Dict, Union, Any, Iterable, Optional
+
+logger = logging.getLogger("hydrous")
+
+# Encoders por modelo: crear uno carga (y la primera vez descarga) el BPE,
+# así que se crean una sola vez por proceso
+_encoders: Dict[str, Any] = {}
+_encoders_lock = threading.Lock()
+
+
+def get_encoding(model: str):
+    """Encoder de tiktoken para el modelo (memoizado por proceso)."""
+    encoding = _encoders.get(model)
+    if encoding is not None:
+        return encoding
+    with _encoders_lock:
+        encoding = _encoders.get(model)
+        if encoding is None:
+            try:
+                encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                # Para modelos no reconocidos, usar cl100k_base (encodificación general para GPT-3.5/4)
+                encoding = tiktoken.get_encoding("cl100k_base")
+            _encoders[model] = encoding
+    return encoding
+
+
+def warm_encoders(models: Iterable[str]):
+    """Carga los encoders al arrancar para que la primera petición no pague el coste."""
+    for model in models:
+        try:
+            get_encoding(model)
+            logger.info(f"Encoder de tokens listo para {model}")
+        except Exception as e:
+            logger.warning(f"No se pudo cargar el encoder de tokens para {model}: {e}")
+
+
+def _uses_chat_overhead(model: str) -> bool:
+    return model.startswith(("gpt-3.5", "gpt-4"))
+
+
+def count_message_tokens(
+    role: str, content: str, model: str = "gpt-3.5-turbo", name: Optional[str] = None
+) -> int:
+    """
+    Tokens de un solo mensaje (sin el overhead de la respuesta). Es el valor que
+    se guarda en cada mensaje para no re-tokenizar el historial en cada turno.
+    """
+    encoding = get_encoding(model)
+    if not _uses_chat_overhead(model):
+        return len(encoding.encode(content))
+
+    # Cada mensaje sigue <im_start>{role/name}\n{content}<im_end>\n
+    num_tokens = 4 + len(encoding.encode(role)) + len(encoding.encode(content))
+    if name is not None:
+        num_tokens += len(encoding.encode(name)) + 1  # Si hay un nombre, se añade 1 token
+    return num_tokens
 
 
-def count_tokens(messages: List[Dict[str, str]], model: str = "gpt-3.5-turbo") -> int:
+def count_tokens(messages: List[Dict[str, Any]], model: str = "gpt-3.5-turbo") -> int:
     """
     Cuenta de forma precisa el número de tokens en una lista de mensajes para un modelo específico
 
     Args:
         messages: Lista de mensajes en formato {"role": "...", "content": "..."}
+                  (si traen "token_count" se usa ese valor sin re-tokenizar)
         model: Nombre del modelo para el que contar tokens
 
     Returns:
         int: Número de tokens
     """
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        # Para modelos no reconocidos, usar cl100k_base (encodificación general para GPT-3.5/4)
-        encoding = tiktoken.get_encoding("cl100k_base")
-
     num_tokens = 0
-
-    # Constantes para diferentes modelos
-    if model.startswith(("gpt-3.5", "gpt-4")):
-        # Cada mensaje tiene un overhead de tokens
-        tokens_per_message = (
-            4  # Cada mensaje sigue <im_start>{role/name}\n{content}<im_end>\n
+    for message in messages:
+        cached = message.get("token_count")
+        if cached is not None:
+            num_tokens += cached
+            continue
+        num_tokens += count_message_tokens(
+            message.get("role", ""),
+            message.get("content") or "",
+            model=model,
+            name=message.get("name"),
         )
-        tokens_per_name = 1  # Si hay un nombre, se añade 1 token
-
-        for message in messages:
-            num_tokens += tokens_per_message
-            for key, value in message.items():
-                num_tokens += len(encoding.encode(value))
-                if key == "name":
-                    num_tokens += tokens_per_name
 
+    if _uses_chat_overhead(model):
         # Cada respuesta tiene un overhead de tokens
         num_tokens += 3  # Cada respuesta es precedida por <im_start>assistant
 
-    else:
-        # Para otros modelos, simplemente sumamos los tokens de cada mensaje
-        for message in messages:
-            for key, value in message.items():
-                if key == "content":
-                    num_tokens += len(encoding.encode(value))
-
     return num_tokens
 
 
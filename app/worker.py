@@ -0,0 +1,51 @@
+# app/worker.py
+"""
+Worker de trabajos en segundo plano (generación de propuestas).
+
+Uso:
+    python -m app.worker
+
+Consume la cola de Redis (JOB_QUEUE_BACKEND=redis). Debe compartir
+UPLOAD_DIR con la API para que los PDFs generados estén disponibles.
+Sin este servicio, JOB_WORKER_IN_PROCESS=true consume la misma cola dentro
+de cada worker de la API (ver app.main).
+"""
+import asyncio
+import signal
+
+from app.config import settings
+from app.core.logging_config import get_logger
+from app.db.base import async_engine
+from app.db.migrate import check_schema_version
+from app.services.llm_http_client import llm_http_client
+from app.services.pdf_render_pool import pdf_render_pool
+from app.services.task_queue import task_queue
+from app.utils.token_counter import warm_encoders
+
+# Registra los handlers de trabajos
+import app.services.proposal_jobs  # noqa: F401
+
+logger = get_logger("hydrous")
+
+
+async def main():
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    await check_schema_version()
+    await llm_http_client.start()
+    await asyncio.to_thread(warm_encoders, [settings.MODEL])
+    try:
+        await task_queue.run_worker(
+            concurrency=settings.JOB_WORKER_CONCURRENCY, stop_event=stop_event
+        )
+    finally:
+        await llm_http_client.close()
+        pdf_render_pool.close()
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -70,16 +70,21 @@ docker tag $ECR_REPOSITORY_NAME:latest $ECR_REPOSITORY_URI:latest || print_error
 docker push $ECR_REPOSITORY_URI:latest || print_error "Error al subir la imagen a ECR"
 print_success "Imagen subida a ECR correctamente"
 
-# Paso 5: Forzar nuevo despliegue en ECS
+# Paso 5: Aplicar migraciones (una tarea ECS por despliegue, antes de los contenedores nuevos)
+print_step "Aplicando migraciones de la base de datos"
+./infra/scripts/run-migrations.sh $ECS_CLUSTER_NAME $ECS_SERVICE_NAME $AWS_REGION || print_error "Error al aplicar las migraciones"
+print_success "Migraciones aplicadas"
+
+# Paso 6: Forzar nuevo despliegue en ECS
 print_step "Actualizando servicio ECS"
 aws ecs update-service --cluster $ECS_CLUSTER_NAME --service $ECS_SERVICE_NAME --force-new-deployment --region $AWS_REGION || print_error "Error al actualizar el servicio ECS"
 print_success "Servicio ECS actualizado correctamente. El despliegue está en proceso..."
 
-# Paso 6: Monitorear el despliegue
+# Paso 7: Monitorear el despliegue
 print_step "Monitoreo del despliegue"
 echo "Puedes verificar el estado del despliegue en la consola AWS ECS o ejecutando:"
 echo "aws ecs describe-services --cluster $ECS_CLUSTER_NAME --services $ECS_SERVICE_NAME --region $AWS_REGION"
 
 print_success "¡Proceso de despliegue iniciado exitosamente!"
 echo "La aplicación estará disponible en unos minutos en: https://api.h2oassistant.com"
-echo "Recuerda verificar los logs en CloudWatch para asegurarte de que las tablas se inicializaron correctamente."
+echo "Los logs de la tarea de migración están en CloudWatch junto a los de la API."
@@ -79,12 +79,17 @@ print_success "Imagen subida a ECR correctamente como $ECR_REPOSITORY_URI:$VERSI
 echo "$(date +"%Y-%m-%d %H:%M:%S") - Versión $VERSION desplegada - Task: $CURRENT_TASK_DEF" >> $DEPLOY_LOG_DIR/deploy-history.log
 print_success "Historial de despliegue actualizado"
 
-# Paso 6: Forzar nuevo despliegue en ECS
+# Paso 6: Aplicar migraciones (una tarea ECS por despliegue, antes de los contenedores nuevos)
+print_step "Aplicando migraciones de la base de datos"
+./infra/scripts/run-migrations.sh $ECS_CLUSTER_NAME $ECS_SERVICE_NAME $AWS_REGION || print_error "Error al aplicar las migraciones"
+print_success "Migraciones aplicadas"
+
+# Paso 7: Forzar nuevo despliegue en ECS
 print_step "Actualizando servicio ECS"
 aws ecs update-service --cluster $ECS_CLUSTER_NAME --service $ECS_SERVICE_NAME --force-new-deployment --region $AWS_REGION || print_error "Error al actualizar el servicio ECS"
 print_success "Servicio ECS actualizado correctamente. El despliegue está en proceso..."
 
-# Paso 7: Instrucciones de monitoreo y rollback
+# Paso 8: Instrucciones de monitoreo y rollback
 echo ""
 print_step "Monitoreo y Rollback"
 echo "Para monitorear el despliegue, ejecuta:"
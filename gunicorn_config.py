@@ -2,8 +2,17 @@
 # Configuración para Gunicorn + Uvicorn
 
 # Número de workers basado en núcleos de CPU (ajusta según tu servidor)
+# Cada worker abre como máximo DB_POOL_SIZE + DB_MAX_OVERFLOW conexiones de BD
+# (ambos motores juntos): dimensionar con GUNICORN_WORKERS según el límite de RDS
+import gc
 import multiprocessing
-workers = multiprocessing.cpu_count() * 2 + 1
+import os
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+
+# Cargar la app en el master antes del fork: cuestionario, prompts, plantillas
+# y encoders se cargan una vez y los workers comparten esas páginas de memoria.
+# Las conexiones de BD/Redis se abren después del fork (ver post_fork)
+preload_app = os.getenv("GUNICORN_PRELOAD", "True").lower() in ("true", "1", "t")
 
 # Usar el worker de Uvicorn
 worker_class = 'uvicorn.workers.UvicornWorker'
@@ -20,11 +29,31 @@ bind = '0.0.0.0:8000'
 # Nivel de log
 loglevel = 'info'
 
-# Archivo de logs
-accesslog = 'gunicorn_access.log'
-errorlog = 'gunicorn_error.log'
+# Archivo de logs ("-" = stdout/stderr, lo que usa la imagen de producción)
+accesslog = os.getenv("GUNICORN_ACCESSLOG", 'gunicorn_access.log')
+errorlog = os.getenv("GUNICORN_ERRORLOG", 'gunicorn_error.log')
 
 # Configuración para manejo de múltiples peticiones
 worker_connections = 1000
 max_requests = 1000
 max_requests_jitter = 50
+
+
+def when_ready(server):
+    """En el master, con la app ya importada y antes de crear los workers."""
+    if not server.cfg.preload_app:
+        return
+    from app.core.preload import prepare_for_fork, warm_shared_state
+
+    warm_shared_state()
+    prepare_for_fork()
+    # Sacar los objetos cargados del GC para que no se copien al recolectar en los workers
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    """En cada worker recién creado: pools de conexiones propios."""
+    if server.cfg.preload_app:
+        from app.core.preload import reset_after_fork
+
+        reset_after_fork()
@@ -19,23 +19,27 @@ NC='\033[0m' # No Color
 echo -e "${YELLOW}Iniciando despliegue de H₂O Allegiant...${NC}"
 
 # 1. Autenticación con ECR
-echo -e "\n${YELLOW}[1/5] Autenticando con Amazon ECR...${NC}"
+echo -e "\n${YELLOW}[1/6] Autenticando con Amazon ECR...${NC}"
 aws ecr get-login-password --region $AWS_REGION | docker login --username AWS --password-stdin $AWS_ACCOUNT_ID.dkr.ecr.$AWS_REGION.amazonaws.com
 
 # 2. Construir la imagen Docker
-echo -e "\n${YELLOW}[2/5] Construyendo imagen Docker...${NC}"
+echo -e "\n${YELLOW}[2/6] Construyendo imagen Docker...${NC}"
 docker build -t $ECR_REPOSITORY:latest -f Dockerfile.prod .
 
 # 3. Etiquetar la imagen
-echo -e "\n${YELLOW}[3/5] Etiquetando imagen...${NC}"
+echo -e "\n${YELLOW}[3/6] Etiquetando imagen...${NC}"
 docker tag $ECR_REPOSITORY:latest $AWS_ACCOUNT_ID.dkr.ecr.$AWS_REGION.amazonaws.com/$ECR_REPOSITORY:latest
 
 # 4. Subir la imagen a ECR
-echo -e "\n${YELLOW}[4/5] Subiendo imagen a ECR...${NC}"
+echo -e "\n${YELLOW}[4/6] Subiendo imagen a ECR...${NC}"
 docker push $AWS_ACCOUNT_ID.dkr.ecr.$AWS_REGION.amazonaws.com/$ECR_REPOSITORY:latest
 
-# 5. Actualizar el servicio ECS
-echo -e "\n${YELLOW}[5/5] Actualizando servicio ECS...${NC}"
+# 5. Aplicar migraciones (una tarea ECS por despliegue, antes de los contenedores nuevos)
+echo -e "\n${YELLOW}[5/6] Aplicando migraciones de la base de datos...${NC}"
+"$(dirname "$0")/run-migrations.sh" $ECS_CLUSTER $ECS_SERVICE $AWS_REGION
+
+# 6. Actualizar el servicio ECS
+echo -e "\n${YELLOW}[6/6] Actualizando servicio ECS...${NC}"
 aws ecs update-service --cluster $ECS_CLUSTER --service $ECS_SERVICE --force-new-deployment --region $AWS_REGION
 
 echo -e "\n${GREEN}¡Despliegue completado con éxito!${NC}"
@@ -0,0 +1,51 @@
+#!/bin/bash
+# Aplica las migraciones de Alembic una vez por despliegue, como tarea ECS
+# aislada (python -m app.db.migrate), antes de actualizar el servicio.
+#
+# Uso: infra/scripts/run-migrations.sh <cluster> <servicio> [región]
+#
+# Usa la definición de tarea y la red del servicio (la imagen :latest recién
+# subida). Termina con error si la tarea de migración no sale con código 0.
+
+set -e
+
+ECS_CLUSTER="$1"
+ECS_SERVICE="$2"
+AWS_REGION="${3:-us-east-1}"
+
+if [ -z "$ECS_CLUSTER" ] || [ -z "$ECS_SERVICE" ]; then
+    echo "Uso: $0 <cluster> <servicio> [región]"
+    exit 1
+fi
+
+# Definición de tarea, contenedor y red del servicio
+TASK_DEF=$(aws ecs describe-services --cluster "$ECS_CLUSTER" --services "$ECS_SERVICE" --region "$AWS_REGION" --query 'services[0].taskDefinition' --output text)
+CONTAINER_NAME=$(aws ecs describe-task-definition --task-definition "$TASK_DEF" --region "$AWS_REGION" --query 'taskDefinition.containerDefinitions[0].name' --output text)
+NETWORK_CONFIG=$(aws ecs describe-services --cluster "$ECS_CLUSTER" --services "$ECS_SERVICE" --region "$AWS_REGION" --query 'services[0].networkConfiguration' --output json)
+
+echo "Lanzando tarea de migración ($TASK_DEF, contenedor $CONTAINER_NAME)..."
+TASK_ARN=$(aws ecs run-task \
+    --cluster "$ECS_CLUSTER" \
+    --task-definition "$TASK_DEF" \
+    --launch-type FARGATE \
+    --network-configuration "$NETWORK_CONFIG" \
+    --overrides "{\"containerOverrides\":[{\"name\":\"$CONTAINER_NAME\",\"command\":[\"python\",\"-m\",\"app.db.migrate\"]}]}" \
+    --region "$AWS_REGION" \
+    --query 'tasks[0].taskArn' --output text)
+
+if [ -z "$TASK_ARN" ] || [ "$TASK_ARN" = "None" ]; then
+    echo "No se pudo lanzar la tarea de migración"
+    exit 1
+fi
+
+echo "Esperando a que termine la tarea $TASK_ARN..."
+aws ecs wait tasks-stopped --cluster "$ECS_CLUSTER" --tasks "$TASK_ARN" --region "$AWS_REGION"
+
+EXIT_CODE=$(aws ecs describe-tasks --cluster "$ECS_CLUSTER" --tasks "$TASK_ARN" --region "$AWS_REGION" --query 'tasks[0].containers[0].exitCode' --output text)
+if [ "$EXIT_CODE" != "0" ]; then
+    REASON=$(aws ecs describe-tasks --cluster "$ECS_CLUSTER" --tasks "$TASK_ARN" --region "$AWS_REGION" --query 'tasks[0].stoppedReason' --output text)
+    echo "La migración falló (código $EXIT_CODE: $REASON). Revisa los logs en CloudWatch."
+    exit 1
+fi
+
+echo "Migraciones aplicadas correctamente"
@@ -24,5 +24,11 @@ if [ -n "$REDIS_URL" ]; then
     fi
 fi
 
+# Aplicar migraciones de Alembic antes de arrancar (si se solicita)
+if [ "$RUN_MIGRATIONS" = "true" ]; then
+    echo "Aplicando migraciones de la base de datos..."
+    python -m app.db.migrate
+fi
+
 # Ejecutar el comando pasado a este script
 exec "$@"
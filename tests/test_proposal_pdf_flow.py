@@ -0,0 +1,146 @@
+# tests/test_proposal_pdf_flow.py
+"""
+Ida y vuelta de la propuesta: se encola, el trabajo termina y, con la
+conversación recargada, pedir el PDF devuelve el enlace de descarga.
+
+La BD se sustituye por un almacén en memoria que reproduce lo que hace
+`StorageService._write_conversation`: las claves con columna propia
+(has_proposal, pdf_path, is_complete, ...) no vuelven en la metadata al cargar.
+"""
+import asyncio
+import copy
+from contextlib import asynccontextmanager
+
+from fastapi import BackgroundTasks
+
+from app.models.conversation import Conversation
+from app.models.message import Message
+from app.routes import chat
+from app.services import pdf_cache as pdf_cache_module
+from app.services import proposal_jobs
+from app.services.pdf_cache import pdf_cache
+from app.services.task_queue import COMPLETED, TaskQueue
+
+# Claves que _write_conversation guarda en columnas de `conversations`
+COLUMN_KEYS = {
+    "selected_sector",
+    "selected_subsector",
+    "current_question_id",
+    "is_complete",
+    "has_proposal",
+    "client_name",
+    "proposal_text",
+    "pdf_path",
+}
+
+CONVERSATION_ID = "3f2b7c1e-9d4a-4e0b-8f6a-1c2d3e4f5a6b"
+USER_ID = "8a7b6c5d-4e3f-4a1b-9c8d-7e6f5a4b3c2d"
+
+
+class InMemorySession:
+    """Sustituye a ConversationSession: flush guarda solo la tabla de metadata."""
+
+    def __init__(self, store, conversation: Conversation):
+        self.store = store
+        self.conversation = conversation
+
+    @property
+    def metadata(self):
+        return self.conversation.metadata
+
+    def add_message(self, message: Message):
+        self.conversation.add_message(message)
+
+    async def flush(self, db) -> bool:
+        self.store.save(self.conversation)
+        return True
+
+
+class InMemoryStorage:
+    def __init__(self):
+        self.metadata = {}
+        self.messages = []
+
+    def save(self, conversation: Conversation):
+        self.metadata = {
+            key: copy.deepcopy(value)
+            for key, value in conversation.metadata.items()
+            if key not in COLUMN_KEYS
+        }
+        self.messages = list(conversation.messages)
+
+    async def open_session(self, conversation_id, db, user_id=None):
+        conversation = Conversation(
+            id=conversation_id,
+            user_id=USER_ID,
+            messages=list(self.messages),
+            metadata=copy.deepcopy(self.metadata),
+        )
+        return InMemorySession(self, conversation)
+
+
+@asynccontextmanager
+async def _no_db():
+    yield None
+
+
+def test_pdf_request_after_proposal_job_completes(monkeypatch, tmp_path):
+    storage = InMemoryStorage()
+    queue = TaskQueue(None)
+    queue.register(
+        proposal_jobs.GENERATE_PROPOSAL,
+        proposal_jobs.generate_proposal_job,
+        on_failure=proposal_jobs.on_proposal_failed,
+    )
+
+    async def fake_generate(conversation):
+        # Igual que DirectProposalGenerator: PDF en la caché por clave de contenido
+        rendered = tmp_path / "rendered.pdf"
+        rendered.write_bytes(b"%PDF-1.4 propuesta")
+        conversation.metadata["pdf_key"] = "a" * 64
+        return await pdf_cache.put(conversation.metadata["pdf_key"], str(rendered))
+
+    monkeypatch.setattr(proposal_jobs, "task_queue", queue)
+    monkeypatch.setattr(proposal_jobs, "storage_service", storage)
+    monkeypatch.setattr(proposal_jobs, "AsyncSessionLocal", _no_db)
+    monkeypatch.setattr(
+        proposal_jobs.direct_proposal_generator,
+        "generate_complete_proposal",
+        fake_generate,
+    )
+    monkeypatch.setattr(pdf_cache, "cache_dir", str(tmp_path / "cache"))
+    monkeypatch.setattr(pdf_cache_module.s3_service, "S3_BUCKET", None)
+    (tmp_path / "cache").mkdir()
+
+    async def scenario():
+        # Cuestionario terminado: propuesta pedida
+        conversation = Conversation(id=CONVERSATION_ID, user_id=USER_ID)
+        conversation.metadata.update(is_complete=True, proposal_status="queued")
+        storage.save(conversation)
+
+        # Encolar y esperar a que el trabajo termine
+        job_id = await proposal_jobs.enqueue_proposal(CONVERSATION_ID, USER_ID)
+        for _ in range(100):
+            job = await queue.get_job(job_id)
+            if job["status"] == COMPLETED:
+                break
+            await asyncio.sleep(0.01)
+        assert job["status"] == COMPLETED
+
+        # Pedir el PDF con la conversación recargada
+        session = await storage.open_session(CONVERSATION_ID, None)
+        assert "has_proposal" not in session.metadata
+        return await chat._process_message(
+            session,
+            CONVERSATION_ID,
+            "download pdf",
+            {"id": USER_ID},
+            BackgroundTasks(),
+            None,
+        )
+
+    response = asyncio.run(scenario())
+
+    assert response["action"] == "download_proposal_pdf"
+    assert response["download_url"].endswith(f"/chat/{CONVERSATION_ID}/download-pdf")
+    assert storage.metadata["proposal_status"] == "ready"